@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+The contact schema, after the datastore/us-500 records.
+
+Every field is an optional string with a maximum length and, for the fields
+with a well known shape, a pattern; firstName and lastName are required in
+complete contacts (POST, PUT and bulk adds). Other fields are rejected, so
+documents stay the size and shape reads expect, except the read-only fields
+responses hold, _id and updatedAt: they are accepted, whatever their value,
+and dropped, so a client can send back the attributes it read.
+
+The schema is compiled once, at import, into one check per field: the
+patterns are compiled and bound, and the allowed and required field names
+are frozen sets, so validating a body is a dict walk with no lookups into
+the schema itself.
+"""
+import re
+from collections import namedtuple
+from typing import Callable, Dict, List
+
+import falcon
+
+# A schema field.
+#   max_length: max length of the value
+#   pattern: regular expression the whole value must match, or None
+Field = namedtuple('Field', 'max_length pattern')
+
+_NAME = Field(50, None)
+_PHONE = Field(20, r'[0-9+(). -]{7,20}')
+
+CONTACT_SCHEMA = dict(
+    firstName=_NAME,
+    lastName=_NAME,
+    companyName=Field(100, None),
+    address=Field(100, None),
+    city=_NAME,
+    county=_NAME,
+    state=Field(2, r'[A-Z]{2}'),
+    # us-500 drops the leading zeros of some codes, e.g. '8014'
+    zip=Field(10, r'[0-9]{1,5}(-[0-9]{4})?'),
+    phone1=_PHONE,
+    phone2=_PHONE,
+    email=Field(254, r'[^@\s]+@[^@\s]+\.[^@\s]+'),
+    website=Field(200, r'https?://\S+'),
+)
+CONTACT_REQUIRED = ('firstName', 'lastName')
+# Set by the service; ignored in request bodies
+CONTACT_READ_ONLY = ('_id', 'updatedAt')
+
+
+class Validator(object):
+    """ A schema compiled to one check per field """
+    def __init__(self, schema: Dict[str, Field], required: tuple = (), read_only: tuple = ()):
+        self._checks = {name: self._compile(name, field) for name, field in schema.items()}
+        self._required = frozenset(required)
+        self._read_only = frozenset(read_only)
+
+    def errors(self, body: object, partial: bool = False) -> List[str]:
+        """
+        Why body is not a valid document, empty if it is. A partial document
+        (e.g. for PATCH) may omit required fields but must set at least one.
+        """
+        if not isinstance(body, dict):
+            return ['The body must be a JSON object']
+        if partial and self._read_only.issuperset(body):
+            return ['The body must set at least one field']
+        result = []
+        checks = self._checks
+        for name, value in body.items():
+            check = checks.get(name)
+            if check is None:
+                if name in self._read_only:
+                    continue
+                result.append('"{}" is not a contact field'.format(name))
+                continue
+            error = check(value)
+            if error is not None:
+                result.append(error)
+        if not partial and not self._required.issubset(body):
+            result.extend('"{}" is required'.format(name)
+                          for name in sorted(self._required.difference(body)))
+        return result
+
+    def writable(self, body: Dict) -> Dict:
+        """ body without its read-only fields """
+        if self._read_only.isdisjoint(body):
+            return body
+        return {name: value for name, value in body.items() if name not in self._read_only}
+
+    def validate(self, body: object, partial: bool = False) -> None:
+        """ Raise ValueError with every reason body is not a valid document """
+        errors = self.errors(body, partial)
+        if errors:
+            raise ValueError('; '.join(errors))
+
+    @staticmethod
+    def _compile(name: str, field: Field) -> Callable[[object], str]:
+        """ A function returning why a value is invalid for the field, None if it is valid """
+        max_length = field.max_length
+        match = re.compile(field.pattern).fullmatch if field.pattern else None
+        too_long = '"{}" must be at most {} characters'.format(name, max_length)
+        mismatch = '"{}" must match {}'.format(name, field.pattern)
+        not_string = '"{}" must be a string'.format(name)
+
+        def check(value: object) -> str:
+            if not isinstance(value, str):
+                return not_string
+            if len(value) > max_length:
+                return too_long
+            if match is not None and match(value) is None:
+                return mismatch
+            return None
+        return check
+
+
+CONTACT = Validator(CONTACT_SCHEMA, CONTACT_REQUIRED, CONTACT_READ_ONLY)
+
+
+def validate_contact(req: falcon.Request, _: falcon.Response, __, ___) -> None:
+    """
+    falcon.before hook validating req.context['body_json'] as a contact:
+    partially for PATCH, completely otherwise, and drops its read-only
+    fields. Raises 400 listing every problem found.
+    """
+    body = req.context.get('body_json')
+    errors = CONTACT.errors(body, partial=req.method == 'PATCH')
+    if errors:
+        raise falcon.HTTPBadRequest(title='Invalid contact', description='; '.join(errors))
+    req.context['body_json'] = CONTACT.writable(body)
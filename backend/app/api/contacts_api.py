@@ -7,10 +7,13 @@ this will divide a single resource into operations on the collection and
 collection items. We use:
     * Contacts: for operations on the entire contacts collection
     * Contact: for operations on a single contact item
+    * ContactsSearch: for contact search
+    * ContactsWrites: for the status of queued creates
 
 ReST API classes:
 Classes in the api directory are responsible for
-    * request parameter validation
+    * request parameter validation; contact bodies are validated against the
+      contact schema (see contact_schema) by a before hook
     * response encoding
     * exception handling
 
@@ -37,32 +40,49 @@ Examples:
             }
         },
 
+Conditional requests:
+    * GET responses for contacts and collection pages carry a strong ETag; a
+      matching If-None-Match returns 304 Not Modified without a body
+    * PATCH and PUT honor If-Match: the update is applied only if the contact
+      still matches the ETag the client read, otherwise 412 Precondition Failed
+
 Logging:
     * Each class is subclassed from the LoggerMixin which exposes protected
       members for logging. The logging mixins add information about the class
       to the log entry.
 """
 from typing import Union, List, Dict
+from urllib.parse import urlencode
 
 import falcon
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING
 
-from ..common.json_api import make_response
+from ..common import etag, json_codec
+from ..common.config import env_int
+from ..common.json_api import make_response, stream_response
 from ..common.logging import LoggerMixin
 from ..controller.contacts_controller import ContactsController
+from ..repository.contacts_repository import BulkOperation, ContactsRepoMongo, ListQuery
+from ..repository.write_behind import InsertQueue
+from . import contact_schema
 
 
 class _ContactsApi(LoggerMixin):
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 1000
 
-    def __init__(self):
-        self._controller = ContactsController()
+    def __init__(self, controller: ContactsController = None):
+        self._controller = controller if controller is not None else ContactsController()
 
     @staticmethod
-    def _validate_contact(_: falcon.Request, __: falcon.Response, ___, ____):
+    def _validate_contact(req: falcon.Request, resp: falcon.Response, resource, params):
         """
-        Validate create contact params.
+        Validate the contact in the request body against the contact schema,
+        partially for PATCH.
 
         Example:
-            This will normally be attached to the on_post, on_put methods via a before hook::
+            This is attached to the on_post, on_put and on_patch methods via a before hook::
 
                 @falcon.before(_ContactsApi._validate_contact)
 
@@ -78,28 +98,348 @@ class _ContactsApi(LoggerMixin):
             Raises a falcon.HTTPBadRequest on validation error with explanation
             in response body.
         """
-        # perform validation and if failure ->
-        msg = 'Image type not allowed. Must be PNG, JPEG, or GIF'
-        raise falcon.HTTPBadRequest('Bad request', msg)
+        contact_schema.validate_contact(req, resp, resource, params)
 
-    def _make_response(self, data: Union[Dict, List[Dict]]) -> str:
+    def _make_response(self, data: Union[Dict, List[Dict]], links: Dict = None,
+                       meta: Dict = None) -> str:
         """ Return JSON respresentation for the data object """
-        return make_response('contacts', '_id', data)
+        return make_response('contacts', '_id', data, links, meta)
+
+    def _get_page_size(self, req: falcon.Request) -> int:
+        """ The requested page size, limited to MAX_PAGE_SIZE """
+        page_size = req.get_param_as_int('page[size]')
+        if page_size is None:
+            return self.DEFAULT_PAGE_SIZE
+        if page_size < 1:
+            raise falcon.HTTPInvalidParam('The value must be at least 1', 'page[size]')
+        return min(page_size, self.MAX_PAGE_SIZE)
+
+    @staticmethod
+    def _set_body(req: falcon.Request, resp: falcon.Response, body: str) -> None:
+        """
+        Set the response body and its ETag, or 304 Not Modified without a body
+        when the client's If-None-Match shows it already has this body.
+        """
+        resp.etag = etag.make_etag(body)
+        if etag.matches(req.get_header('If-None-Match'), resp.etag, weak=True):
+            resp.status = falcon.HTTP_NOT_MODIFIED
+        else:
+            resp.text = body
 
 
 class ContactsApi(_ContactsApi):
-    """Handler for collection operations"""
+    """
+    Handler for collection operations
+
+    GET returns one page of contacts in _id order using keyset pagination::
+
+        GET /contacts?page[size]=50&page[after]=5970fc55f33a80de48ba7a54
+
+    page[size] defaults to DEFAULT_PAGE_SIZE and is capped at MAX_PAGE_SIZE so
+    each response is bounded regardless of collection size. When more contacts
+    exist, the response links.next holds the url of the next page.
+
+    Contacts may be filtered and sorted on the indexed FILTER_FIELDS, and the
+    attributes returned limited to a sparse fieldset::
+
+        GET /contacts?filter[state]=MO,KS&sort=lastName,-companyName&fields[contacts]=firstName,lastName
+
+    Comma separated filter values match any of the values; a '-' prefix sorts
+    descending. Contacts with equal sort keys are ordered by _id.
+
+    POST creates a contact and returns 201 with its id. With
+    CONTACTS_WRITE_BEHIND=1 the contact is queued for a batched insert instead
+    and POST returns 202 with the id it will have; GET /contacts/writes reports
+    contacts that could not be written.
+    """
+    FILTER_FIELDS = ContactsRepoMongo.INDEXED_FIELDS
+    FIELDS = ('firstName', 'lastName', 'companyName', 'address', 'city', 'county', 'state',
+              'zip', 'phone1', 'phone2', 'email', 'website')
+
+    def __init__(self, controller: ContactsController = None):
+        super(ContactsApi, self).__init__(controller)
+        self._write_behind = env_int('CONTACTS_WRITE_BEHIND', 0) > 0
 
     def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
-        data = self._controller.get_list(req)
-        resp.body = self._make_response(data)
+        page_size = self._get_page_size(req)
+        # Ask for one extra contact to learn whether there is a next page
+        data = self._controller.get_list(req, page_size + 1, req.get_param('page[after]'),
+                                         self._get_list_query(req))
+        self._set_page(req, resp, data, page_size)
 
+    @falcon.before(_ContactsApi._validate_contact)
     def on_post(self, req: falcon.Request, resp: falcon.Response):
+        if self._write_behind:
+            self._set_queued(req, resp, self._controller.queue_item(req))
+            return
         object_id = self._controller.create_item(req)
         data = dict(_id=object_id)
-        resp.body = self._make_response(data)
+        resp.text = self._make_response(data)
         resp.status = falcon.HTTP_201
 
+    def _set_queued(self, req: falcon.Request, resp: falcon.Response, object_id: str) -> None:
+        """ 202 Accepted: the contact will be written with object_id """
+        status = '{}{}/writes?id={}'.format(req.prefix, req.path, object_id)
+        resp.text = self._make_response(dict(_id=object_id), dict(status=status))
+        resp.status = falcon.HTTP_202
+
+    def _set_page(self, req: falcon.Request, resp: falcon.Response,
+                  data: List[Dict], page_size: int) -> None:
+        """ Set the body to one page of data, read with a limit of page_size + 1 """
+        links = None
+        if len(data) > page_size:
+            data = data[:page_size]
+            links = dict(next=self._make_page_link(req, page_size, str(data[-1]['_id'])))
+        self._set_body(req, resp, self._make_response(data, links))
+
+    def _get_list_query(self, req: falcon.Request) -> ListQuery:
+        """ The filter[...], sort and fields[contacts] params, validated """
+        filters = {}
+        for name in req.params:
+            if name.startswith('filter[') and name.endswith(']'):
+                field = name[len('filter['):-1]
+                if field not in self.FILTER_FIELDS:
+                    raise falcon.HTTPInvalidParam(
+                        'Filter on one of {}'.format(', '.join(self.FILTER_FIELDS)), name)
+                filters[field] = self._get_param_as_csv(req, name)
+
+        sort = []
+        for key in self._get_param_as_csv(req, 'sort') or ():
+            field = key.lstrip('-')
+            if field not in self.FILTER_FIELDS or field in dict(sort):
+                raise falcon.HTTPInvalidParam(
+                    'Sort on one of {}, each at most once'.format(', '.join(self.FILTER_FIELDS)),
+                    'sort')
+            sort.append((field, DESCENDING if key.startswith('-') else ASCENDING))
+
+        fields = self._get_param_as_csv(req, 'fields[contacts]')
+        if fields is not None and (not fields or not set(fields).issubset(self.FIELDS)):
+            raise falcon.HTTPInvalidParam(
+                'Fields must be among {}'.format(', '.join(self.FIELDS)), 'fields[contacts]')
+        return ListQuery(filters, sort, fields)
+
+    @staticmethod
+    def _get_param_as_csv(req: falcon.Request, name: str) -> List[str]:
+        """ The comma separated values of a param, which may also be repeated """
+        values = req.get_param_as_list(name)
+        if values is None:
+            return None
+        return [value for item in values for value in item.split(',') if value]
+
+    @staticmethod
+    def _make_page_link(req: falcon.Request, page_size: int, after: str) -> str:
+        """ The url for the page following 'after', keeping other query params """
+        params = dict(req.params)
+        params['page[size]'] = page_size
+        params['page[after]'] = after
+        return '{}{}?{}'.format(req.prefix, req.path, urlencode(params, doseq=True))
+
+
+class ContactsBulkApi(_ContactsApi):
+    """
+    Handler for bulk operations
+
+    POST applies up to CONTACTS_BULK_MAX_OPERATIONS contact operations in one
+    request and one datastore round trip. The body follows the json:api atomic
+    operations extension::
+
+        POST /contacts/bulk?ordered=false
+
+        {"atomic:operations": [
+            {"op": "add", "data": {"type": "contacts", "attributes": {...}}},
+            {"op": "update", "ref": {"type": "contacts", "id": "5970fc55f33a80de48ba7a54"},
+             "data": {"type": "contacts", "attributes": {...}}},
+            {"op": "remove", "ref": {"type": "contacts", "id": "5970fc55f33a80de48ba7a54"}}
+        ]}
+
+    Unlike the extension, operations are not all-or-nothing. With ordered=true,
+    the default, processing stops at the first failed operation; with
+    ordered=false every valid operation is applied. The response reports the
+    outcome of each operation, in request order::
+
+        {"atomic:results": [
+            {"data": {"type": "contacts", "id": "..."}, "meta": {"status": "201"}},
+            {"errors": [{"status": "404", "title": "...", "detail": "...",
+                         "source": {"pointer": "/atomic:operations/1"}}]},
+            {"meta": {"status": "424"}}
+         ],
+         "meta": {"ordered": true, "succeeded": 1, "failed": 1, "notAttempted": 1}}
+
+    Status 424 (failed dependency) marks operations not attempted because an
+    earlier operation failed in ordered mode.
+    """
+    OPERATIONS_KEY = 'atomic:operations'
+
+    def __init__(self, controller: ContactsController = None):
+        super(ContactsBulkApi, self).__init__(controller)
+        self._max_operations = env_int('CONTACTS_BULK_MAX_OPERATIONS', 1000)
+
+    def on_post(self, req: falcon.Request, resp: falcon.Response) -> None:
+        ordered = req.get_param_as_bool('ordered')
+        ordered = True if ordered is None else ordered
+        raw_operations = self._get_operations(req)
+        operations, errors = self._make_operations(raw_operations, ordered)
+
+        results = self._controller.bulk_write(req, operations, ordered) if operations else {}
+        results.update(errors)
+        resp.text = json_codec.dumps(self._make_bulk_response(len(raw_operations), results, ordered))
+
+    def _get_operations(self, req: falcon.Request) -> List:
+        body = req.context['body_json']
+        operations = body.get(self.OPERATIONS_KEY) if isinstance(body, dict) else None
+        if not isinstance(operations, list) or not operations:
+            raise falcon.HTTPBadRequest(
+                title='Invalid bulk request',
+                description='The body must hold a non-empty "{}" list'.format(self.OPERATIONS_KEY))
+        if len(operations) > self._max_operations:
+            raise falcon.HTTPBadRequest(
+                title='Too many operations',
+                description='A bulk request may hold at most {} operations, got {}'.format(
+                    self._max_operations, len(operations)))
+        return operations
+
+    def _make_operations(self, raw_operations: List, ordered: bool) -> tuple:
+        """ The valid operations, and a 400 result for each invalid one by index """
+        operations = []
+        errors = {}
+        for index, raw in enumerate(raw_operations):
+            try:
+                operations.append(self._make_operation(index, raw))
+            except ValueError as ex:
+                errors[index] = dict(status='400', title='Invalid operation', detail=str(ex))
+                if ordered:
+                    break
+        return operations, errors
+
+    @staticmethod
+    def _make_operation(index: int, raw: Dict) -> BulkOperation:
+        """ Validate one raw operation; raises ValueError with the reason it is invalid """
+        if not isinstance(raw, dict) or raw.get('op') not in ('add', 'update', 'remove'):
+            raise ValueError('"op" must be one of add, update, remove')
+        data = raw.get('data') or {}
+        ref = raw.get('ref') or {}
+        for member in (data, ref):
+            if not isinstance(member, dict) or member.get('type', 'contacts') != 'contacts':
+                raise ValueError('"data" and "ref" must be objects of type "contacts"')
+
+        object_id = None
+        if raw['op'] != 'add':
+            object_id = ref.get('id', data.get('id'))
+            if not isinstance(object_id, str) or not ObjectId.is_valid(object_id):
+                raise ValueError('"ref" must hold a valid contact "id"')
+
+        attributes = None
+        if raw['op'] != 'remove':
+            attributes = data.get('attributes')
+            if not isinstance(attributes, dict) or not attributes:
+                raise ValueError('"data" must hold the contact "attributes"')
+            contact_schema.CONTACT.validate(attributes, partial=raw['op'] == 'update')
+            attributes = contact_schema.CONTACT.writable(attributes)
+        return BulkOperation(index, raw['op'], object_id, attributes)
+
+    def _make_bulk_response(self, count: int, results: Dict[int, Dict], ordered: bool) -> Dict:
+        items = []
+        failed = 0
+        for index in range(count):
+            result = results.get(index)
+            if result is None:
+                items.append(dict(meta=dict(status='424')))
+            elif 'id' in result:
+                items.append(dict(data=dict(type='contacts', id=result['id']),
+                                  meta=dict(status=result['status'])))
+            else:
+                failed += 1
+                items.append(dict(errors=[dict(
+                    status=result['status'],
+                    title=result['title'],
+                    detail=result['detail'],
+                    source=dict(pointer='/{}/{}'.format(self.OPERATIONS_KEY, index)))]))
+        return {
+            'atomic:results': items,
+            'meta': dict(ordered=ordered,
+                         succeeded=len(results) - failed,
+                         failed=failed,
+                         notAttempted=count - len(results)),
+        }
+
+
+class ContactsExportApi(_ContactsApi):
+    """
+    Handler for full collection exports
+
+    GET streams every contact as a single json:api collection response. Contacts
+    are read from the datastore CONTACTS_EXPORT_BATCH_SIZE at a time and encoded
+    as they arrive, so worker memory stays flat regardless of collection size.
+    The body is identical to a GET /contacts response holding every contact.
+    """
+    def __init__(self, controller: ContactsController = None):
+        super(ContactsExportApi, self).__init__(controller)
+        self._batch_size = env_int('CONTACTS_EXPORT_BATCH_SIZE', 500)
+
+    def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        data = self._controller.iter_list(req, self._batch_size)
+        resp.stream = stream_response('contacts', '_id', data)
+
+
+class ContactsSearchApi(_ContactsApi):
+    """
+    Handler for contact search
+
+    GET returns the contacts best matching q, a few words each matching the
+    start of a word of the contact's name, company, city or email::
+
+        GET /contacts/search?q=jenk+town&page[size]=20&page[offset]=20
+
+    Contacts are ranked by how well they match (see ContactsController), and
+    hold the searched fields only; fetch the contact for the others. meta.total
+    holds the number of matching contacts and, when there are more,
+    links.next the url of the next page.
+    """
+    DEFAULT_PAGE_SIZE = 20
+    MAX_PAGE_SIZE = 100
+    MAX_QUERY_LENGTH = 100
+
+    def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        query, page_size, offset = self._get_search(req)
+        total, data = self._controller.search(req, query, page_size, offset)
+        self._set_results(req, resp, total, data, page_size, offset)
+
+    def _get_search(self, req: falcon.Request) -> tuple:
+        """ The validated query, page size and offset """
+        query = req.get_param('q', required=True)
+        if len(query) > self.MAX_QUERY_LENGTH:
+            raise falcon.HTTPInvalidParam(
+                'The query may be at most {} characters'.format(self.MAX_QUERY_LENGTH), 'q')
+        offset = req.get_param_as_int('page[offset]', min_value=0, default=0)
+        return query, self._get_page_size(req), offset
+
+    def _set_results(self, req: falcon.Request, resp: falcon.Response, total: int,
+                     data: List[Dict], page_size: int, offset: int) -> None:
+        links = None
+        if offset + page_size < total:
+            params = dict(req.params)
+            params['page[size]'] = page_size
+            params['page[offset]'] = offset + page_size
+            links = dict(next='{}{}?{}'.format(req.prefix, req.path, urlencode(params, doseq=True)))
+        self._set_body(req, resp, self._make_response(data, links, dict(total=total)))
+
+
+class ContactsWritesApi(_ContactsApi):
+    """
+    Handler for queued (write-behind) creates
+
+    GET reports this worker's write-behind queue: its counters and the latest
+    contacts that could not be written, each with the error. With ?id= it
+    also reports that contact's status: pending, failed, or unknown once
+    written (or if queued by another worker).
+    """
+    def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        result = dict(id=0, failures=InsertQueue.failures(), **InsertQueue.stats())
+        contact_id = req.get_param('id')
+        if contact_id is not None:
+            result.update(contactId=contact_id, status=InsertQueue.status(contact_id))
+        resp.text = make_response('writes', 'id', result)
+
 
 class ContactApi(_ContactsApi):
     """Handler for element operations"""
@@ -109,12 +449,40 @@ class ContactApi(_ContactsApi):
 
     def on_get(self, req: falcon.Request, resp: falcon.Response, contact_id: str) -> None:
         data = self._controller.get_item(req, contact_id)
-        resp.body = self._make_response(data)
+        self._set_body(req, resp, self._make_response(data))
 
+    @falcon.before(_ContactsApi._validate_contact)
     def on_patch(self, req: falcon.Request, resp: falcon.Response, contact_id: str) -> None:
-        data = self._controller.update_item(req, contact_id)
-        resp.body = self._make_response(data)
+        expected = self._check_if_match(req, contact_id)
+        data = self._controller.update_item(req, contact_id, expected)
+        resp.text = self._make_response(data)
+        resp.etag = etag.make_etag(resp.text)
 
+    @falcon.before(_ContactsApi._validate_contact)
     def on_put(self, req: falcon.Request, resp: falcon.Response, contact_id: str) -> None:
-        data = self._controller.replace_item(req, contact_id)
-        resp.body = self._make_response(data)
+        expected = self._check_if_match(req, contact_id)
+        data = self._controller.replace_item(req, contact_id, expected)
+        resp.text = self._make_response(data)
+        resp.etag = etag.make_etag(resp.text)
+
+    def _check_if_match(self, req: falcon.Request, contact_id: str) -> Dict:
+        """
+        Enforce If-Match for optimistic concurrency.
+
+        Returns None when there is no If-Match header, otherwise the contact the
+        client's ETag was computed from; the repository only applies the write
+        if the stored contact still equals it. The contact is read from the
+        datastore, not the cache, which may hold an older version.
+        """
+        if_match = req.get_header('If-Match')
+        if if_match is None:
+            return None
+        return self._match_etag(if_match, self._controller.get_current_item(req, contact_id), contact_id)
+
+    def _match_etag(self, if_match: str, current: Dict, contact_id: str) -> Dict:
+        """ current, if the If-Match header matches its ETag; 412 otherwise """
+        if not etag.matches(if_match, etag.make_etag(self._make_response(current)), weak=False):
+            raise falcon.HTTPPreconditionFailed(
+                title='Contact has changed',
+                description='Contact {} does not match If-Match; fetch it again and retry'.format(contact_id))
+        return current
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Contacts API for the asyncio (ASGI) app.
+
+Each class mirrors the contacts_api class of the same name with coroutine
+responders that await AsyncContactsController. Parameter validation, response
+encoding and conditional request handling are inherited, so both apps serve
+byte-identical responses.
+"""
+import falcon
+
+from ..common import etag, json_codec
+from ..common.json_api import stream_response_async
+from ..controller.contacts_controller_async import AsyncContactsController
+from .contacts_api import (ContactApi, ContactsApi, ContactsBulkApi, ContactsExportApi,
+                           ContactsSearchApi, ContactsWritesApi)
+
+
+async def _validate_contact(req: falcon.Request, resp: falcon.Response, resource, params) -> None:
+    """ ContactsApi._validate_contact as a coroutine, as hooks of coroutine responders must be """
+    ContactsApi._validate_contact(req, resp, resource, params)  # pylint: disable=protected-access
+
+
+class AsyncContactsApi(ContactsApi):
+    """Handler for collection operations"""
+
+    def __init__(self):
+        super(AsyncContactsApi, self).__init__(AsyncContactsController())
+
+    async def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        page_size = self._get_page_size(req)
+        data = await self._controller.get_list(req, page_size + 1, req.get_param('page[after]'),
+                                               self._get_list_query(req))
+        self._set_page(req, resp, data, page_size)
+
+    @falcon.before(_validate_contact)
+    async def on_post(self, req: falcon.Request, resp: falcon.Response):
+        if self._write_behind:
+            self._set_queued(req, resp, await self._controller.queue_item(req))
+            return
+        object_id = await self._controller.create_item(req)
+        data = dict(_id=object_id)
+        resp.text = self._make_response(data)
+        resp.status = falcon.HTTP_201
+
+
+class AsyncContactsBulkApi(ContactsBulkApi):
+    """Handler for bulk operations"""
+
+    def __init__(self):
+        super(AsyncContactsBulkApi, self).__init__(AsyncContactsController())
+
+    async def on_post(self, req: falcon.Request, resp: falcon.Response) -> None:
+        ordered = req.get_param_as_bool('ordered')
+        ordered = True if ordered is None else ordered
+        raw_operations = self._get_operations(req)
+        operations, errors = self._make_operations(raw_operations, ordered)
+
+        results = await self._controller.bulk_write(req, operations, ordered) if operations else {}
+        results.update(errors)
+        resp.text = json_codec.dumps(self._make_bulk_response(len(raw_operations), results, ordered))
+
+
+class AsyncContactsExportApi(ContactsExportApi):
+    """Handler for full collection exports"""
+
+    def __init__(self):
+        super(AsyncContactsExportApi, self).__init__(AsyncContactsController())
+
+    async def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        data = await self._controller.iter_list(req, self._batch_size)
+        resp.stream = stream_response_async('contacts', '_id', data)
+
+
+class AsyncContactsSearchApi(ContactsSearchApi):
+    """Handler for contact search"""
+
+    def __init__(self):
+        super(AsyncContactsSearchApi, self).__init__(AsyncContactsController())
+
+    async def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        query, page_size, offset = self._get_search(req)
+        total, data = await self._controller.search(req, query, page_size, offset)
+        self._set_results(req, resp, total, data, page_size, offset)
+
+
+class AsyncContactsWritesApi(ContactsWritesApi):
+    """Handler for queued (write-behind) creates"""
+
+    def __init__(self):
+        super(AsyncContactsWritesApi, self).__init__(AsyncContactsController())
+
+    async def on_get(self, req: falcon.Request, resp: falcon.Response) -> None:
+        super(AsyncContactsWritesApi, self).on_get(req, resp)
+
+
+class AsyncContactApi(ContactApi):
+    """Handler for element operations"""
+
+    def __init__(self):
+        super(AsyncContactApi, self).__init__(AsyncContactsController())
+
+    async def on_delete(self, req: falcon.Request, _: falcon.Response, contact_id: str) -> None:
+        await self._controller.delete_item(req, contact_id)
+
+    async def on_get(self, req: falcon.Request, resp: falcon.Response, contact_id: str) -> None:
+        data = await self._controller.get_item(req, contact_id)
+        self._set_body(req, resp, self._make_response(data))
+
+    @falcon.before(_validate_contact)
+    async def on_patch(self, req: falcon.Request, resp: falcon.Response, contact_id: str) -> None:
+        expected = await self._check_if_match(req, contact_id)
+        data = await self._controller.update_item(req, contact_id, expected)
+        resp.text = self._make_response(data)
+        resp.etag = etag.make_etag(resp.text)
+
+    @falcon.before(_validate_contact)
+    async def on_put(self, req: falcon.Request, resp: falcon.Response, contact_id: str) -> None:
+        expected = await self._check_if_match(req, contact_id)
+        data = await self._controller.replace_item(req, contact_id, expected)
+        resp.text = self._make_response(data)
+        resp.etag = etag.make_etag(resp.text)
+
+    async def _check_if_match(self, req: falcon.Request, contact_id: str):
+        if_match = req.get_header('If-Match')
+        if if_match is None:
+            return None
+        return self._match_etag(if_match, await self._controller.get_current_item(req, contact_id),
+                                contact_id)
@@ -1,55 +1,111 @@
 # -*- coding: utf-8 -*-
 """
 Service health indicators
-"""
-from datetime import datetime
 
+Liveness and readiness report the cached verdicts of a background
+HealthChecker (see app/controller/health_checker.py) rather than querying
+MongoDB per probe, with the age of the verdict and how long the check took.
+Add ?fresh=1 to check now; fresh checks are rate limited per worker.
+"""
 import falcon
 
+from ..common.admission import Admission
 from ..common.json_api import make_response
+from ..common.log_queue import LogQueue
+from ..controller.coherence import Coherence
 from ..controller.contacts_controller import ContactsController
+from ..controller.contacts_controller_async import AsyncContactsController
+from ..controller.health_checker import AsyncHealthChecker, HealthChecker, Verdict
 from ..repository.contacts_repository import ContactsRepoMongo
+from ..repository.contacts_repository_async import AsyncContactsRepoMongo
+from ..repository.mongo_pool import MongoPool
+from ..repository.resilience import Resilience
+from ..repository.write_behind import InsertQueue
 from ..common.build_info import BuildInfo
 
 
-class Liveness(object):
+def make_checker() -> HealthChecker:
+    """ The checks behind Liveness and Readiness; share one checker between them """
+    return HealthChecker(dict(mongodbFindOne=ContactsController().find_one,
+                              mongodbPing=ContactsRepoMongo().ping))
+
+
+def make_async_checker() -> AsyncHealthChecker:
+    """ make_checker() for the asyncio (ASGI) app """
+    return AsyncHealthChecker(dict(mongodbFindOne=AsyncContactsController().find_one,
+                                   mongodbPing=AsyncContactsRepoMongo().ping))
+
+
+class _Probe(object):
+    """ Report a check's verdict """
+    CHECK = None
+
+    def __init__(self, checker: HealthChecker = None):
+        self._checker = checker if checker is not None else make_checker()
+
+    @staticmethod
+    def _fresh(req: falcon.Request) -> bool:
+        return req.get_param_as_bool('fresh', default=False)
+
+    def _make_result(self, verdict: Verdict) -> dict:
+        """ The verdict as response attributes; raises 503 if the check failed """
+        age = self._checker.age_millis(verdict)
+        if not verdict.ok:
+            raise falcon.HTTPServiceUnavailable(
+                title='Datastore is unreachable',
+                description='{} (checked {}ms ago)'.format(verdict.error, age),
+                retry_after=max(1, int(self._checker.interval)))
+        return {'id': 0,
+                'mongodb': 'ok',
+                self.CHECK + 'DurationMicros': verdict.duration_micros,
+                'checkAgeMillis': age,
+                'checkIntervalSec': self._checker.interval}
+
+
+class Liveness(_Probe):
     """
     Are we functional? Or should our scheduler kill us and make another.
 
-    We will pump a get message through our service to prove all parts viable
+    We pump a get message through our service to prove all parts viable
 
     Return 200 OK if we are functional, 503 otherwise.
     """
-    def on_get(self, _: falcon.Request, resp: falcon.Response):
-        start = datetime.now()
-        ContactsController().find_one()
-        duration = int((datetime.now() - start).total_seconds() * 1000000)
+    CHECK = 'mongodbFindOne'
 
-        resp.body = make_response('liveness',
-                                  'id',
-                                  dict(id=0,
-                                       mongodb='ok',
-                                       mongodbFindOneDurationMicros=duration))
+    def on_get(self, req: falcon.Request, resp: falcon.Response):
+        verdict = self._checker.verdict(self.CHECK, self._fresh(req))
+        resp.text = make_response('liveness', 'id', self._make_result(verdict))
 
 
-class Readiness(object):
+class Readiness(_Probe):
     """
     Are we ready to serve requests?
 
     Check that we can connect to all upstream components.
 
+    The response includes this worker's MongoDB connection pool, circuit
+    breaker, contacts cache, search index and coherence, log queue, write-behind queue and
+    admission counters.
+
     Return 200 OK if we are functional, 503 otherwise.
     """
-    def on_get(self, _: falcon.Request, resp: falcon.Response):
-        start = datetime.now()
-        ContactsRepoMongo().ping()
-        duration = int((datetime.now() - start).total_seconds() * 1000000)
+    CHECK = 'mongodbPing'
+
+    def on_get(self, req: falcon.Request, resp: falcon.Response):
+        verdict = self._checker.verdict(self.CHECK, self._fresh(req))
+        resp.text = make_response('readiness', 'id', self._make_ready_result(verdict))
 
-        resp.body = make_response('readiness',
-                                  'id',
-                                  dict(id=0,
-                                       mongodb='ok',
-                                       mongodbPingDurationMicros=duration))
+    def _make_ready_result(self, verdict: Verdict) -> dict:
+        result = self._make_result(verdict)
+        result.update(mongodbPool=MongoPool.stats(),
+                      mongodbBreaker=Resilience.stats(),
+                      contactsCache=ContactsController.cache_stats(),
+                      contactsSearch=ContactsController.search_stats(),
+                      contactsCoherence=Coherence.stats(),
+                      logQueue=LogQueue.stats(),
+                      writeBehind=InsertQueue.stats(),
+                      admission=Admission.stats())
+        return result
 
 
 class Ping(object):
@@ -72,4 +128,30 @@ class Ping(object):
                       buildDate=info.build_date,
                       buildEpochSec=info.build_epoch_sec
                      )
-        resp.body = make_response('ping', 'id', result)
+        resp.text = make_response('ping', 'id', result)
+
+
+class AsyncLiveness(Liveness):
+    """ Liveness for the asyncio (ASGI) app """
+    def __init__(self, checker: AsyncHealthChecker = None):
+        super(AsyncLiveness, self).__init__(checker if checker is not None else make_async_checker())
+
+    async def on_get(self, req: falcon.Request, resp: falcon.Response):
+        verdict = await self._checker.verdict(self.CHECK, self._fresh(req))
+        resp.text = make_response('liveness', 'id', self._make_result(verdict))
+
+
+class AsyncReadiness(Readiness):
+    """ Readiness for the asyncio (ASGI) app """
+    def __init__(self, checker: AsyncHealthChecker = None):
+        super(AsyncReadiness, self).__init__(checker if checker is not None else make_async_checker())
+
+    async def on_get(self, req: falcon.Request, resp: falcon.Response):
+        verdict = await self._checker.verdict(self.CHECK, self._fresh(req))
+        resp.text = make_response('readiness', 'id', self._make_ready_result(verdict))
+
+
+class AsyncPing(Ping):
+    """ Ping for the asyncio (ASGI) app """
+    async def on_get(self, req: falcon.Request, resp: falcon.Response):
+        super(AsyncPing, self).on_get(req, resp)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus metrics endpoint
+
+GET /metrics returns the metrics registry (see app/common/metrics.py) in the
+Prometheus text exposition format, aggregated across gunicorn workers when
+PROMETHEUS_MULTIPROC_DIR is set.
+"""
+import falcon
+
+from ..common import metrics
+from ..common.admission import Admission
+from ..common.log_queue import LogQueue
+from ..controller.coherence import Coherence
+from ..controller.contacts_controller import ContactsController
+from ..repository.mongo_pool import MongoPool
+from ..repository.resilience import Resilience
+from ..repository.write_behind import InsertQueue
+
+
+class MetricsApi(object):
+    """
+    Scrape target for Prometheus. Also registers the contacts cache, search
+    index and coherence, connection pool, circuit breaker, log queue, write-behind queue
+    and admission counters, so each worker reports them.
+    """
+    def __init__(self):
+        metrics.register_stats('contacts_cache', ContactsController.cache_stats)
+        metrics.register_stats('contacts_search', ContactsController.search_stats)
+        metrics.register_stats('contacts_coherence', Coherence.stats)
+        metrics.register_stats('mongodb_pool', MongoPool.stats, exclude=('pid',))
+        metrics.register_stats('mongodb_breaker', Resilience.stats)
+        metrics.register_stats('log_queue', LogQueue.stats)
+        metrics.register_stats('write_behind', InsertQueue.stats)
+        metrics.register_stats('admission', Admission.stats)
+
+    def on_get(self, _: falcon.Request, resp: falcon.Response):
+        resp.data, resp.content_type = metrics.render()
+
+
+class AsyncMetricsApi(MetricsApi):
+    """ MetricsApi for the asyncio (ASGI) app """
+    async def on_get(self, req: falcon.Request, resp: falcon.Response):
+        super(AsyncMetricsApi, self).on_get(req, resp)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+Profiler endpoint
+
+GET /profile samples the stacks of the worker serving it (see
+app/common/profiler.py). It is only routed when PROFILER_TOKEN is set and
+requires 'Authorization: Bearer <PROFILER_TOKEN>'.
+
+Query parameters:
+    * seconds: how long to sample, default 5, at most PROFILER_MAX_SECONDS
+      (default 25, under the gunicorn worker timeout)
+    * interval: seconds between samples, default 0.005
+    * top: how many functions to report, default PROFILER_TOP (30)
+    * format: 'json' (default), the top functions by cumulative time and the
+      collapsed stacks; 'collapsed', the collapsed stacks only, as text for
+      flamegraph.pl or speedscope
+"""
+import asyncio
+import threading
+
+import falcon
+
+from ..common import profiler
+from ..common.config import env_float, env_int
+from ..common.json_api import make_response
+
+
+class ProfilerApi(object):
+    """
+    Statistical profile of this worker. One profile is taken at a time per
+    worker; concurrent requests are refused with 409 Conflict.
+    """
+    def __init__(self):
+        self._max_seconds = env_float('PROFILER_MAX_SECONDS', 25.0)
+        self._top = env_int('PROFILER_TOP', 30)
+        self._lock = threading.Lock()
+
+    def on_get(self, req: falcon.Request, resp: falcon.Response):
+        seconds, interval, top, output = self._get_params(req)
+        self._acquire()
+        try:
+            samples = profiler.sample(seconds, interval)
+        finally:
+            self._lock.release()
+        self._set_body(resp, samples, top, output)
+
+    def _acquire(self) -> None:
+        if not self._lock.acquire(blocking=False):
+            raise falcon.HTTPConflict(title='Profile in progress',
+                                      description='this worker is already being profiled')
+
+    def _get_params(self, req: falcon.Request) -> tuple:
+        if not profiler.authorized(req):
+            raise falcon.HTTPUnauthorized(title='Unauthorized',
+                                          description='the profiler requires its bearer token')
+        seconds = req.get_param_as_float('seconds', min_value=0.01, max_value=self._max_seconds,
+                                         default=min(5.0, self._max_seconds))
+        interval = req.get_param_as_float('interval', min_value=0.001, max_value=1.0, default=0.005)
+        top = req.get_param_as_int('top', min_value=1, default=self._top)
+        output = req.get_param('format', default='json')
+        if output not in ('json', 'collapsed'):
+            raise falcon.HTTPInvalidParam('must be json or collapsed', 'format')
+        return seconds, interval, top, output
+
+    @staticmethod
+    def _set_body(resp: falcon.Response, samples: profiler.Samples, top: int, output: str) -> None:
+        if output == 'collapsed':
+            resp.content_type = falcon.MEDIA_TEXT
+            resp.text = samples.collapsed()
+            return
+        resp.text = make_response('profile',
+                                  'id',
+                                  dict(id=0,
+                                       samples=samples.rounds,
+                                       intervalSec=samples.interval,
+                                       top=samples.top(top),
+                                       collapsed=samples.collapsed()))
+
+
+class AsyncProfilerApi(ProfilerApi):
+    """
+    ProfilerApi for the asyncio (ASGI) app: sampling runs in an executor
+    thread, so the event loop it samples keeps serving requests.
+    """
+    async def on_get(self, req: falcon.Request, resp: falcon.Response):
+        seconds, interval, top, output = self._get_params(req)
+        self._acquire()
+        try:
+            samples = await asyncio.get_event_loop().run_in_executor(
+                None, profiler.sample, seconds, interval)
+        finally:
+            self._lock.release()
+        self._set_body(resp, samples, top, output)
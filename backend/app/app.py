@@ -2,7 +2,9 @@
 """
 Application entry point.
 
-Initializes the application and returns a falcon.API for Gunicorn to run.
+Initializes the application and returns a falcon.App for Gunicorn to run.
+
+This is the WSGI app; app/asgi.py serves the same API on asyncio.
 
 Example::
 
@@ -10,19 +12,27 @@ Example::
     MONGO_URI='mongodb://localhost:27017/' \
     gunicorn \
         --workers 5 \
+        --config python:app.gunicorn_conf \
         --logger-class app.common.logging.GunicornLogger \
         'app.app:run()'
 """
 import falcon
 
-from .api.contacts_api import ContactsApi, ContactApi
-from .api.health import Liveness, Readiness, Ping
+from .api.contacts_api import (ContactsApi, ContactsBulkApi, ContactsExportApi, ContactsSearchApi,
+                               ContactsWritesApi, ContactApi)
+from .api.health import Liveness, Readiness, Ping, make_checker
+from .api.metrics_api import MetricsApi
+from .api.profiler_api import ProfilerApi
+from .common import profiler
 from .common.falcon_mods import falcon_error_serializer
 from .common.logging import Logger
-from .common.middleware import Telemetry
+from .common.middleware import AdmissionControl, RequestBudget, RequestId, Telemetry, Tracing
+from .controller.coherence import Coherence
+from .controller.contacts_controller import ContactsController
+from .repository.contacts_repository import ContactsRepoMongo
 
 
-def initialize() -> falcon.API:
+def initialize() -> falcon.App:
     """
     Initialize the falcon api and our router
     """
@@ -32,24 +42,39 @@ def initialize() -> falcon.API:
 
     # Create our WSGI application
     # media_type set for json:api compliance
-    api = falcon.API(media_type='application/vnd.api+json',
-                     middleware=[Telemetry()])
+    api = falcon.App(media_type='application/vnd.api+json',
+                     middleware=[RequestId(), AdmissionControl(), Tracing(),
+                                 RequestBudget(), Telemetry()])
 
     # Add a json:api compliant error serializer
     api.set_error_serializer(falcon_error_serializer)
 
+    # Liveness and readiness share one background checker per worker
+    checker = make_checker()
+
     # Routes
     api.add_route('/contacts', ContactsApi())
+    api.add_route('/contacts/bulk', ContactsBulkApi())
+    api.add_route('/contacts/export', ContactsExportApi())
+    if ContactsController.search_backend() != 'off':
+        api.add_route('/contacts/search', ContactsSearchApi())
+    api.add_route('/contacts/writes', ContactsWritesApi())
     api.add_route('/contacts/{contact_id}', ContactApi())
-    api.add_route('/liveness', Liveness())
+    api.add_route('/liveness', Liveness(checker))
+    api.add_route('/metrics', MetricsApi())
     api.add_route('/ping', Ping())
-    api.add_route('/readiness', Readiness())
+    if profiler.enabled():
+        api.add_route('/profile', ProfilerApi())
+    api.add_route('/readiness', Readiness(checker))
     return api
 
 
-def run() -> falcon.API:
+def run() -> falcon.App:
     """
-    :return: an initialized falcon.API
+    :return: an initialized falcon.App
     """
     Logger('app').info("ember-falcon-mongo service starting")
+    ContactsRepoMongo().ensure_indexes()
+    ContactsController().prepare_search()
+    Coherence.start()
     return initialize()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI application entry point.
+
+Serves the same API as app/app.py on an asyncio event loop: datastore calls
+go through Motor and yield to the loop, so one worker overlaps many requests
+that are waiting on MongoDB instead of holding a worker per request.
+
+Select it at deploy time with SERVER_MODE=asgi (see build/docker-entrypoint.sh),
+or run it directly::
+
+    PYTHONPATH=$PYTHONPATH:. \
+    MONGO_URI='mongodb://localhost:27017/' \
+    SERVER_MODE=asgi \
+    gunicorn \
+        --workers 5 \
+        --worker-class uvicorn.workers.UvicornWorker \
+        --config python:app.gunicorn_conf \
+        --logger-class app.common.logging.GunicornLogger \
+        'app.asgi:run()'
+"""
+import asyncio
+import sys
+
+import falcon
+import falcon.asgi
+
+from .api.contacts_api_async import (AsyncContactsApi, AsyncContactsBulkApi,
+                                     AsyncContactsExportApi, AsyncContactsSearchApi,
+                                     AsyncContactsWritesApi, AsyncContactApi)
+from .api.health import AsyncLiveness, AsyncReadiness, AsyncPing, make_async_checker
+from .api.metrics_api import AsyncMetricsApi
+from .api.profiler_api import AsyncProfilerApi
+from .common import profiler
+from .common.falcon_mods import falcon_error_serializer
+from .common.logging import Logger
+from .common.middleware import (AsyncAdmissionControl, AsyncRequestBudget, AsyncRequestId,
+                                AsyncTelemetry, AsyncTracing)
+from .controller.coherence import Coherence
+from .controller.contacts_controller_async import AsyncContactsController
+from .controller.health_checker import AsyncHealthChecker
+from .repository.contacts_repository_async import AsyncContactsRepoMongo
+from .repository.mongo_pool import MotorPool
+from .repository.write_behind import InsertQueue
+
+
+class MotorLifespan:
+    """
+    Create the Motor client on the worker's event loop at startup, and the
+    contacts indexes and search index with it, and start following contact
+    changes; at shutdown, stop them and the health checker, write queued
+    contacts and close the client.
+    """
+    def __init__(self, checker: AsyncHealthChecker):
+        self._checker = checker
+
+    async def process_startup(self, _, __) -> None:
+        MotorPool.initialize()
+        await AsyncContactsRepoMongo().ensure_indexes()
+        await AsyncContactsController().prepare_search()
+        Coherence.start()
+
+    async def process_shutdown(self, _, __) -> None:
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, Coherence.stop)
+        self._checker.stop()
+        await loop.run_in_executor(None, InsertQueue.flush)
+        MotorPool.close()
+
+
+def initialize() -> falcon.asgi.App:
+    """
+    Initialize the falcon asgi app and our router
+    """
+    # Before 3.7, asyncio tasks don't get their own contextvars context: the
+    # backport would share the trace, request id and deadline of every request
+    if sys.version_info < (3, 7):
+        raise RuntimeError('SERVER_MODE=asgi needs Python 3.7 or later')
+
+    # Liveness and readiness share one background checker per worker
+    checker = make_async_checker()
+
+    # media_type set for json:api compliance
+    api = falcon.asgi.App(media_type='application/vnd.api+json',
+                          middleware=[MotorLifespan(checker), AsyncRequestId(),
+                                      AsyncAdmissionControl(), AsyncTracing(),
+                                      AsyncRequestBudget(), AsyncTelemetry()])
+
+    # Add a json:api compliant error serializer
+    api.set_error_serializer(falcon_error_serializer)
+
+    # Routes, as in app.initialize()
+    api.add_route('/contacts', AsyncContactsApi())
+    api.add_route('/contacts/bulk', AsyncContactsBulkApi())
+    api.add_route('/contacts/export', AsyncContactsExportApi())
+    if AsyncContactsController.search_backend() != 'off':
+        api.add_route('/contacts/search', AsyncContactsSearchApi())
+    api.add_route('/contacts/writes', AsyncContactsWritesApi())
+    api.add_route('/contacts/{contact_id}', AsyncContactApi())
+    api.add_route('/liveness', AsyncLiveness(checker))
+    api.add_route('/metrics', AsyncMetricsApi())
+    api.add_route('/ping', AsyncPing())
+    if profiler.enabled():
+        api.add_route('/profile', AsyncProfilerApi())
+    api.add_route('/readiness', AsyncReadiness(checker))
+    return api
+
+
+def run() -> falcon.asgi.App:
+    """
+    :return: an initialized falcon.asgi.App
+    """
+    Logger('app').info("ember-falcon-mongo service starting", serverMode='asgi')
+    return initialize()
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control: per-client rate limits and a cap on requests in progress.
+
+Each client has a token bucket holding up to `burst` tokens, refilled at
+`rate` tokens per second; a request spends its route's cost, and a request
+that finds too few tokens is refused (see middleware.AdmissionControl), with
+the seconds until enough have been refilled. Separately, the requests in
+progress are counted, so a request arriving when the limit is reached can be
+shed at once instead of queueing for a worker.
+
+Buckets and counts live in a store:
+    * MemoryStore: in this process. Each gunicorn worker limits clients on
+      its own, so a client gets up to one bucket per worker
+    * SharedStore: in a file under ADMISSION_DIR, mapped into the memory of
+      every worker on the host and locked with flock, so the workers share
+      one bucket per client and one count of requests in progress. Each
+      worker counts its own requests in a slot of the file; the slots of
+      workers that exit are cleared by the gunicorn hooks, or by the next
+      worker to start
+
+The store is created on first use in each process: a SharedStore if
+ADMISSION_DIR is set, a MemoryStore otherwise. Another store, e.g. one
+backed by Redis to share limits across hosts, can be plugged in with
+Admission.use(); it provides take(), enter(), leave() and in_flight(), as
+MemoryStore does.
+
+Each store holds the buckets of at most RATE_LIMIT_CLIENTS (default 16384)
+clients; the least recently seen are dropped, which only forgets a client's
+spending.
+
+Examples::
+
+    wait = Admission.take(client, cost=10, rate=20, burst=100)
+    if Admission.enter(max_in_flight=4):
+        try:
+            ...
+        finally:
+            Admission.leave()
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+from .config import env_int
+
+SHARED_FILE = 'admission.mmap'
+# Workers that can share a SharedStore
+WORKER_SLOTS = 256
+# Buckets looked at for a client in a SharedStore before one is reused
+PROBES = 8
+
+# key digest, tokens, refilled at (epoch seconds)
+_BUCKET = struct.Struct('<Qdd')
+# pid, requests in progress
+_WORKER = struct.Struct('<qq')
+_WORKERS = struct.Struct('<' + 'qq' * WORKER_SLOTS)
+
+
+def _spend(tokens: float, at: float, cost: float, rate: float, burst: float,
+           now: float) -> Tuple[float, float]:
+    """ Refill a bucket last refilled at, then spend cost; the tokens left and the seconds to wait """
+    tokens = min(burst, tokens + max(0.0, now - at) * rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / rate
+
+
+def _digest(key: str) -> int:
+    """ A stable, non-zero 64 bit digest of key; 0 marks an unused bucket """
+    digest = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+    return digest or 1
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MemoryStore:
+    """ Buckets and the count of requests in progress of this process """
+    name = 'memory'
+
+    def __init__(self, clients: int):
+        self._clients = clients
+        self._lock = threading.Lock()
+        # client -> (tokens, refilled at), least recently seen first
+        self._buckets = OrderedDict()
+        self._in_flight = 0
+
+    def take(self, key: str, cost: float, rate: float, burst: float, now: float) -> float:
+        """ Spend cost from key's bucket; 0 if it held enough, else the seconds until it will """
+        with self._lock:
+            tokens, at = self._buckets.pop(key, (burst, now))
+            tokens, wait = _spend(tokens, at, cost, rate, burst, now)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self._clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def enter(self, limit: int) -> bool:
+        """ Count a request in progress, unless limit are already """
+        with self._lock:
+            if self._in_flight >= limit:
+                return False
+            self._in_flight += 1
+            return True
+
+    def leave(self) -> None:
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def close(self) -> None:
+        pass
+
+
+class SharedStore:
+    """
+    Buckets and counts of requests in progress in a file mapped by every
+    worker. The file holds WORKER_SLOTS (pid, in progress) slots, then an
+    open addressing table of `clients` buckets, keyed by the client's digest.
+    """
+    name = 'shared'
+
+    def __init__(self, path: str, clients: int):
+        self._clients = clients
+        self._size = _WORKERS.size + _BUCKET.size * clients
+        self._lock = threading.Lock()
+        self._slot = None
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                size = os.fstat(self._fd).st_size
+                if size == 0:
+                    os.ftruncate(self._fd, self._size)
+                elif size != self._size:
+                    raise ValueError('{} was made for another RATE_LIMIT_CLIENTS; remove it'.format(path))
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(self._fd, self._size)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    @contextmanager
+    def _locked(self):
+        """ Exclusive access, from this process's threads and other processes """
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._map
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def take(self, key: str, cost: float, rate: float, burst: float, now: float) -> float:
+        digest = _digest(key)
+        with self._locked() as shared:
+            offset, tokens, at = self._find(shared, digest, burst, now)
+            tokens, wait = _spend(tokens, at, cost, rate, burst, now)
+            _BUCKET.pack_into(shared, offset, digest, tokens, now)
+        return wait
+
+    def _find(self, shared: mmap.mmap, digest: int, burst: float, now: float) -> Tuple[int, float, float]:
+        """ The offset, tokens and refill time of digest's bucket; a full one if it has none """
+        start = digest % self._clients
+        oldest = None
+        for probe in range(min(PROBES, self._clients)):
+            offset = _WORKERS.size + (start + probe) % self._clients * _BUCKET.size
+            key, tokens, at = _BUCKET.unpack_from(shared, offset)
+            if key == digest:
+                return offset, tokens, at
+            if key == 0:
+                return offset, burst, now
+            if oldest is None or at < oldest[1]:
+                oldest = (offset, at)
+        # Reuse the least recently seen of the buckets probed
+        return oldest[0], burst, now
+
+    def enter(self, limit: int) -> bool:
+        with self._locked() as shared:
+            workers = _WORKERS.unpack_from(shared, 0)
+            if sum(workers[1::2]) >= limit:
+                # Requests of workers killed without the gunicorn hooks must not count
+                workers = self._sweep(shared, workers)
+                if sum(workers[1::2]) >= limit:
+                    return False
+            offset = self._own_slot(shared, workers)
+            pid, in_flight = _WORKER.unpack_from(shared, offset)
+            _WORKER.pack_into(shared, offset, pid, in_flight + 1)
+            return True
+
+    def leave(self) -> None:
+        if self._slot is None:
+            return
+        with self._locked() as shared:
+            pid, in_flight = _WORKER.unpack_from(shared, self._slot)
+            _WORKER.pack_into(shared, self._slot, pid, max(0, in_flight - 1))
+
+    def in_flight(self) -> int:
+        """ Requests in progress in every worker """
+        with self._locked() as shared:
+            return sum(_WORKERS.unpack_from(shared, 0)[1::2])
+
+    def forget(self, pid: int) -> None:
+        """ Clear the slot of a worker that exited """
+        with self._locked() as shared:
+            workers = _WORKERS.unpack_from(shared, 0)
+            for index in range(WORKER_SLOTS):
+                if workers[index * 2] == pid:
+                    _WORKER.pack_into(shared, index * _WORKER.size, 0, 0)
+
+    def _sweep(self, shared: mmap.mmap, workers: tuple) -> tuple:
+        """ Clear the slots of workers that are gone; returns the slots as they are now """
+        pid = os.getpid()
+        for index in range(WORKER_SLOTS):
+            slot_pid = workers[index * 2]
+            if slot_pid != 0 and slot_pid != pid and not _alive(slot_pid):
+                _WORKER.pack_into(shared, index * _WORKER.size, 0, 0)
+        return _WORKERS.unpack_from(shared, 0)
+
+    def _own_slot(self, shared: mmap.mmap, workers: tuple) -> int:
+        """ This worker's slot; claimed on first use, clearing those of workers gone since """
+        if self._slot is not None:
+            return self._slot
+        pid = os.getpid()
+        workers = self._sweep(shared, workers)
+        free = None
+        for index in range(WORKER_SLOTS):
+            slot_pid = workers[index * 2]
+            if slot_pid == pid or (slot_pid == 0 and free is None):
+                free = index
+        if free is None:
+            raise RuntimeError('More than {} workers share {}'.format(WORKER_SLOTS, SHARED_FILE))
+        self._slot = free * _WORKER.size
+        if workers[free * 2] != pid:
+            _WORKER.pack_into(shared, self._slot, pid, 0)
+        return self._slot
+
+    def close(self) -> None:
+        self._map.close()
+        os.close(self._fd)
+
+
+class Admission:
+    """
+    The process-wide admission store and counters.
+
+    All members are class level: there is one store per process.
+    """
+    _LOCK = threading.Lock()
+    _STORE = None
+    _PID = None
+    _LIMITED = 0
+    _SHED = 0
+
+    @staticmethod
+    def use(store) -> None:
+        """ Keep buckets and counts in store, in this process """
+        with Admission._LOCK:
+            Admission._STORE = store
+            Admission._PID = os.getpid()
+
+    @staticmethod
+    def reset() -> None:
+        """ Start over: the next request creates a store from the settings """
+        with Admission._LOCK:
+            if Admission._STORE is not None and Admission._PID == os.getpid():
+                Admission._STORE.close()
+            Admission._STORE = None
+            Admission._PID = None
+            Admission._LIMITED = 0
+            Admission._SHED = 0
+
+    @staticmethod
+    def take(client: str, cost: float, rate: float, burst: float) -> float:
+        """ Spend cost from client's bucket; 0 if it could, else the seconds until it can """
+        wait = Admission._store().take(client, cost, rate, burst, time.time())
+        if wait:
+            with Admission._LOCK:
+                Admission._LIMITED += 1
+        return wait
+
+    @staticmethod
+    def enter(max_in_flight: int) -> bool:
+        """ Count a request in progress, unless max_in_flight are; leave() when it completes """
+        if Admission._store().enter(max_in_flight):
+            return True
+        with Admission._LOCK:
+            Admission._SHED += 1
+        return False
+
+    @staticmethod
+    def leave() -> None:
+        Admission._store().leave()
+
+    @staticmethod
+    def stats() -> Dict:
+        """ Requests refused by this process, and requests in progress as the store counts them """
+        store = Admission._STORE if Admission._PID == os.getpid() else None
+        with Admission._LOCK:
+            return dict(store=store.name if store is not None else None,
+                        limited=Admission._LIMITED,
+                        shed=Admission._SHED,
+                        inFlight=store.in_flight() if store is not None else 0)
+
+    @staticmethod
+    def clear_shared_dir() -> None:
+        """ Remove the shared file left by a previous run; call before workers start """
+        path = Admission._shared_path()
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.exists(path):
+                os.remove(path)
+
+    @staticmethod
+    def mark_process_dead(pid: int) -> None:
+        """ Stop counting an exited worker's requests in progress """
+        path = Admission._shared_path()
+        if path and os.path.exists(path):
+            store = SharedStore(path, Admission._clients())
+            try:
+                store.forget(pid)
+            finally:
+                store.close()
+
+    @staticmethod
+    def _store():
+        pid = os.getpid()
+        if Admission._PID != pid:
+            with Admission._LOCK:
+                if Admission._PID != pid:
+                    path = Admission._shared_path()
+                    Admission._STORE = SharedStore(path, Admission._clients()) if path \
+                        else MemoryStore(Admission._clients())
+                    Admission._PID = pid
+        return Admission._STORE
+
+    @staticmethod
+    def _shared_path() -> str:
+        directory = os.getenv('ADMISSION_DIR')
+        return os.path.join(directory, SHARED_FILE) if directory else None
+
+    @staticmethod
+    def _clients() -> int:
+        return env_int('RATE_LIMIT_CLIENTS', 16384)
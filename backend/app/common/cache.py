@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+A bounded, thread safe, in-process LRU cache with per-entry time to live.
+
+Used as a read-through cache in front of repositories::
+
+    cache = LruCache(max_size=1000, ttl_sec=30)
+    contact = cache.get_or_load(contact_id, lambda: repo.get_item(req, contact_id))
+    ...
+    cache.invalidate(contact_id)    # after any write to contact_id
+
+Eviction:
+    * when full, the least recently used entry is evicted
+    * entries older than ttl_sec are dropped when next read
+
+A load racing with an invalidation never stores the value it read: the value
+may predate the write that caused the invalidation.
+
+A max_size of 0 disables the cache: every get_or_load calls the loader.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class LruCache:
+    """ LRU + TTL cache with hit, miss and eviction counters """
+
+    _MISSING = object()
+
+    def __init__(self, max_size: int, ttl_sec: float, clock: Callable[[], float] = time.monotonic):
+        self._max_size = max(0, max_size)
+        self._ttl_sec = ttl_sec
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expires_at, value); ordered least to most recently used
+        self._entries = OrderedDict()
+        # bumped by every invalidation so in-flight loads know not to store
+        self._generation = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._max_size > 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """ The cached value for key, or default on a miss """
+        with self._lock:
+            value = self._get(key)
+            if value is self._MISSING:
+                self._misses += 1
+                return default
+            self._hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._put(key, value)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        The cached value for key; on a miss, call loader() and cache its result.
+        Exceptions raised by loader propagate and nothing is cached.
+        """
+        if not self.enabled:
+            return loader()
+        value, generation = self._lookup(key)
+        if value is not self._MISSING:
+            return value
+        value = loader()
+        self._store(key, value, generation)
+        return value
+
+    async def get_or_load_async(self, key: Hashable, loader: Callable[[], Awaitable]) -> Any:
+        """ get_or_load for a coroutine loader, e.g. an asynchronous repository read """
+        if not self.enabled:
+            return await loader()
+        value, generation = self._lookup(key)
+        if value is not self._MISSING:
+            return value
+        value = await loader()
+        self._store(key, value, generation)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        """ Drop key; call after every write to the underlying data """
+        with self._lock:
+            self._generation += 1
+            self._invalidations += 1
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """ A snapshot of the cache counters """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return dict(
+                size=len(self._entries),
+                maxSize=self._max_size,
+                ttlSec=self._ttl_sec,
+                hits=self._hits,
+                misses=self._misses,
+                hitRatio=round(self._hits / lookups, 4) if lookups else 0.0,
+                evictions=self._evictions,
+                expirations=self._expirations,
+                invalidations=self._invalidations,
+            )
+
+    def _lookup(self, key: Hashable) -> tuple:
+        """ The value, or _MISSING, and the generation a subsequent load must store under """
+        with self._lock:
+            value = self._get(key)
+            if value is self._MISSING:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return value, self._generation
+
+    def _store(self, key: Hashable, value: Any, generation: int) -> None:
+        """ Store a loaded value unless an invalidation happened while it was loading """
+        with self._lock:
+            if generation == self._generation:
+                self._put(key, value)
+
+    def _get(self, key: Hashable) -> Any:
+        """ Lookup with the lock held """
+        entry = self._entries.get(key)
+        if entry is None:
+            return self._MISSING
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self._expirations += 1
+            return self._MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def _put(self, key: Hashable, value: Any) -> None:
+        """ Store with the lock held, evicting the least recently used entries """
+        if not self.enabled:
+            return
+        self._entries[key] = (self._clock() + self._ttl_sec, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self._evictions += 1
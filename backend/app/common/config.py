@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Typed access to configuration environment variables.
+
+Service configuration comes from the environment (see README.md). These helpers
+return a default when the variable is unset or empty and raise a ValueError
+naming the variable when it is set to something unusable.
+"""
+import os
+from typing import Any, Callable, Dict
+
+
+def env_int(name: str, default: int = None) -> int:
+    """ Return the env var as an int, or default if it is not set """
+    value = os.getenv(name, '')
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('{} must be an integer, got "{}"'.format(name, value))
+
+
+def env_float(name: str, default: float = None) -> float:
+    """ Return the env var as a float, or default if it is not set """
+    value = os.getenv(name, '')
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError('{} must be a number, got "{}"'.format(name, value))
+
+
+def env_map(name: str, convert: Callable[[str], Any] = str) -> Dict[str, Any]:
+    """
+    Return a 'key=value,key=value' env var as a dict, each value passed through
+    convert; an empty dict if it is not set
+    """
+    value = os.getenv(name, '')
+    result = {}
+    for item in filter(None, (item.strip() for item in value.split(','))):
+        key, separator, item_value = item.rpartition('=')
+        if not separator or not key:
+            raise ValueError('{} must be a list of key=value, got "{}"'.format(name, value))
+        try:
+            result[key.strip()] = convert(item_value.strip())
+        except ValueError:
+            raise ValueError('{} has an invalid value for {}: "{}"'.format(name, key, item_value))
+    return result
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Entity tags for conditional requests.
+
+ETags are strong validators: a hash of the exact response body. Two responses
+share an ETag only if their bodies are byte for byte identical.
+
+REFERENCES:
+    https://tools.ietf.org/html/rfc7232
+"""
+import hashlib
+
+
+def make_etag(body: str) -> str:
+    """ A quoted, strong ETag for a response body """
+    return '"{}"'.format(hashlib.blake2b(body.encode('utf-8'), digest_size=16).hexdigest())
+
+
+def matches(header: str, etag: str, weak: bool) -> bool:
+    """
+    Does an If-Match or If-None-Match header value match etag?
+
+    Args:
+        header: the header value, e.g. '"abc"', 'W/"abc", "def"' or '*'
+        etag: our current, quoted, strong ETag
+        weak: use the weak comparison (If-None-Match) instead of the
+            strong comparison (If-Match)
+    """
+    if header is None:
+        return False
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -2,10 +2,10 @@
 """
 Any modifications to the falcon framework are consolidated here
 """
-import json
-
 import falcon
 
+from . import json_codec
+
 
 def falcon_error_serializer(_: falcon.Request,
                             resp: falcon.Response,
@@ -24,4 +24,4 @@ def falcon_error_serializer(_: falcon.Request,
     if hasattr(exc, "link") and exc.link is not None:
         error['links'] = {'about': exc.link['href']}
 
-    resp.body = json.dumps({'errors': [error]})
+    resp.text = json_codec.dumps({'errors': [error]})
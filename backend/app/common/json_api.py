@@ -4,11 +4,19 @@ json:api helpers
 
 see http://jsonapi.org/
 """
-import json
-from typing import Union, Dict, List
+from typing import Union, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List
 
+from . import json_codec, tracing
 
-def make_response(data_type: str, id_key: str, data: Union[Dict, List[Dict]]) -> str:
+# Streamed responses are written in chunks of about this many bytes
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def make_response(data_type: str,
+                  id_key: str,
+                  data: Union[Dict, List[Dict]],
+                  links: Dict = None,
+                  meta: Dict = None) -> str:
     """
     Format a normal response body IAW json:api.
 
@@ -32,18 +40,113 @@ def make_response(data_type: str, id_key: str, data: Union[Dict, List[Dict]]) ->
         data_type (str): generic type name of data, e.g "contacts"
         id_key (str): key name in data that holds the id value
         data (dict or list(dict)): a response object or list
+        links (dict): optional top level links object, e.g. pagination links
+        meta (dict): optional top level meta object, e.g. a result count
 
     Returns:
         str: JSON string respresentation for the response body
     """
-    if isinstance(data, list):
-        items = []
-        for item in data:
-            items.append(_make_response_item(data_type, id_key, item))
-        result = dict(data=items)
-    else:
-        result = dict(data=_make_response_item(data_type, id_key, data))
-    return json.dumps(result, ensure_ascii=False)
+    with tracing.span('encode'):
+        if isinstance(data, list):
+            items = []
+            for item in data:
+                items.append(_make_response_item(data_type, id_key, item))
+            result = dict(data=items)
+        else:
+            result = dict(data=_make_response_item(data_type, id_key, data))
+        if links:
+            result['links'] = links
+        if meta:
+            result['meta'] = meta
+        return json_codec.dumps(result)
+
+
+def stream_response(data_type: str,
+                    id_key: str,
+                    data: Iterable[Dict],
+                    links: Dict = None) -> Iterator[bytes]:
+    """
+    Generate a json:api collection response body incrementally.
+
+    Items are encoded one at a time as they are pulled from data, so memory use
+    does not grow with the number of items. Assign the result to resp.stream.
+
+    The concatenated output is byte for byte identical to
+    make_response(data_type, id_key, list(data), links).encode('utf-8').
+
+    Args:
+        data_type (str): generic type name of data, e.g "contacts"
+        id_key (str): key name in data that holds the id value
+        data (iterable(dict)): response objects, e.g. a repository cursor
+        links (dict): optional top level links object
+
+    Returns:
+        iterator(bytes): utf-8 encoded chunks of the response body
+    """
+    encoder = _StreamEncoder(data_type, id_key)
+    for item in data:
+        chunk = encoder.add(item)
+        if chunk:
+            yield chunk
+    yield encoder.finish(links)
+
+
+async def stream_response_async(data_type: str,
+                                id_key: str,
+                                data: AsyncIterable[Dict],
+                                links: Dict = None) -> AsyncIterator[bytes]:
+    """
+    The asynchronous version of stream_response, for falcon.asgi responses.
+
+    Args:
+        data_type (str): generic type name of data, e.g "contacts"
+        id_key (str): key name in data that holds the id value
+        data (async iterable(dict)): response objects, e.g. a motor cursor
+        links (dict): optional top level links object
+
+    Returns:
+        async iterator(bytes): utf-8 encoded chunks of the response body
+    """
+    encoder = _StreamEncoder(data_type, id_key)
+    async for item in data:
+        chunk = encoder.add(item)
+        if chunk:
+            yield chunk
+    yield encoder.finish(links)
+
+
+class _StreamEncoder:
+    """ Incrementally builds a make_response compatible collection body """
+
+    def __init__(self, data_type: str, id_key: str):
+        self._data_type = data_type
+        self._id_key = id_key
+        self._chunk = ['{"data":[']
+        self._chunk_len = 0
+        self._separator = ''
+
+    def add(self, item: Dict) -> bytes:
+        """ Encode one item; returns a chunk to send once enough has accumulated """
+        encoded = json_codec.dumps(_make_response_item(self._data_type, self._id_key, item))
+        self._chunk.append(self._separator)
+        self._chunk.append(encoded)
+        self._separator = ','
+        self._chunk_len += len(encoded)
+        if self._chunk_len < STREAM_CHUNK_BYTES:
+            return None
+        chunk = ''.join(self._chunk).encode('utf-8')
+        self._chunk = []
+        self._chunk_len = 0
+        return chunk
+
+    def finish(self, links: Dict = None) -> bytes:
+        """ The final chunk, closing the data array and adding links """
+        self._chunk.append(']')
+        if links:
+            self._chunk.append(',"links":')
+            self._chunk.append(json_codec.dumps(links))
+        self._chunk.append('}')
+        return ''.join(self._chunk).encode('utf-8')
 
 
 def _make_response_item(data_type: str, id_key: str, data: Dict) -> dict:
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+The JSON codec used for request bodies, responses, errors and log records.
+
+Serialization is a large share of per-request CPU, so all JSON work goes
+through this module instead of the stdlib json package directly. The backend
+is chosen once at import:
+    * orjson, if installed
+    * ujson, if installed
+    * the stdlib json package otherwise
+
+Set JSON_CODEC to 'orjson', 'ujson' or 'json' to force a backend; the default,
+'auto', picks the fastest one installed.
+
+All backends:
+    * write compact JSON (no spaces after ',' and ':') with non-ascii characters
+      left unescaped
+    * encode bson ObjectIds as their hex string and datetimes in ISO 8601 format,
+      so repository documents can be encoded as read from the datastore
+    * write int, float and bool dict keys as strings, e.g. {1: 'a'} as {"1":"a"}
+
+Examples::
+
+    from . import json_codec
+
+    body = json_codec.load(req.bounded_stream)
+    resp.text = json_codec.dumps(result)
+"""
+import datetime
+import json
+import os
+from typing import Any, Callable
+
+from bson.objectid import ObjectId
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+def _default(obj: Any) -> Any:
+    """ Encode the non-JSON types that appear in our documents """
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def _log_default(obj: Any) -> Any:
+    """ Log records must always render; fall back to repr() for anything else """
+    try:
+        return _default(obj)
+    except TypeError:
+        return repr(obj)
+
+
+class _StdlibCodec:
+    name = 'json'
+
+    @staticmethod
+    def dumps(obj: Any, default: Callable = _default) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'), default=default)
+
+    @staticmethod
+    def loads(data) -> Any:
+        return json.loads(data)
+
+
+class _UjsonCodec:
+    name = 'ujson'
+
+    @staticmethod
+    def dumps(obj: Any, default: Callable = _default) -> str:
+        return ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, default=default)
+
+    @staticmethod
+    def loads(data) -> Any:
+        return ujson.loads(data)
+
+
+class _OrjsonCodec:
+    name = 'orjson'
+
+    @staticmethod
+    def dumps(obj: Any, default: Callable = _default) -> str:
+        # Like json and ujson, write non-str dict keys, e.g. ints, as strings
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    @staticmethod
+    def loads(data) -> Any:
+        return orjson.loads(data)
+
+
+_CODECS = dict(
+    orjson=_OrjsonCodec if orjson is not None else None,
+    ujson=_UjsonCodec if ujson is not None else None,
+    json=_StdlibCodec,
+)
+
+
+def available() -> list:
+    """ Names of the codecs that can be used in this environment, fastest first """
+    return [name for name, codec in _CODECS.items() if codec is not None]
+
+
+def select(codec: str = 'auto') -> str:
+    """
+    Switch the active codec. Returns the name of the codec selected.
+
+    'auto' selects the fastest available codec. Raises ValueError if the named
+    codec is unknown or not installed.
+    """
+    global _CODEC  # pylint: disable=global-statement
+    if codec == 'auto':
+        codec = available()[0]
+    if _CODECS.get(codec) is None:
+        raise ValueError('JSON codec "{}" is not available; choose from {}'.format(
+            codec, ', '.join(['auto'] + available())))
+    _CODEC = _CODECS[codec]
+    return codec
+
+
+def active() -> str:
+    """ Name of the active codec """
+    return _CODEC.name
+
+
+def dumps(obj: Any) -> str:
+    """ Serialize obj to a compact JSON str """
+    return _CODEC.dumps(obj)
+
+
+def loads(data) -> Any:
+    """ Deserialize a JSON str or utf-8 bytes """
+    return _CODEC.loads(data)
+
+
+def load(stream) -> Any:
+    """ Deserialize JSON read from a file-like object, e.g. req.bounded_stream """
+    return _CODEC.loads(stream.read())
+
+
+def render_log(_, __, event_dict: dict) -> str:
+    """ structlog processor: the final JSON renderer for log records """
+    return _CODEC.dumps(event_dict, default=_log_default)
+
+
+_CODEC = _StdlibCodec
+select(os.getenv('JSON_CODEC', 'auto'))
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous, batched log writing.
+
+With LOG_QUEUE_SIZE > 0 the JSON logging chain (see logging.initialize_logging)
+ends with LogQueue.enqueue instead of the renderer: the request thread only
+adds the event dict to a bounded queue. A background thread renders queued
+events to JSON lines and writes them to stdout in batches, so a slow stdout
+no longer stalls requests. An event the renderer fails on is written as its
+repr instead, so one bad event can't stop the writer.
+
+When the queue is full, LOG_QUEUE_POLICY decides:
+    * drop (default): the event is discarded and counted in stats()['dropped']
+    * block: the request thread waits for room, as synchronous logging would
+
+The queue and its writer thread are a worker_queue.WorkerQueue, started on
+first use in each process. Queued events are flushed when a worker exits
+(app/gunicorn_conf.py) and at interpreter exit.
+"""
+import atexit
+import json
+import queue
+import sys
+import threading
+from typing import Callable, Dict
+
+import structlog
+
+from .worker_queue import WorkerQueue
+
+
+class LogQueue:
+    """
+    The process-wide log queue and its writer thread.
+
+    All members are class level: there is exactly one queue per process.
+    """
+    BATCH_SIZE = 512
+
+    _LOCK = threading.Lock()
+    # The queue and writer thread of this process, set below
+    _WRITER = None
+    _MAX_SIZE = 0
+    _BLOCK = False
+    _RENDER = None
+    _STREAM = None
+    _WRITTEN = 0
+    _DROPPED = 0
+    _BATCHES = 0
+
+    @staticmethod
+    def configure(max_size: int, policy: str, render: Callable[[object, str, Dict], str],
+                  stream=None) -> None:
+        """
+        Args:
+            max_size: max events waiting to be written
+            policy: 'drop' or 'block', what to do when the queue is full
+            render: structlog renderer run by the writer thread, e.g. json_codec.render_log
+            stream: where to write, default sys.stdout
+        """
+        if policy not in ('drop', 'block'):
+            raise ValueError('LOG_QUEUE_POLICY must be drop or block, not "{}"'.format(policy))
+        LogQueue.flush()
+        with LogQueue._LOCK:
+            LogQueue._MAX_SIZE = max_size
+            LogQueue._BLOCK = policy == 'block'
+            LogQueue._RENDER = render
+            LogQueue._STREAM = stream
+        LogQueue._WRITER.reset()
+
+    @staticmethod
+    def enqueue(logger, method_name: str, event_dict: Dict) -> None:
+        """ structlog processor, last in the chain: queue the event for the writer """
+        events = LogQueue._WRITER.queue(LogQueue._start)
+        try:
+            events.put((logger, method_name, event_dict), block=LogQueue._BLOCK)
+        except queue.Full:
+            with LogQueue._LOCK:
+                LogQueue._DROPPED += 1
+        raise structlog.DropEvent
+
+    @staticmethod
+    def flush(timeout: float = 5.0) -> bool:
+        """
+        Wait until every event queued so far is written.
+        Returns False if that takes longer than timeout seconds.
+        """
+        return LogQueue._WRITER.flush(timeout)
+
+    @staticmethod
+    def stats() -> Dict:
+        """ Queue counters for this process """
+        with LogQueue._LOCK:
+            return dict(enabled=LogQueue._MAX_SIZE > 0,
+                        queued=LogQueue._WRITER.qsize(),
+                        maxSize=LogQueue._MAX_SIZE,
+                        policy='block' if LogQueue._BLOCK else 'drop',
+                        written=LogQueue._WRITTEN,
+                        dropped=LogQueue._DROPPED,
+                        batches=LogQueue._BATCHES)
+
+    @staticmethod
+    def _start() -> int:
+        """ A new queue of this process: start counting over """
+        with LogQueue._LOCK:
+            LogQueue._WRITTEN = LogQueue._DROPPED = LogQueue._BATCHES = 0
+        return LogQueue._MAX_SIZE
+
+    @staticmethod
+    def _write(events: queue.Queue) -> None:
+        """ Writer thread: render and write whatever is queued, one batch at a time """
+        while True:
+            batch = [events.get()]
+            while len(batch) < LogQueue.BATCH_SIZE:
+                try:
+                    batch.append(events.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            flushed = []
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    flushed.append(item)
+                else:
+                    lines.append(LogQueue._render(*item))
+            if lines:
+                stream = LogQueue._STREAM or sys.stdout
+                try:
+                    stream.write('\n'.join(lines) + '\n')
+                    stream.flush()
+                except Exception:  # pylint: disable=broad-except
+                    pass  # stdout is gone; nowhere left to report it
+                with LogQueue._LOCK:
+                    LogQueue._WRITTEN += len(lines)
+                    LogQueue._BATCHES += 1
+            for written in flushed:
+                written.set()
+
+
+    @staticmethod
+    def _render(logger, method_name: str, event_dict: Dict) -> str:
+        """ The event's JSON line, or one with its repr if it can't be rendered """
+        try:
+            return LogQueue._RENDER(logger, method_name, event_dict)
+        except Exception as ex:  # pylint: disable=broad-except
+            return json.dumps(dict(logMessage='Unrenderable log record', level=method_name,
+                                   record=repr(event_dict), error=repr(ex)))
+
+
+LogQueue._WRITER = WorkerQueue('log-writer', LogQueue._write)  # pylint: disable=protected-access
+atexit.register(LogQueue.flush)
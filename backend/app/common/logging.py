@@ -57,80 +57,87 @@ NOTES:
       without LOG_MODE=LOCAL - they are not perfectly aligned - one may
       cause an error where the other does not.
 """
-import datetime
 import logging
 import os
 import platform
 import sys
 import threading
+import time
+from contextvars import ContextVar
 
 import structlog
 
+from . import json_codec
 from .build_info import BuildInfo
+from .config import env_int
+from .log_queue import LogQueue
 
 class LogEntryProcessor:
     """
     Provide log entry processors as well as cached values that are expensive
-    to create and thread local storage for request level variables.
+    to create and context local storage for request level variables, which
+    keeps concurrent requests apart in threaded and asyncio workers alike.
+
+    The JSON chain is built for per-request cost: the application keys are the
+    same in every record, so they are rendered to a JSON fragment once and
+    spliced into each rendered record, and timestamps reuse the formatted
+    date and time until the second changes.
     """
     # TODO: need some way to get a pod/node identifier instead of host - or perhaps that will work
     _HOST = platform.node().split('.')[0]
     _BI = BuildInfo()
-    _TLS = threading.local()
+    _REQUEST_ID = ContextVar('request_id', default=None)
+    # (epoch second, 'YYYY-MM-DDTHH:MM:SS') of the last timestamp
+    _SECOND = (None, '')
+    _STATIC_JSON = None
 
     @staticmethod
     def get_request_id() -> str:
-        if hasattr(LogEntryProcessor._TLS, "request_id"):
-            return LogEntryProcessor._TLS.request_id
-        return None
+        return LogEntryProcessor._REQUEST_ID.get()
 
     @staticmethod
     def set_request_id(request_id: str) -> None:
-        LogEntryProcessor._TLS.request_id = request_id
+        LogEntryProcessor._REQUEST_ID.set(request_id)
 
     @staticmethod
-    def add_app_info(_, __, event_dict: dict) -> dict:
-        """
-        Add application level keys to the event dict
-        """
-        event_dict['logGitHubRepoName'] = LogEntryProcessor._BI.repo_name
-        event_dict['logServiceType'] = LogEntryProcessor._BI.service_type
-        event_dict['logServiceName'] = LogEntryProcessor._BI.service_name
-        event_dict['logServiceVersion'] = LogEntryProcessor._BI.version
-        event_dict['logServiceInstance'] = LogEntryProcessor._HOST
-        event_dict['logThreadId'] = threading.current_thread().getName()
-        if LogEntryProcessor.get_request_id():
-            # We are also used by the gunicorn logger so this may not be set
-            event_dict['logRequestId'] = LogEntryProcessor.get_request_id()
-        return event_dict
+    def app_info() -> dict:
+        """ The application level keys of every log record """
+        return dict(logGitHubRepoName=LogEntryProcessor._BI.repo_name,
+                    logServiceType=LogEntryProcessor._BI.service_type,
+                    logServiceName=LogEntryProcessor._BI.service_name,
+                    logServiceVersion=LogEntryProcessor._BI.version,
+                    logServiceInstance=LogEntryProcessor._HOST)
 
     @staticmethod
-    def add_logger_name(logger, _, event_dict: dict) -> dict:
+    def add_context(logger, _, event_dict: dict) -> dict:
         """
-        Add the logger name to the event dict - using loggerName consistent
-        with existing platform logging.
+        Add the keys that vary per record: thread, request id, logger name and timestamp
         """
+        event_dict['logThreadId'] = threading.current_thread().name
+        request_id = LogEntryProcessor._REQUEST_ID.get()
+        if request_id:
+            # We are also used by the gunicorn logger so this may not be set
+            event_dict['logRequestId'] = request_id
         # TODO: is this still needed - why do we need a loggerName if we include class
         record = event_dict.get("_record")
-        if record is None:
-            event_dict["loggerName"] = logger.name
-        else:
-            event_dict["loggerName"] = record.name
+        event_dict["loggerName"] = logger.name if record is None else record.name
+        event_dict["timestamp"] = LogEntryProcessor.timestamp()
         return event_dict
 
     @staticmethod
-    def add_timestamp(_, __, event_dict: dict) -> dict:
+    def timestamp(now: float = None) -> str:
         """
-        Add timestamp to the event dict - using an Analyitics appropriate time stamp
+        An Analytics appropriate UTC time stamp: YYYY-MM-DDTHH:MM:SS.sssZ
 
-        CLC Analytics requires timestamps to be of form: YYYY-MM-DDTHH:MM:SS.sssZ
-        python 3.5 strftime does not have millis; strftime is implemented on by the
-        C library on the target OS - trying for something that is portable
+        strftime has no portable millis, and is slow, so it runs once per second
         """
-        now = datetime.datetime.utcnow()
-        millis = '{:3d}'.format(int(now.microsecond / 1000))
-        event_dict["timestamp"] = "%s.%sZ" % (now.strftime('%Y-%m-%dT%H:%M:%S'), millis)
-        return event_dict
+        now = time.time() if now is None else now
+        second = int(now)
+        cached_second, prefix = LogEntryProcessor._SECOND
+        if second != cached_second:
+            prefix = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(second))
+            LogEntryProcessor._SECOND = (second, prefix)
+        return '{}.{:03d}Z'.format(prefix, int((now - second) * 1000))
 
     @staticmethod
     def censor_password(_, __, event_dict: dict) -> dict:
@@ -141,15 +148,38 @@ class LogEntryProcessor:
             event_dict['password'] = '*CENSORED*'
         return event_dict
 
+    @staticmethod
+    def format_exc_info(logger, method_name: str, event_dict: dict) -> dict:
+        """ Render stack_info and exc_info, in the rare records that have them """
+        if 'stack_info' in event_dict:
+            event_dict = _STACK_INFO_RENDERER(logger, method_name, event_dict)
+        if 'exc_info' in event_dict:
+            event_dict = structlog.processors.format_exc_info(logger, method_name, event_dict)
+        return event_dict
+
     @staticmethod
     def cleanup_keynames(_, __, event_dict: dict) -> dict:
         """
         Final processing to ensure log record key names meet Analytics requirements
         """
-        event_dict['logMessage'] = event_dict['event']
-        del event_dict['event']
+        event_dict['logMessage'] = event_dict.pop('event')
         return event_dict
 
+    @staticmethod
+    def render(_, __, event_dict: dict) -> str:
+        """ The JSON renderer: the record with the application keys spliced in """
+        static = LogEntryProcessor._STATIC_JSON
+        if static is None:
+            static = json_codec.dumps(LogEntryProcessor.app_info())[1:-1]
+            LogEntryProcessor._STATIC_JSON = static
+        body = json_codec.render_log(_, __, event_dict)
+        if len(body) <= 2:
+            return '{' + static + '}'
+        return '{' + static + ',' + body[1:]
+
+
+_STACK_INFO_RENDERER = structlog.processors.StackInfoRenderer()
+
 
 def initialize_logging() -> None:
     """
@@ -163,6 +193,9 @@ def initialize_logging() -> None:
     * To enable human readable, colored, positional logging, set LOG_MODE=LOCAL
       Note that this hides many of the boilerplate log entry elements that is
       clutter for local development.
+    * To render and write JSON log records on a background thread, set
+      LOG_QUEUE_SIZE to the max records waiting to be written and optionally
+      LOG_QUEUE_POLICY to drop (default) or block; see log_queue.py
     """
     debug = os.environ.get('DEBUG', 'false') != 'false'
     logging.basicConfig(level='DEBUG' if debug else 'INFO',
@@ -179,16 +212,28 @@ def initialize_logging() -> None:
             structlog.processors.format_exc_info,
             structlog.dev.ConsoleRenderer()
         ]
+    elif env_int('LOG_QUEUE_SIZE', 0) > 0:
+        LogQueue.configure(env_int('LOG_QUEUE_SIZE'),
+                           os.getenv('LOG_QUEUE_POLICY', 'drop'),
+                           LogEntryProcessor.render)
+        # Records are dropped before reaching the stdlib logger, so filter
+        # by level first; context (thread, request id, time) is captured
+        # here and rendering is left to the writer thread
+        chain = [
+            structlog.stdlib.filter_by_level,
+            LogEntryProcessor.add_context,
+            LogEntryProcessor.censor_password,
+            LogEntryProcessor.format_exc_info,
+            LogEntryProcessor.cleanup_keynames,
+            LogQueue.enqueue
+        ]
     else:
         chain = [
-            LogEntryProcessor.add_app_info,
-            LogEntryProcessor.add_logger_name,
-            LogEntryProcessor.add_timestamp,
+            LogEntryProcessor.add_context,
             LogEntryProcessor.censor_password,
-            structlog.processors.StackInfoRenderer(),
-            structlog.processors.format_exc_info,
+            LogEntryProcessor.format_exc_info,
             LogEntryProcessor.cleanup_keynames,
-            structlog.processors.JSONRenderer()
+            LogEntryProcessor.render
         ]
 
     structlog.configure_once(
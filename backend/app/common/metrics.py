@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus metrics, served by GET /metrics.
+
+    * http_request_duration_seconds: histogram by route, method and status
+    * http_requests_in_flight: requests being processed
+    * mongodb_command_duration_seconds: histogram of MongoDB commands by
+      command and outcome
+    * contacts_cache_*, mongodb_pool_*, mongodb_breaker_*: the contacts cache,
+      connection pool and circuit breaker counters of each worker, refreshed
+      at most once per STATS_INTERVAL_SEC
+
+Each gunicorn worker has its own metric values. For /metrics to report all
+of them, whichever worker serves the scrape, set PROMETHEUS_MULTIPROC_DIR to
+an empty directory writable by the workers: values are then kept in mmap'd
+files there and aggregated at scrape time. The gunicorn hooks in
+app/gunicorn_conf.py clear the directory on start and retire the files of
+workers that exit. Without it, /metrics reports the serving process only.
+
+Examples::
+
+    from . import metrics
+
+    metrics.REQUEST_DURATION.labels(route, method, status).observe(seconds)
+    metrics.register_stats('contacts_cache', ContactsController.cache_stats)
+"""
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Callable, Dict, Iterable
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Gauge,
+                               Histogram, generate_latest, multiprocess)
+
+STATS_INTERVAL_SEC = 1.0
+
+
+def multiprocess_dir() -> str:
+    return os.getenv('PROMETHEUS_MULTIPROC_DIR') or os.getenv('prometheus_multiproc_dir')
+
+
+# Metrics open their files in the directory as they are defined, e.g. when
+# gunicorn imports app/gunicorn_conf.py, before on_starting runs
+if multiprocess_dir():
+    os.makedirs(multiprocess_dir(), exist_ok=True)
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'HTTP request latency',
+    ['route', 'method', 'status'])
+
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'HTTP requests being processed',
+    multiprocess_mode='livesum')
+
+MONGODB_COMMAND_DURATION = Histogram(
+    'mongodb_command_duration_seconds', 'MongoDB command latency',
+    ['command', 'outcome'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 10.0))
+
+_STATS_LOCK = threading.Lock()
+# prefix -> (stats function, excluded keys)
+_STATS_SOURCES = {}
+# metric name -> Gauge
+_STATS_GAUGES = {}
+_STATS_REFRESHED_AT = [0.0]
+
+_CAMEL_HUMP = re.compile(r'(?<!^)(?=[A-Z])')
+
+
+def clear_multiprocess_dir() -> None:
+    """ Remove metric files left by a previous run; call before workers start """
+    path = multiprocess_dir()
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def mark_process_dead(pid: int) -> None:
+    """ Drop an exited worker's live gauges from the aggregate """
+    if multiprocess_dir():
+        multiprocess.mark_process_dead(pid)
+
+
+def register_stats(prefix: str, stats: Callable[[], Dict], exclude: Iterable[str] = ()) -> None:
+    """
+    Report the numeric values of stats() as gauges named prefix_<snake_case key>,
+    one series per worker.
+    """
+    with _STATS_LOCK:
+        _STATS_SOURCES[prefix] = (stats, frozenset(exclude))
+
+
+def refresh_stats(force: bool = False) -> None:
+    """ Update the registered stats gauges, at most once per STATS_INTERVAL_SEC """
+    now = time.monotonic()
+    if not force and now - _STATS_REFRESHED_AT[0] < STATS_INTERVAL_SEC:
+        return
+    with _STATS_LOCK:
+        _STATS_REFRESHED_AT[0] = now
+        for prefix, (stats, exclude) in _STATS_SOURCES.items():
+            for key, value in stats().items():
+                if key in exclude or isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                _stats_gauge(prefix, key).set(value)
+
+
+def _stats_gauge(prefix: str, key: str) -> Gauge:
+    name = '{}_{}'.format(prefix, _CAMEL_HUMP.sub('_', key).lower())
+    gauge = _STATS_GAUGES.get(name)
+    if gauge is None:
+        gauge = Gauge(name, '{} {}'.format(prefix.replace('_', ' '), key),
+                      multiprocess_mode='liveall')
+        _STATS_GAUGES[name] = gauge
+    return gauge
+
+
+def render() -> tuple:
+    """ The exposition body of every metric, and its content type """
+    refresh_stats(force=True)
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -5,17 +5,53 @@ Falcon middleware
 REFERENCES:
     https://falcon.readthedocs.io/en/stable/api/middleware.html
 """
-import json
+import math
+import os
+import random
 from datetime import datetime
 from uuid import uuid4
 
 import falcon
 
+from . import json_codec, metrics, profiler, tracing
+from .admission import Admission
+from .config import env_float, env_int, env_map
 from .logging import LogEntryProcessor, LoggerMixin
+from ..repository.resilience import Resilience
 
 
 class Telemetry(LoggerMixin):
     """
+    Logs each request and its response, and records its latency, by route,
+    method and status, and the requests in flight in the metrics registry.
+    Health probes, metrics scrapes and profiles are excluded.
+
+    Which requests are logged is configured from the environment; routes are
+    named by their template, e.g. '/contacts/{contact_id}':
+        * LOG_REQUESTS: 'all' (default) logs sampled requests; 'exceptional'
+          logs only requests that fail (4xx, 5xx) or are slow
+        * LOG_SAMPLE_RATE: fraction of requests logged in 'all' mode, default 1
+        * LOG_ROUTE_SAMPLE_RATES: per route rates, e.g. '/contacts/bulk=0.01'
+        * LOG_SLOW_MS: requests slower than this are always logged, default never
+        * LOG_ROUTE_SLOW_MS: per route thresholds, e.g. '/contacts/export=5000'
+        * LOG_BODY_MAX_BYTES: longer request bodies are logged truncated, as
+          text, default 0 (no limit)
+
+    Request bodies are read once the request is routed, so requests refused
+    before that, e.g. by AdmissionControl, are measured and logged from their
+    response without their body being read. Bodies longer than
+    REQUEST_BODY_MAX_BYTES (default 1MiB, 0 for no limit) are refused with 413
+    before they are read; bodies that are not JSON with 400.
+
+    Requests failing with a 5xx are always logged with their full body. When
+    whether to log a request is only known once it completes, its "Request
+    received" record is written then.
+
+    A request sent with 'X-Profile: 1' and the profiler's bearer token (see
+    profiler) is run under cProfile; its response body is replaced by the
+    PROFILER_TOP (default 30) functions with the most cumulative time, as
+    text. The status and headers are the request's own.
+
     CAVEATS:
         We really want to log the body on ingress but it is provided as a non-seekable
         stream from the WSGI server - so once read, it is gone. We read the body and
@@ -24,26 +60,35 @@ class Telemetry(LoggerMixin):
     """
     def __init__(self):
         super(Telemetry, self).__init__()
-        self._excluded_resources = ('/liveness', '/readiness', '/ping')
+        self._excluded_resources = ('/liveness', '/readiness', '/ping', '/metrics', '/profile')
+        self._log_mode = os.getenv('LOG_REQUESTS', 'all')
+        if self._log_mode not in ('all', 'exceptional'):
+            raise ValueError('LOG_REQUESTS must be all or exceptional, not "{}"'.format(
+                self._log_mode))
+        self._sample_rate = env_float('LOG_SAMPLE_RATE', 1.0)
+        self._sample_rates = env_map('LOG_ROUTE_SAMPLE_RATES', float)
+        self._slow_ms = env_float('LOG_SLOW_MS')
+        self._slow_ms_routes = env_map('LOG_ROUTE_SLOW_MS', float)
+        self._body_max_bytes = env_int('LOG_BODY_MAX_BYTES', 0)
+        self._profile_top = env_int('PROFILER_TOP', 30)
+        self._body_limit = env_int('REQUEST_BODY_MAX_BYTES', 1048576)
 
     def process_request(self, req: falcon.Request, _: falcon.Response) -> None:
         """
         Process the request before routing it.
         """
         if req.path not in self._excluded_resources:
-            req.context['received_at'] = datetime.now()
-            req.context['body_json'] = {}
-            if req.content_length:
-                req.context['body_json'] = json.load(req.bounded_stream)
-            self._info("Request received",
-                       logCategory='apiRequest',
-                       reqReferrer=', '.join(req.access_route),
-                       reqVerb=req.method,
-                       reqPath=req.path,
-                       reqQuery=req.query_string,
-                       reqBody=req.context['body_json'])
+            self._request_started(req)
+
+    def process_resource(self, req: falcon.Request, _: falcon.Response, __, ___) -> None:
+        """
+        Process the request after routing it to a resource.
+        """
+        if req.path not in self._excluded_resources:
+            self._request_read(req, req.bounded_stream.read() if self._body_length(req) else b'')
+            self._request_routed(req)
 
-    def process_response(self, req: falcon.Request, resp: falcon.Response, _, __: bool) -> None:
+    def process_response(self, req: falcon.Request, resp: falcon.Response, resource, __: bool) -> None:
         """
         Post-processing of the response (after routing)
         :param req:
@@ -55,31 +100,337 @@ class Telemetry(LoggerMixin):
         :return:
         """
         if req.path not in self._excluded_resources:
-            status = 0
+            self._request_completed(req, resp, resource)
+
+    @staticmethod
+    def _request_started(req: falcon.Request) -> None:
+        req.context['received_at'] = datetime.now()
+        metrics.REQUESTS_IN_FLIGHT.inc()
+        if req.get_header('X-Profile') == '1' and profiler.authorized(req):
+            try:
+                req.context['profile'] = profiler.RequestProfile().start()
+            except ValueError:
+                pass  # another profiler is active in this process; serve unprofiled
+
+    def _body_length(self, req: falcon.Request) -> int:
+        """ The request's Content-Length; 413 if over REQUEST_BODY_MAX_BYTES, before it is read """
+        length = req.content_length
+        if length and self._body_limit and length > self._body_limit:
+            req.context['body_raw'] = b''
+            raise falcon.HTTPPayloadTooLarge(
+                title='Request body too large',
+                description='The body may be at most {} bytes, got {}'.format(self._body_limit, length))
+        return length
+
+    @staticmethod
+    def _request_read(req: falcon.Request, raw: bytes) -> None:
+        req.context['body_raw'] = raw
+        with tracing.span('parse', bodyBytes=len(raw)):
             try:
-                status = int(resp.status[0:3])
-            except:  # pylint: disable=bare-except
-                pass # intentionally ignore
+                req.context['body_json'] = json_codec.loads(raw) if raw else {}
+            except ValueError as ex:
+                raise falcon.HTTPBadRequest(title='Malformed JSON', description=str(ex))
+
+    def _request_routed(self, req: falcon.Request) -> None:
+        """ Sample the request; in 'all' mode, log sampled requests on arrival """
+        if self._sample(req) and self._log_mode == 'all':
+            self._request_received(req, full_body=False)
+
+    def _sample(self, req: falcon.Request) -> bool:
+        rate = self._sample_rates.get(req.uri_template, self._sample_rate)
+        sampled = rate >= 1 or random.random() < rate
+        req.context['log_sampled'] = sampled
+        return sampled
+
+    def _request_received(self, req: falcon.Request, full_body: bool) -> None:
+        raw = req.context.get('body_raw', b'')
+        if full_body or not self._body_max_bytes or len(raw) <= self._body_max_bytes:
+            body = dict(reqBody=req.context.get('body_json', raw.decode('utf-8', 'replace')))
+            req.context['log_received'] = 'full'
+        else:
+            body = dict(reqBody=raw[:self._body_max_bytes].decode('utf-8', 'ignore'),
+                        reqBodyBytes=len(raw),
+                        reqBodyTruncated=True)
+            req.context['log_received'] = 'truncated'
+        with tracing.span('log'):
+            self._info("Request received",
+                       logCategory='apiRequest',
+                       reqReferrer=', '.join(req.access_route),
+                       reqVerb=req.method,
+                       reqPath=req.path,
+                       reqQuery=req.query_string,
+                       **body)
+
+    def _request_completed(self, req: falcon.Request, resp: falcon.Response, resource) -> None:
+        status = 0
+        try:
+            status = int(str(resp.status)[0:3])
+        except:  # pylint: disable=bare-except
+            pass # intentionally ignore
+
+        duration = int((datetime.now() - req.context['received_at']).total_seconds() * 1000000)
+        # Unrouted requests share one label so scanners can't inflate cardinality
+        route = req.uri_template if resource is not None else 'unmatched'
+        if resource is not None and 'log_sampled' not in req.context:
+            # Refused before its body was read, e.g. by AdmissionControl
+            self._sample(req)
+        if self._should_log(req, route, status, duration):
+            if status >= 500 and req.context.get('log_received') != 'full':
+                self._request_received(req, full_body=True)
+            elif 'log_received' not in req.context:
+                self._request_received(req, full_body=False)
+            with tracing.span('log'):
+                self._info("Request completed",
+                           logCategory='apiResponse',
+                           reqDurationMicros=duration,
+                           reqStatusCode=status)
+
+        metrics.REQUESTS_IN_FLIGHT.dec()
+        metrics.REQUEST_DURATION.labels(route, req.method, str(status)).observe(duration / 1000000)
+        metrics.refresh_stats()
+
+        profile = req.context.get('profile')
+        if profile is not None:
+            profile.stop()
+            resp.stream = None
+            resp.data = None
+            resp.content_type = falcon.MEDIA_TEXT
+            resp.text = profile.report(self._profile_top)
+
+    def _should_log(self, req: falcon.Request, route: str, status: int, duration: int) -> bool:
+        if status >= 500:
+            return True
+        slow_ms = self._slow_ms_routes.get(route, self._slow_ms)
+        if slow_ms is not None and duration >= slow_ms * 1000:
+            return True
+        if self._log_mode == 'exceptional':
+            return status >= 400
+        # Requests that never reached a resource (e.g. 404s) were not sampled
+        return req.context.get('log_sampled', True)
+
+
+class AsyncTelemetry(Telemetry):
+    """
+    Telemetry for the falcon.asgi app: the request body must be awaited.
+    """
+    async def process_request(self, req: falcon.Request, _: falcon.Response) -> None:
+        if req.path not in self._excluded_resources:
+            self._request_started(req)
+
+    async def process_resource(self, req: falcon.Request, _: falcon.Response, __, ___) -> None:
+        if req.path not in self._excluded_resources:
+            self._request_read(req, await req.bounded_stream.read() if self._body_length(req) else b'')
+            self._request_routed(req)
+
+    async def process_response(self, req: falcon.Request, resp: falcon.Response,
+                               resource, __: bool) -> None:
+        if req.path not in self._excluded_resources:
+            self._request_completed(req, resp, resource)
 
-            duration = int((datetime.now() - req.context['received_at']).total_seconds() * 1000000)
-            self._info("Request completed",
-                       logCategory='apiResponse',
-                       reqDurationMicros=duration,
-                       reqStatusCode=status)
+
+class AdmissionControl:
+    """
+    Refuses requests over their client's rate limit with 429, and sheds
+    requests arriving while too many are in progress with 503, both with a
+    Retry-After header, before the resource runs (see admission). Health
+    probes, metrics scrapes and profiles are exempt.
+
+    Configured from the environment:
+        * RATE_LIMIT_PER_SEC: tokens refilled per second in each client's
+          bucket, default 0 (no rate limit)
+        * RATE_LIMIT_BURST: tokens a bucket holds, default RATE_LIMIT_PER_SEC,
+          or the largest route cost if more
+        * RATE_LIMIT_ROUTE_COSTS: tokens spent per request, by route template
+          with or without its method, e.g. 'GET /contacts=10,/contacts/export=100';
+          default 1
+        * RATE_LIMIT_KEY_HEADER: requests with this header are limited by its
+          value, others by address; default 'X-Api-Key', empty for address only
+        * RATE_LIMIT_TRUSTED_PROXIES: proxies in front of the service, whose
+          forwarding headers are believed; default 0 (the peer's address)
+        * ADMISSION_MAX_IN_FLIGHT: requests in progress, across the workers
+          sharing ADMISSION_DIR or in this worker, beyond which requests are
+          shed; default 0 (no limit)
+        * ADMISSION_RETRY_AFTER_SEC: Retry-After of shed requests, default 1
+
+    Register it before Telemetry, right after RequestId: a refused request
+    is turned away before its body is read and parsed, and Telemetry still
+    measures and logs it from its response.
+    """
+    def __init__(self):
+        self._excluded_resources = ('/liveness', '/readiness', '/ping', '/metrics', '/profile')
+        self._rate = env_float('RATE_LIMIT_PER_SEC', 0.0)
+        self._costs = env_map('RATE_LIMIT_ROUTE_COSTS', float)
+        self._burst = env_float('RATE_LIMIT_BURST', max([self._rate, 1.0] + list(self._costs.values())))
+        self._key_header = os.getenv('RATE_LIMIT_KEY_HEADER', 'X-Api-Key')
+        self._trusted_proxies = env_int('RATE_LIMIT_TRUSTED_PROXIES', 0)
+        self._max_in_flight = env_int('ADMISSION_MAX_IN_FLIGHT', 0)
+        self._retry_after = env_int('ADMISSION_RETRY_AFTER_SEC', 1)
+        if self._rate and max(self._costs.values(), default=1.0) > self._burst:
+            raise ValueError('RATE_LIMIT_ROUTE_COSTS must not exceed RATE_LIMIT_BURST ({})'.format(
+                self._burst))
+
+    def process_resource(self, req: falcon.Request, _: falcon.Response, __, ___) -> None:
+        if req.path in self._excluded_resources:
+            return
+        if self._rate:
+            wait = Admission.take(self._client(req), self._cost(req), self._rate, self._burst)
+            if wait:
+                raise falcon.HTTPTooManyRequests(
+                    title='Rate limit exceeded',
+                    description='Too many requests from this client; retry in {:.1f} seconds'.format(wait),
+                    retry_after=math.ceil(wait))
+        if self._max_in_flight:
+            if not Admission.enter(self._max_in_flight):
+                raise falcon.HTTPServiceUnavailable(
+                    title='Server busy',
+                    description='{} requests are in progress; retry shortly'.format(self._max_in_flight),
+                    retry_after=self._retry_after)
+            req.context['admitted'] = True
+
+    def process_response(self, req: falcon.Request, _: falcon.Response, __, ___: bool) -> None:
+        if req.context.get('admitted'):
+            req.context['admitted'] = False
+            Admission.leave()
+
+    def _client(self, req: falcon.Request) -> str:
+        """ The API key, or the address of the client in front of our trusted proxies """
+        key = req.get_header(self._key_header) if self._key_header else None
+        if key:
+            return 'key:' + key
+        route = req.access_route
+        return 'addr:' + route[max(0, len(route) - 1 - self._trusted_proxies)]
+
+    def _cost(self, req: falcon.Request) -> float:
+        costs = self._costs
+        return costs.get('{} {}'.format(req.method, req.uri_template),
+                         costs.get(req.uri_template, 1.0))
+
+
+class AsyncAdmissionControl(AdmissionControl):
+    """
+    AdmissionControl for the falcon.asgi app
+    """
+    async def process_resource(self, req: falcon.Request, resp: falcon.Response,
+                               resource, params) -> None:
+        super(AsyncAdmissionControl, self).process_resource(req, resp, resource, params)
+
+    async def process_response(self, req: falcon.Request, resp: falcon.Response,
+                               resource, req_succeeded: bool) -> None:
+        super(AsyncAdmissionControl, self).process_response(req, resp, resource, req_succeeded)
 
 
 class RequestId:
+    """
+    Provide a request id for tying together all log entries made during
+    request processing. If the client provided a x-request-id, use that,
+    otherwise generate one; either way it is returned in the x-request-id
+    response header.
+
+    The id is kept in a context variable (see LogEntryProcessor), so it is
+    the current request's in threaded and asyncio workers alike.
+    """
 
     def process_request(self, req: falcon.Request, _: falcon.Response) -> None:
-        """
-        Provide a request id for tying together all log entries made during
-        request processing. If the client provided a x-request-id, use that,
-        otherwise generate one.
-        """
-        LogEntryProcessor.set_request_id(req.get_header('x-request-id', default=str(uuid4())))
+        request_id = req.get_header('x-request-id') or str(uuid4())
+        req.context['request_id'] = request_id
+        LogEntryProcessor.set_request_id(request_id)
 
-    def process_response(self, _: falcon.Request, __: falcon.Response, ___, ____: bool) -> None:
+    def process_response(self, req: falcon.Request, resp: falcon.Response, ___, ____: bool) -> None:
         """
-        Remove x-request-id from thread local storage in preparation for next request
+        Return the id and clear it in preparation for the next request in this context
         """
+        request_id = req.context.get('request_id')
+        if request_id:
+            resp.set_header('x-request-id', request_id)
         LogEntryProcessor.set_request_id(None)
+
+
+class AsyncRequestId(RequestId):
+    """
+    RequestId for the falcon.asgi app
+    """
+    async def process_request(self, req: falcon.Request, resp: falcon.Response) -> None:
+        super(AsyncRequestId, self).process_request(req, resp)
+
+    async def process_response(self, req: falcon.Request, resp: falcon.Response,
+                               resource, req_succeeded: bool) -> None:
+        super(AsyncRequestId, self).process_response(req, resp, resource, req_succeeded)
+
+
+class RequestBudget:
+    """
+    Start each request's time budget, REQUEST_BUDGET_MS (default 10000): the
+    datastore operations it runs must complete within it (see
+    repository.resilience).
+    """
+    def __init__(self):
+        self._budget_ms = env_float('REQUEST_BUDGET_MS', 10000.0)
+
+    def process_request(self, req: falcon.Request, _: falcon.Response) -> None:
+        req.context['budget'] = Resilience.start_budget(self._budget_ms)
+
+    def process_response(self, req: falcon.Request, _: falcon.Response, __, ___: bool) -> None:
+        token = req.context.get('budget')
+        if token is not None:
+            Resilience.end_budget(token)
+
+
+class AsyncRequestBudget(RequestBudget):
+    """
+    RequestBudget for the falcon.asgi app
+    """
+    async def process_request(self, req: falcon.Request, resp: falcon.Response) -> None:
+        super(AsyncRequestBudget, self).process_request(req, resp)
+
+    async def process_response(self, req: falcon.Request, resp: falcon.Response,
+                               resource, req_succeeded: bool) -> None:
+        super(AsyncRequestBudget, self).process_response(req, resp, resource, req_succeeded)
+
+
+class Tracing:
+    """
+    Traces each request (see tracing), continuing the client's trace if it
+    sent a traceparent header. The response reports the trace in its
+    traceparent header and, unless TRACE_SERVER_TIMING=0, the time spent per
+    span name in its Server-Timing header; the spans are exported to
+    TRACE_EXPORT_FILE when it is set. Health probes, metrics scrapes and
+    profiles are not traced.
+
+    Register it after RequestId and before Telemetry, so that Telemetry's
+    spans, including logging the completed request, end before the trace.
+    """
+    def __init__(self):
+        self._excluded_resources = ('/liveness', '/readiness', '/ping', '/metrics', '/profile')
+        self._server_timing = env_int('TRACE_SERVER_TIMING', 1) != 0
+
+    def process_request(self, req: falcon.Request, _: falcon.Response) -> None:
+        if req.path not in self._excluded_resources:
+            req.context['trace'] = tracing.start(
+                '{} {}'.format(req.method, req.path), req.get_header('traceparent'),
+                **{'http.method': req.method, 'http.target': req.relative_uri,
+                   'request.id': req.context.get('request_id', '')})
+
+    def process_response(self, req: falcon.Request, resp: falcon.Response, resource, __: bool) -> None:
+        trace = req.context.get('trace')
+        if trace is None:
+            return
+        tracing.finish(trace)
+        if resource is not None:
+            trace.root.name = '{} {}'.format(req.method, req.uri_template)
+        trace.root.attributes['http.status_code'] = str(resp.status)[0:3]
+        resp.set_header('traceparent', trace.traceparent)
+        if self._server_timing:
+            resp.set_header('Server-Timing', trace.server_timing())
+        tracing.export(trace)
+
+
+class AsyncTracing(Tracing):
+    """
+    Tracing for the falcon.asgi app
+    """
+    async def process_request(self, req: falcon.Request, resp: falcon.Response) -> None:
+        super(AsyncTracing, self).process_request(req, resp)
+
+    async def process_response(self, req: falcon.Request, resp: falcon.Response,
+                               resource, req_succeeded: bool) -> None:
+        super(AsyncTracing, self).process_response(req, resp, resource, req_succeeded)
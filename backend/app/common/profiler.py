@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+On-demand profiling of a live worker.
+
+Profiling is disabled unless PROFILER_TOKEN is set; requests must then carry
+'Authorization: Bearer <PROFILER_TOKEN>'. Two modes are provided:
+    * sample(): a statistical profile of the worker over some seconds, taken
+      by reading the stack of every other thread every interval seconds
+      (see GET /profile, app/api/profiler_api.py)
+    * RequestProfile: a deterministic cProfile profile of one request, for
+      requests sent with 'X-Profile: 1' (see middleware.Telemetry)
+
+A sync gunicorn worker serves one request at a time, so while it serves the
+GET /profile request there is nothing else to sample: sample workers run
+with threads (gunicorn --threads) or in SERVER_MODE=asgi.
+
+Sampled stacks are reported in the collapsed format read by flamegraph.pl
+and speedscope, one 'thread;outer frame;...;inner frame count' line per
+distinct stack.
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List
+
+import falcon
+
+
+def enabled() -> bool:
+    return bool(os.getenv('PROFILER_TOKEN'))
+
+
+def authorized(req: falcon.Request) -> bool:
+    """ Does the request carry the profiler token? Always False when profiling is disabled """
+    token = os.getenv('PROFILER_TOKEN')
+    if not token:
+        return False
+    offered = req.get_header('Authorization') or ''
+    return hmac.compare_digest(offered.encode('utf-8'), 'Bearer {}'.format(token).encode('utf-8'))
+
+
+class Samples:
+    """ Stacks seen by sample(), with how many times each was seen """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.rounds = 0
+        self.stacks = Counter()
+
+    def collapsed(self) -> str:
+        """ The stacks in collapsed format, most frequent first """
+        return ''.join('{} {}\n'.format(';'.join(stack), count)
+                       for stack, count in self.stacks.most_common())
+
+    def top(self, count: int) -> List[Dict]:
+        """
+        The count functions with the most cumulative time, i.e. time on any
+        thread's stack, estimated as samples * interval
+        """
+        cumulative = Counter()
+        own = Counter()
+        for stack, seen in self.stacks.items():
+            for frame in set(stack[1:]):
+                cumulative[frame] += seen
+            own[stack[-1]] += seen
+        duration = self.rounds * self.interval
+        return [dict(function=frame,
+                     cumulativeSec=round(seen * self.interval, 6),
+                     selfSec=round(own[frame] * self.interval, 6),
+                     cumulativePct=round(100.0 * seen * self.interval / duration, 1) if duration else 0.0)
+                for frame, seen in cumulative.most_common(count)]
+
+
+def sample(seconds: float, interval: float = 0.005) -> Samples:
+    """ Sample the stacks of every thread but the calling one for seconds """
+    samples = Samples(interval)
+    own_id = threading.get_ident()
+    names = {}
+    stop_at = time.monotonic() + seconds
+    while time.monotonic() < stop_at:
+        for thread_id, frame in sys._current_frames().items():  # pylint: disable=protected-access
+            if thread_id == own_id:
+                continue
+            if thread_id not in names:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            samples.stacks[_stack(names.get(thread_id, str(thread_id)), frame)] += 1
+        samples.rounds += 1
+        time.sleep(interval)
+    return samples
+
+
+def _stack(thread_name: str, frame) -> tuple:
+    """ The frames of a stack, outermost first, below a root named for the thread """
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append('{} ({}:{})'.format(code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    frames.append(thread_name)
+    frames.reverse()
+    return tuple(frames)
+
+
+class RequestProfile:
+    """
+    cProfile for one request. Under asyncio, other requests served by the
+    event loop meanwhile are profiled too.
+    """
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+        self._started = time.perf_counter()
+        self.duration = None
+
+    def start(self) -> 'RequestProfile':
+        self._profile.enable()
+        return self
+
+    def stop(self) -> None:
+        self._profile.disable()
+        self.duration = time.perf_counter() - self._started
+
+    def report(self, count: int) -> str:
+        """ The count functions with the most cumulative time, as a pstats table """
+        output = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=output)
+        stats.sort_stats('cumulative').print_stats(count)
+        return output.getvalue()
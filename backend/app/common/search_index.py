@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+A thread safe, in-process prefix search index.
+
+Documents are indexed by the words (runs of letters and digits, lower cased)
+of a few weighted text fields::
+
+    index = SearchIndex(dict(lastName=3.0, city=1.0))
+    index.rebuild((str(doc['_id']), doc) for doc in cursor)
+    index.add('5970fc55f33a80de48ba7a54', {'lastName': 'Jenkins', 'city': 'Town & Country'})
+    total, page = index.search('jen tow', limit=20)
+
+Every word of a query must start a word of a matching document. A document
+scores, for each query word, the weight of the best field holding a word it
+starts, scaled by how much of that word it covers, so exact words rank above
+longer completions and lastName above city. Results are ordered by score,
+then id.
+
+The index keeps the words in a sorted array, so the words starting with a
+prefix are one bisect away, and each word's postings (document id -> weight)
+in a dict. The query word with the fewest postings is looked up; the others are
+checked against each candidate's own words. A lookup costs the candidates it
+finds, not the size of the index.
+
+rebuild() builds new structures while the index keeps serving. Documents
+written meanwhile are copied to the new structures, and their versions read
+by the rebuild, which may be older, are ignored.
+"""
+import bisect
+import heapq
+import re
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+_WORD = re.compile(r'[^\W_]+')
+# Sorts after every word starting with a given prefix
+_LAST = '\U0010ffff'
+
+
+def words(text: str) -> List[str]:
+    """ The lower cased words of text """
+    return _WORD.findall(text.lower())
+
+
+class _Postings:
+    """ The index structures; not thread safe """
+    def __init__(self, fields: Dict[str, float]):
+        self.fields = fields
+        # sorted words, for prefix ranges
+        self.words = []
+        # word -> {document id: weight}
+        self.postings = {}
+        # document id -> its (word, weight) pairs, sorted
+        self.weights = {}
+        # document id -> indexed fields
+        self.documents = {}
+
+    def add(self, doc_id: str, document: Dict) -> None:
+        self.remove(doc_id)
+        stored = {field: document[field] for field in self.fields
+                  if isinstance(document.get(field), str)}
+        weights = {}
+        for field, value in stored.items():
+            weight = self.fields[field]
+            for word in words(value):
+                if weights.get(word, 0) < weight:
+                    weights[word] = weight
+        self.documents[doc_id] = stored
+        self.weights[doc_id] = tuple(sorted(weights.items()))
+        for word, weight in weights.items():
+            postings = self.postings.get(word)
+            if postings is None:
+                postings = self.postings[word] = {}
+                bisect.insort(self.words, word)
+            postings[doc_id] = weight
+
+    def remove(self, doc_id: str) -> None:
+        weights = self.weights.pop(doc_id, None)
+        if weights is None:
+            return
+        del self.documents[doc_id]
+        for word, _ in weights:
+            postings = self.postings[word]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+
+    def span(self, prefix: str) -> Tuple[int, int]:
+        """ The range of self.words starting with prefix """
+        return (bisect.bisect_left(self.words, prefix),
+                bisect.bisect_left(self.words, prefix + _LAST))
+
+    def count(self, prefix: str) -> int:
+        """ The postings of the words starting with prefix: the cost of looking it up """
+        start, end = self.span(prefix)
+        return sum(len(self.postings[self.words[index]]) for index in range(start, end))
+
+    def lookup(self, prefix: str) -> Dict[str, float]:
+        """ Score the documents holding a word starting with prefix """
+        scores = {}
+        start, end = self.span(prefix)
+        for index in range(start, end):
+            word = self.words[index]
+            cover = len(prefix) / len(word)
+            for doc_id, weight in self.postings[word].items():
+                score = weight * (1 + cover)
+                if scores.get(doc_id, 0) < score:
+                    scores[doc_id] = score
+        return scores
+
+    def score(self, doc_id: str, prefix: str) -> float:
+        """ Score one document for prefix; 0 if no word of it starts with prefix """
+        pairs = self.weights[doc_id]
+        best = 0
+        for index in range(bisect.bisect_left(pairs, (prefix,)), len(pairs)):
+            word, weight = pairs[index]
+            if not word.startswith(prefix):
+                break
+            score = weight * (1 + len(prefix) / len(word))
+            if best < score:
+                best = score
+        return best
+
+
+class SearchIndex:
+    """ Weighted prefix search over a few text fields of each document """
+    def __init__(self, fields: Dict[str, float]):
+        self.fields = dict(fields)
+        self._lock = threading.Lock()
+        self._index = _Postings(self.fields)
+        # New structures being built by rebuild(), if any
+        self._next = None
+        # Ids written during the rebuild, whose version in self._next is current
+        self._synced = None
+        self._built = False
+        self._searches = 0
+
+    @property
+    def built(self) -> bool:
+        """ Whether the index has been built (see rebuild) """
+        return self._built
+
+    def add(self, doc_id: str, document: Dict) -> None:
+        """ Index document, replacing any earlier version """
+        with self._lock:
+            self._index.add(doc_id, document)
+            self._sync(doc_id)
+
+    def update(self, doc_id: str, fields: Dict) -> None:
+        """ Apply a partial update to an indexed document; unknown documents are ignored """
+        with self._lock:
+            stored = self._index.documents.get(doc_id)
+            if stored is not None:
+                self._index.add(doc_id, dict(stored, **fields))
+                self._sync(doc_id)
+
+    def remove(self, doc_id: str) -> None:
+        with self._lock:
+            self._index.remove(doc_id)
+            self._sync(doc_id)
+
+    def rebuild(self, documents: Iterable[Tuple[str, Dict]]) -> None:
+        """ Replace the index with documents, (id, document) pairs, e.g. read from a cursor """
+        with self.rebuilding() as load:
+            for doc_id, document in documents:
+                load(doc_id, document)
+
+    @contextmanager
+    def rebuilding(self) -> Iterator[Callable[[str, Dict], None]]:
+        """
+        rebuild() for documents read asynchronously: yields a function taking
+        each (id, document), and replaces the index with them when the block
+        completes. One rebuild runs at a time.
+        """
+        with self._lock:
+            if self._next is not None:
+                raise RuntimeError('The index is already being rebuilt')
+            self._next = _Postings(self.fields)
+            self._synced = set()
+        try:
+            yield self._load
+            with self._lock:
+                self._index = self._next
+                self._built = True
+        finally:
+            with self._lock:
+                self._next = None
+                self._synced = None
+
+    def _load(self, doc_id: str, document: Dict) -> None:
+        with self._lock:
+            # Documents written since the read began are already current
+            if doc_id not in self._synced:
+                self._next.add(doc_id, document)
+
+    def _sync(self, doc_id: str) -> None:
+        """ During a rebuild, copy the current version of doc_id to the new structures """
+        if self._next is None:
+            return
+        stored = self._index.documents.get(doc_id)
+        if stored is None:
+            self._next.remove(doc_id)
+        else:
+            self._next.add(doc_id, stored)
+        self._synced.add(doc_id)
+
+    def search(self, query: str, limit: int, offset: int = 0) -> Tuple[int, List[Dict]]:
+        """
+        The number of documents matching every word of query, and the indexed
+        fields, with '_id', of the limit best from offset on.
+        """
+        prefixes = sorted(set(words(query)))
+        with self._lock:
+            self._searches += 1
+            index = self._index
+            if not prefixes:
+                return 0, []
+            if len(prefixes) > 1:
+                prefixes.sort(key=index.count)
+            scores = index.lookup(prefixes[0])
+            for prefix in prefixes[1:]:
+                for doc_id in list(scores):
+                    score = index.score(doc_id, prefix)
+                    if score:
+                        scores[doc_id] += score
+                    else:
+                        del scores[doc_id]
+            best = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))
+            return len(scores), [dict(index.documents[doc_id], _id=doc_id)
+                                 for doc_id, _ in best[offset:]]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(built=self._built,
+                        documents=len(self._index.documents),
+                        words=len(self._index.words),
+                        searches=self._searches)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Request scoped tracing.
+
+The Tracing middleware starts a trace for each request and keeps it in a
+context variable, so code anywhere below it can add spans without passing
+the request around; context variables also isolate concurrent requests in
+threaded and asyncio workers. Spans are recorded for:
+    * parse: reading and decoding the request body (Telemetry)
+    * controller.<method>: each controller call (trace_methods)
+    * mongo.<command>: each MongoDB command (mongo_pool.CommandTimer)
+    * encode: rendering the json:api response (json_api)
+    * log: writing the request's log records (Telemetry)
+
+When the response is sent, the trace is reported:
+    * as a Server-Timing header, durations summed by span name, unless
+      TRACE_SERVER_TIMING=0
+    * as a traceparent header (W3C trace context), continuing the trace of
+      the client's traceparent if it sent one
+    * as OTLP/JSON, one ExportTraceServiceRequest per line, appended to
+      TRACE_EXPORT_FILE if it is set
+
+Examples::
+
+    from . import tracing
+
+    with tracing.span('encode'):
+        body = json_codec.dumps(document)
+"""
+import asyncio
+import functools
+import inspect
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict
+
+from . import json_codec
+from .build_info import BuildInfo
+
+_TRACE = ContextVar('trace', default=None)
+_TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+_EXPORT_LOCK = threading.Lock()
+
+
+class Span:
+    """ A timed operation; times are time.perf_counter() seconds """
+    __slots__ = ('name', 'span_id', 'parent_id', 'start', 'end', 'attributes')
+
+    def __init__(self, name: str, parent_id: str, start: float, attributes: Dict = None):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = start
+        self.end = None
+        self.attributes = attributes or {}
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class Trace:
+    """ The spans of one request, below a root span for the whole request """
+
+    def __init__(self, name: str, traceparent: str = None, attributes: Dict = None):
+        match = _TRACEPARENT.match(traceparent or '')
+        self.trace_id = match.group(1) if match else os.urandom(16).hex()
+        self.start_unix = time.time()
+        self.root = Span(name, match.group(2) if match else None, time.perf_counter(), attributes)
+        self.spans = []
+        self._open = [self.root]
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        """ The W3C traceparent naming this request's root span """
+        return '00-{}-{}-01'.format(self.trace_id, self.root.span_id)
+
+    def server_timing(self) -> str:
+        """ The Server-Timing header value: ms per span name, then the total """
+        totals = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration
+        metrics = ['{};dur={:.3f}'.format(name, seconds * 1000) for name, seconds in totals.items()]
+        metrics.append('total;dur={:.3f}'.format(self.root.duration * 1000))
+        return ', '.join(metrics)
+
+    def to_otlp(self) -> Dict:
+        """ The trace as an OTLP/JSON ExportTraceServiceRequest """
+        info = BuildInfo()
+        resource = [_attribute('service.name', info.service_name),
+                    _attribute('service.version', info.version)]
+        return {'resourceSpans': [{
+            'resource': {'attributes': resource},
+            'scopeSpans': [{
+                'scope': {'name': info.repo_name},
+                'spans': [self._otlp_span(span, kind=2 if span is self.root else 1)
+                          for span in [self.root] + self.spans]}]}]}
+
+    def _otlp_span(self, span: Span, kind: int) -> Dict:
+        result = dict(traceId=self.trace_id,
+                      spanId=span.span_id,
+                      name=span.name,
+                      kind=kind,
+                      startTimeUnixNano=str(self._unix_nanos(span.start)),
+                      endTimeUnixNano=str(self._unix_nanos(span.end)),
+                      attributes=[_attribute(key, value) for key, value in span.attributes.items()])
+        if span.parent_id:
+            result['parentSpanId'] = span.parent_id
+        return result
+
+    def _unix_nanos(self, perf: float) -> int:
+        return int((self.start_unix + perf - self.root.start) * 1000000000)
+
+
+def _attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        return dict(key=key, value=dict(boolValue=value))
+    if isinstance(value, int):
+        return dict(key=key, value=dict(intValue=str(value)))
+    return dict(key=key, value=dict(stringValue=str(value)))
+
+
+def start(name: str, traceparent: str = None, **attributes) -> Trace:
+    """ Start the current context's trace """
+    trace = Trace(name, traceparent, attributes)
+    trace._token = _TRACE.set(trace)  # pylint: disable=protected-access
+    return trace
+
+
+def finish(trace: Trace) -> None:
+    """ End the trace's root span and leave the context without a trace """
+    trace.root.end = time.perf_counter()
+    if trace._token is not None:  # pylint: disable=protected-access
+        _TRACE.reset(trace._token)  # pylint: disable=protected-access
+        trace._token = None  # pylint: disable=protected-access
+
+
+def current() -> Trace:
+    """ The current context's trace, or None outside a request """
+    return _TRACE.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """ Time the enclosed block as a span of the current trace, if there is one """
+    trace = _TRACE.get()
+    if trace is None:
+        yield
+        return
+    item = Span(name, trace._open[-1].span_id, time.perf_counter(), attributes)  # pylint: disable=protected-access
+    trace._open.append(item)  # pylint: disable=protected-access
+    try:
+        yield
+    finally:
+        item.end = time.perf_counter()
+        trace._open.remove(item)  # pylint: disable=protected-access
+        trace.spans.append(item)
+
+
+def record(name: str, duration: float, **attributes) -> None:
+    """ Add a span that ended now and lasted duration seconds, e.g. from an event listener """
+    trace = _TRACE.get()
+    if trace is None:
+        return
+    end = time.perf_counter()
+    item = Span(name, trace._open[-1].span_id, end - duration, attributes)  # pylint: disable=protected-access
+    item.end = end
+    trace.spans.append(item)
+
+
+def trace_methods(prefix: str, exclude: tuple = ()):
+    """
+    Class decorator: run each public method defined by the class, plain or
+    coroutine, in a span named prefix.<method>. Static and class methods are
+    left alone, as are those in exclude, e.g. methods returning iterators
+    whose work is only done as they are consumed.
+    """
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude or not inspect.isfunction(method):
+                continue
+            setattr(cls, name, _traced('{}.{}'.format(prefix, name), method))
+        return cls
+    return decorate
+
+
+def _traced(name: str, method):
+    if asyncio.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def traced_coroutine(*args, **kwargs):
+            with span(name):
+                return await method(*args, **kwargs)
+        return traced_coroutine
+
+    @functools.wraps(method)
+    def traced(*args, **kwargs):
+        with span(name):
+            return method(*args, **kwargs)
+    return traced
+
+
+def export(trace: Trace) -> None:
+    """ Append the trace to TRACE_EXPORT_FILE, if set """
+    path = os.getenv('TRACE_EXPORT_FILE')
+    if not path:
+        return
+    line = json_codec.dumps(trace.to_otlp()) + '\n'
+    with _EXPORT_LOCK:
+        with open(path, 'a', encoding='utf-8') as output:
+            output.write(line)
+
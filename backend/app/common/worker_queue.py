@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+A bounded queue per process, drained by a background thread.
+
+Shared by LogQueue (log_queue) and InsertQueue (repository.write_behind).
+The queue and its thread are created on first use in each process, so a
+gunicorn worker never inherits a dead thread from the master across fork: a
+queue created before the fork is left to the parent.
+
+The drain function runs on the thread, forever. It takes items from the
+queue, handles them and sets each threading.Event it takes once the items
+queued before it are handled: flush() queues such an Event and waits for it.
+
+Examples::
+
+    def drain(items: queue.Queue) -> None:
+        while True:
+            item = items.get()
+            if isinstance(item, threading.Event):
+                item.set()
+            else:
+                handle(item)
+
+    writer = WorkerQueue('item-writer', drain)
+    writer.queue(lambda: 100).put(item)
+    writer.flush()
+"""
+import os
+import queue
+import threading
+from typing import Callable
+
+
+class WorkerQueue:
+    """ A process's queue, and the thread draining it """
+    def __init__(self, name: str, drain: Callable[[queue.Queue], None]):
+        """
+        Args:
+            name: the name of the thread
+            drain: run by the thread with the queue
+        """
+        self._name = name
+        self._drain = drain
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+
+    def queue(self, prepare: Callable[[], int]) -> queue.Queue:
+        """
+        This process's queue, starting its thread on first use. Before that,
+        prepare is called, under a lock: it resets its owner's state for the
+        new queue, and returns the queue's max size.
+        """
+        items = self._queue
+        if items is not None and self._pid == os.getpid():
+            return items
+        with self._lock:
+            if self._queue is None or self._pid != os.getpid():
+                self._queue = queue.Queue(prepare())
+                self._pid = os.getpid()
+                threading.Thread(target=self._drain, args=(self._queue,),
+                                 name=self._name, daemon=True).start()
+            return self._queue
+
+    def reset(self) -> None:
+        """ Start over: the next queue() creates a new queue. Flush first to keep queued items """
+        with self._lock:
+            self._queue = None
+            self._pid = None
+
+    def flush(self, timeout: float) -> bool:
+        """
+        Wait until every item queued so far in this process is handled.
+        Returns False if that takes longer than timeout seconds.
+        """
+        items = self._queue
+        if items is None or self._pid != os.getpid():
+            return True
+        handled = threading.Event()
+        try:
+            items.put(handled, timeout=timeout)
+        except queue.Full:
+            return False
+        return handled.wait(timeout)
+
+    def qsize(self) -> int:
+        """ Items waiting in this process's queue """
+        items = self._queue
+        return items.qsize() if items is not None and self._pid == os.getpid() else 0
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Cache coherence across workers and replicas.
+
+With CONTACTS_COHERENCE set (see change_feed), each worker follows every
+write to the contacts collection on a daemon thread and applies it to its
+in-process state: the cached contact is dropped and the search index
+updated, within a poll interval or a change stream round trip of the write,
+wherever it was made. That makes the contacts cache safe to enable for
+traffic mixing reads and writes. When the feed has missed changes, the
+whole cache is dropped and the search index rebuilt.
+
+lagSec in stats() is how long after it was written the latest change was
+applied; a lag that keeps growing means this worker cannot keep up.
+
+The thread is started by start(), at worker startup; a process forked
+afterwards starts its own.
+"""
+import os
+import threading
+from datetime import datetime
+from typing import Dict
+
+import falcon
+
+from ..common.logging import Logger
+from ..repository import change_feed
+from .contacts_controller import ContactsController
+
+
+class Coherence:
+    """
+    The process-wide change follower.
+
+    All members are class level: there is at most one follower per process.
+    """
+    _LOG = Logger(__name__)
+    _LOCK = threading.Lock()
+    _PID = None
+    _STOPPED = None
+    _FEED = None
+    _THREAD = None
+    _EVENTS = 0
+    _RESYNCS = 0
+    _ERRORS = 0
+    _LAG_SEC = 0.0
+    _MAX_LAG_SEC = 0.0
+
+    @staticmethod
+    def start() -> None:
+        """ Start following changes, if CONTACTS_COHERENCE is set and this process isn't yet """
+        if change_feed.mode() == 'off':
+            return
+        with Coherence._LOCK:
+            if Coherence._PID == os.getpid():
+                return
+            Coherence._PID = os.getpid()
+            Coherence._STOPPED = threading.Event()
+            # The search index only needs the searched fields; the cache only ids
+            fields = ContactsController.SEARCH_FIELDS \
+                if ContactsController.search_backend() == 'memory' else ()
+            Coherence._FEED = change_feed.ContactsChangeFeed(fields)
+            Coherence._THREAD = threading.Thread(target=Coherence._follow,
+                                                 args=(Coherence._FEED, Coherence._STOPPED),
+                                                 name='contacts-coherence', daemon=True)
+            Coherence._THREAD.start()
+
+    @staticmethod
+    def stop(timeout: float = 5.0) -> None:
+        """ Stop following changes, waiting up to timeout seconds for the thread to finish """
+        with Coherence._LOCK:
+            if Coherence._STOPPED is not None:
+                Coherence._STOPPED.set()
+            thread = Coherence._THREAD if Coherence._PID == os.getpid() else None
+            Coherence._PID = None
+            Coherence._THREAD = None
+        if thread is not None:
+            thread.join(timeout)
+
+    @staticmethod
+    def stats() -> Dict:
+        """ A snapshot of the follower's counters """
+        feed = Coherence._FEED
+        with Coherence._LOCK:
+            return dict(mode=change_feed.mode(),
+                        source=feed.source if feed is not None else None,
+                        running=Coherence._PID == os.getpid(),
+                        events=Coherence._EVENTS,
+                        resyncs=Coherence._RESYNCS,
+                        errors=Coherence._ERRORS + (feed.errors if feed is not None else 0),
+                        lagSec=Coherence._LAG_SEC,
+                        maxLagSec=Coherence._MAX_LAG_SEC)
+
+    @staticmethod
+    def _follow(feed: change_feed.ContactsChangeFeed, stopped: threading.Event) -> None:
+        controller = ContactsController()
+        for change in feed.follow(stopped):
+            if change is change_feed.RESYNC:
+                Coherence._resync(controller)
+            else:
+                controller.apply_change(change.contact_id, change.contact)
+                Coherence._applied(change)
+
+    @staticmethod
+    def _resync(controller: ContactsController) -> None:
+        Coherence._LOG.warning("Contact changes were missed; resynchronizing")
+        try:
+            controller.resync()
+        except (falcon.HTTPError, RuntimeError) as ex:
+            # The cache is dropped; the search index is left as it was
+            with Coherence._LOCK:
+                Coherence._ERRORS += 1
+            Coherence._LOG.warning("Could not rebuild contacts search index: {}".format(
+                getattr(ex, 'title', ex)))
+        with Coherence._LOCK:
+            Coherence._RESYNCS += 1
+
+    @staticmethod
+    def _applied(change: change_feed.Change) -> None:
+        lag = max(0.0, (datetime.utcnow() - change.at).total_seconds())
+        with Coherence._LOCK:
+            Coherence._EVENTS += 1
+            Coherence._LAG_SEC = round(lag, 3)
+            Coherence._MAX_LAG_SEC = max(Coherence._MAX_LAG_SEC, Coherence._LAG_SEC)
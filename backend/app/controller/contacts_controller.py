@@ -2,42 +2,216 @@
 """
 Orchestration for operations on the contacts collection.
 
-This is simply pass-through now, but left as a place-holder as an
-example of a more robust service.
+Mostly pass-through, except for single contact reads which may be served from
+an in-process read-through cache. The cache is shared by every controller in
+the worker process and is disabled by default; enable it with:
+    * CONTACTS_CACHE_SIZE: max cached contacts per worker (default 0: disabled)
+    * CONTACTS_CACHE_TTL_SEC: max age of a cached contact (default 30)
+
+Writes through this worker invalidate the cached contact; writes through other
+workers or replicas are only seen once the entry expires, unless
+CONTACTS_COHERENCE follows them (see coherence).
+
+Searches are served, per CONTACTS_SEARCH, by:
+    * memory (default): an in-process prefix index (see search_index) of the
+      SEARCH_FIELDS of every contact, built at worker startup, or by the first
+      search if the datastore was down then, and updated by writes through
+      this worker, or by every worker with CONTACTS_COHERENCE
+    * text: a MongoDB text index over the same fields, consistent across
+      workers and replicas but matching whole words only
+    * off: no search
 """
-from typing import List, Dict
+import os
+import threading
+from typing import Dict, Iterator, List, Tuple
 
 import falcon
 
+from ..common import tracing
+from ..common.cache import LruCache
+from ..common.config import env_float, env_int
 from ..common.logging import LoggerMixin
-from ..repository.contacts_repository import ContactsRepoMongo
+from ..common.search_index import SearchIndex
+from ..repository.contacts_repository import BulkOperation, ContactsRepoMongo, ListQuery
+from ..repository.write_behind import InsertQueue
 
 
+@tracing.trace_methods('controller', exclude=('iter_list',))
 class ContactsController(LoggerMixin):
     """
     Controllers orchestrate calls to other controllers and repositories
     to complete API requests.
     """
-    def __init__(self):
-        self._repo = ContactsRepoMongo()
+    _CACHE = LruCache(max_size=env_int('CONTACTS_CACHE_SIZE', 0),
+                      ttl_sec=env_float('CONTACTS_CACHE_TTL_SEC', 30.0))
+    SEARCH_BACKENDS = ('memory', 'text', 'off')
+    # Searched fields and their weights: matches in heavier fields rank first
+    SEARCH_FIELDS = dict(lastName=3.0, firstName=3.0, companyName=2.0, email=2.0, city=1.0)
+    SEARCH_BATCH_SIZE = 1000
+    _SEARCH = SearchIndex(SEARCH_FIELDS)
+    _SEARCH_LOCK = threading.Lock()
+
+    def __init__(self, repo: ContactsRepoMongo = None):
+        self._repo = repo if repo is not None else ContactsRepoMongo()
+        self._search_backend = self.search_backend()
+        InsertQueue.on_failed(ContactsController._unindex_failed)
+
+    @staticmethod
+    def cache_stats() -> Dict:
+        return ContactsController._CACHE.stats()
+
+    @staticmethod
+    def search_stats() -> Dict:
+        return ContactsController._SEARCH.stats()
+
+    @staticmethod
+    def search_backend() -> str:
+        """ CONTACTS_SEARCH: memory (default), text or off """
+        backend = os.getenv('CONTACTS_SEARCH', 'memory')
+        if backend not in ContactsController.SEARCH_BACKENDS:
+            raise ValueError('CONTACTS_SEARCH must be one of {}, not "{}"'.format(
+                ', '.join(ContactsController.SEARCH_BACKENDS), backend))
+        return backend
+
+    def bulk_write(self, req: falcon.Request, operations: List[BulkOperation],
+                   ordered: bool) -> Dict[int, Dict]:
+        try:
+            results = self._repo.bulk_write(req, operations, ordered)
+            self._index_bulk(operations, results)
+            return results
+        finally:
+            for operation in operations:
+                if operation.object_id is not None:
+                    self._CACHE.invalidate(self._cache_key(operation.object_id))
 
     def create_item(self, req: falcon.Request):
-        return self._repo.create_item(req)
+        object_id = self._repo.create_item(req)
+        self._index(object_id, req.context['body_json'])
+        return object_id
+
+    def queue_item(self, req: falcon.Request) -> str:
+        object_id = self._repo.queue_item(req)
+        self._index(object_id, req.context['body_json'])
+        return object_id
 
     def delete_item(self, req: falcon.Request, contact_id: str) -> None:
-        self._repo.delete_item(req, contact_id)
+        try:
+            self._repo.delete_item(req, contact_id)
+            self._index(contact_id, None)
+        finally:
+            self._CACHE.invalidate(self._cache_key(contact_id))
 
     def find_one(self) -> Dict:
         return self._repo.find_one()
 
-    def get_list(self, req: falcon.Request) -> List[Dict]:
-        return self._repo.get_list(req)
+    def get_list(self, req: falcon.Request, limit: int, after: str = None,
+                 query: ListQuery = None) -> List[Dict]:
+        return self._repo.get_list(req, limit, after, query)
+
+    def iter_list(self, req: falcon.Request, batch_size: int) -> Iterator[Dict]:
+        return self._repo.iter_list(req, batch_size)
 
     def get_item(self, req: falcon.Request, contact_id: str) -> Dict:
+        contact = self._CACHE.get_or_load(self._cache_key(contact_id),
+                                          lambda: self._repo.get_item(req, contact_id))
+        # Cached contacts are shared between threads; callers get their own copy
+        return dict(contact)
+
+    def get_current_item(self, req: falcon.Request, contact_id: str) -> Dict:
+        """ The contact as stored now, bypassing the cache, e.g. to check an If-Match against """
         return self._repo.get_item(req, contact_id)
 
-    def update_item(self, req: falcon.Request, contact_id: str) -> Dict:
-        return self._repo.update_item(req, contact_id)
+    def update_item(self, req: falcon.Request, contact_id: str, expected: Dict = None) -> Dict:
+        try:
+            contact = self._repo.update_item(req, contact_id, expected)
+            self._index(contact_id, contact)
+            return contact
+        finally:
+            self._CACHE.invalidate(self._cache_key(contact_id))
+
+    def replace_item(self, req: falcon.Request, contact_id: str, expected: Dict = None) -> Dict:
+        try:
+            contact = self._repo.replace_item(req, contact_id, expected)
+            self._index(contact_id, contact)
+            return contact
+        finally:
+            self._CACHE.invalidate(self._cache_key(contact_id))
+
+    def prepare_search(self) -> None:
+        """
+        Build the search index, or ensure the text index, per CONTACTS_SEARCH.
+        Called at worker startup; a datastore that is down is logged, and the
+        index is built by the first search instead.
+        """
+        if self._search_backend == 'text':
+            self._repo.ensure_text_index(self.SEARCH_FIELDS)
+        elif self._search_backend == 'memory':
+            try:
+                self._build_search_index()
+            except falcon.HTTPError as ex:
+                self._warning("Could not build contacts search index: {}".format(ex.title))
+
+    def search(self, req: falcon.Request, query: str, limit: int,
+               offset: int = 0) -> Tuple[int, List[Dict]]:
+        """ The number of contacts matching query, and the limit best from offset on """
+        if self._search_backend == 'text':
+            return self._repo.search_text(req, query, self.SEARCH_FIELDS, limit, offset)
+        if not self._SEARCH.built:
+            self._build_search_index()
+        return self._SEARCH.search(query, limit, offset)
+
+    def apply_change(self, contact_id: str, contact: Dict) -> None:
+        """
+        Apply a write made by any worker (see coherence): drop the cached
+        contact and index the contact as written, or drop it if None.
+        """
+        self._CACHE.invalidate(self._cache_key(contact_id))
+        self._index(contact_id, contact)
+
+    def resync(self) -> None:
+        """ Writes were missed: drop every cached contact and rebuild the search index """
+        self._CACHE.clear()
+        if self._search_backend == 'memory' and self._SEARCH.built:
+            self._build_search_index(force=True)
+
+    def _build_search_index(self, force: bool = False) -> None:
+        with self._SEARCH_LOCK:
+            if force or not self._SEARCH.built:
+                self._SEARCH.rebuild((str(contact['_id']), contact) for contact in
+                                     self._repo.iter_fields(self.SEARCH_FIELDS, self.SEARCH_BATCH_SIZE))
+                self._info("Contacts search index built", **self._SEARCH.stats())
+
+    def _index(self, contact_id: str, contact: Dict) -> None:
+        """ Index the contact as written, or drop it if None """
+        if self._search_backend != 'memory':
+            return
+        if contact is None:
+            self._SEARCH.remove(contact_id.lower())
+        else:
+            self._SEARCH.add(contact_id.lower(), contact)
+
+    @staticmethod
+    def _unindex_failed(contact_ids: List[str]) -> None:
+        """ Queued contacts were indexed when queued; drop those that could not be written """
+        for contact_id in contact_ids:
+            ContactsController._SEARCH.remove(contact_id)
+
+    def _index_bulk(self, operations: List[BulkOperation], results: Dict[int, Dict]) -> None:
+        """ Index the contacts written by the successful operations of a bulk write """
+        if self._search_backend != 'memory':
+            return
+        for operation in operations:
+            result = results.get(operation.index)
+            if result is None or 'id' not in result:
+                continue
+            if operation.op == 'add':
+                self._SEARCH.add(result['id'], operation.attributes)
+            elif operation.op == 'update':
+                self._SEARCH.update(operation.object_id.lower(), operation.attributes)
+            else:
+                self._SEARCH.remove(operation.object_id.lower())
 
-    def replace_item(self, req: falcon.Request, contact_id: str) -> Dict:
-        return self._repo.replace_item(req, contact_id)
+    @staticmethod
+    def _cache_key(contact_id: str) -> str:
+        # ObjectId hex strings are case insensitive
+        return contact_id.lower()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Orchestration for operations on the contacts collection, for the asyncio (ASGI) app.
+
+Mirrors ContactsController, awaiting the asynchronous repository. The contacts
+cache and search index are the same process-wide ones ContactsController uses.
+"""
+import asyncio
+from typing import AsyncIterator, Dict, List, Tuple
+
+import falcon
+
+from ..common import tracing
+from ..repository.contacts_repository import BulkOperation, ListQuery
+from ..repository.contacts_repository_async import AsyncContactsRepoMongo
+from .contacts_controller import ContactsController
+
+
+@tracing.trace_methods('controller', exclude=('iter_list',))
+class AsyncContactsController(ContactsController):
+    """
+    Controllers orchestrate calls to other controllers and repositories
+    to complete API requests.
+    """
+    _SEARCH_BUILD = None
+
+    def __init__(self, repo: AsyncContactsRepoMongo = None):
+        super(AsyncContactsController, self).__init__(
+            repo if repo is not None else AsyncContactsRepoMongo())
+
+    async def bulk_write(self, req: falcon.Request, operations: List[BulkOperation],
+                         ordered: bool) -> Dict[int, Dict]:
+        try:
+            results = await self._repo.bulk_write(req, operations, ordered)
+            self._index_bulk(operations, results)
+            return results
+        finally:
+            for operation in operations:
+                if operation.object_id is not None:
+                    self._CACHE.invalidate(self._cache_key(operation.object_id))
+
+    async def create_item(self, req: falcon.Request):
+        object_id = await self._repo.create_item(req)
+        self._index(object_id, req.context['body_json'])
+        return object_id
+
+    async def queue_item(self, req: falcon.Request) -> str:
+        object_id = await self._repo.queue_item(req)
+        self._index(object_id, req.context['body_json'])
+        return object_id
+
+    async def delete_item(self, req: falcon.Request, contact_id: str) -> None:
+        try:
+            await self._repo.delete_item(req, contact_id)
+            self._index(contact_id, None)
+        finally:
+            self._CACHE.invalidate(self._cache_key(contact_id))
+
+    async def find_one(self) -> Dict:
+        return await self._repo.find_one()
+
+    async def get_list(self, req: falcon.Request, limit: int, after: str = None,
+                       query: ListQuery = None) -> List[Dict]:
+        return await self._repo.get_list(req, limit, after, query)
+
+    async def iter_list(self, req: falcon.Request, batch_size: int) -> AsyncIterator[Dict]:
+        return await self._repo.iter_list(req, batch_size)
+
+    async def get_item(self, req: falcon.Request, contact_id: str) -> Dict:
+        contact = await self._CACHE.get_or_load_async(
+            self._cache_key(contact_id), lambda: self._repo.get_item(req, contact_id))
+        return dict(contact)
+
+    async def get_current_item(self, req: falcon.Request, contact_id: str) -> Dict:
+        return await self._repo.get_item(req, contact_id)
+
+    async def update_item(self, req: falcon.Request, contact_id: str,
+                          expected: Dict = None) -> Dict:
+        try:
+            contact = await self._repo.update_item(req, contact_id, expected)
+            self._index(contact_id, contact)
+            return contact
+        finally:
+            self._CACHE.invalidate(self._cache_key(contact_id))
+
+    async def replace_item(self, req: falcon.Request, contact_id: str,
+                           expected: Dict = None) -> Dict:
+        try:
+            contact = await self._repo.replace_item(req, contact_id, expected)
+            self._index(contact_id, contact)
+            return contact
+        finally:
+            self._CACHE.invalidate(self._cache_key(contact_id))
+
+    async def prepare_search(self) -> None:
+        if self._search_backend == 'text':
+            await self._repo.ensure_text_index(self.SEARCH_FIELDS)
+        elif self._search_backend == 'memory':
+            try:
+                await self._await_search_index()
+            except falcon.HTTPError as ex:
+                self._warning("Could not build contacts search index: {}".format(ex.title))
+
+    async def search(self, req: falcon.Request, query: str, limit: int,
+                     offset: int = 0) -> Tuple[int, List[Dict]]:
+        if self._search_backend == 'text':
+            return await self._repo.search_text(req, query, self.SEARCH_FIELDS, limit, offset)
+        if not self._SEARCH.built:
+            await self._await_search_index()
+        return self._SEARCH.search(query, limit, offset)
+
+    async def resync(self) -> None:
+        self._CACHE.clear()
+        if self._search_backend == 'memory' and self._SEARCH.built:
+            await self._await_search_index(force=True)
+
+    async def _await_search_index(self, force: bool = False) -> None:
+        """
+        Build the index, or wait for the build another request started;
+        with force, rebuild it once the build in progress, if any, is done
+        """
+        build = AsyncContactsController._SEARCH_BUILD
+        while force and build is not None and not build.done():
+            await asyncio.wait([build])
+            build = AsyncContactsController._SEARCH_BUILD
+        if force or build is None or build.done():
+            build = asyncio.ensure_future(self._rebuild_search_index(force))
+            AsyncContactsController._SEARCH_BUILD = build
+        await asyncio.shield(build)
+
+    async def _rebuild_search_index(self, force: bool = False) -> None:
+        if self._SEARCH.built and not force:
+            return
+        with self._SEARCH.rebuilding() as load:
+            async for contact in self._repo.iter_fields(self.SEARCH_FIELDS, self.SEARCH_BATCH_SIZE):
+                load(str(contact['_id']), contact)
+        self._info("Contacts search index built", **self._SEARCH.stats())
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Background health checks.
+
+Health probes report a cached verdict instead of querying MongoDB on every
+call. Each worker checks its upstreams every HEALTH_CHECK_INTERVAL_SEC
+(default 5) seconds, so however often probes arrive, and from however many
+replicas' schedulers, each worker runs one round of checks per interval.
+
+A probe may ask for a fresh check (see health.Liveness). Fresh checks run
+at most once per HEALTH_FRESH_MIN_INTERVAL_SEC (default 1) seconds per check,
+and concurrent requests for one share it; otherwise the cached verdict is
+returned.
+
+HealthChecker runs the checks on a daemon thread, started by the first probe
+in each process, so a worker never inherits a dead thread across fork.
+AsyncHealthChecker runs coroutine checks as a task on the event loop of the
+ASGI app; stop() it on lifespan shutdown.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import namedtuple
+from typing import Callable, Dict
+
+import falcon
+
+from ..common.config import env_float
+from ..common.logging import LoggerMixin
+
+# The result of one check.
+#   ok: whether the check passed
+#   checked_at: time.monotonic() when it completed
+#   duration_micros: how long it took
+#   error: why it failed, None if ok
+Verdict = namedtuple('Verdict', 'ok checked_at duration_micros error')
+
+
+class HealthChecker(LoggerMixin):
+    """
+    Runs named checks in the background and caches their verdicts. A check
+    is a callable that raises if the upstream is unhealthy.
+    """
+    def __init__(self, checks: Dict[str, Callable[[], object]]):
+        super(HealthChecker, self).__init__()
+        self.interval = env_float('HEALTH_CHECK_INTERVAL_SEC', 5.0)
+        self.fresh_interval = env_float('HEALTH_FRESH_MIN_INTERVAL_SEC', 1.0)
+        self._checks = checks
+        self._verdicts = {}
+        self._locks = {name: threading.Lock() for name in checks}
+        self._pid = None
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def verdict(self, name: str, fresh: bool = False) -> Verdict:
+        """ The latest verdict of the named check, checking now if fresh or never checked """
+        self._start()
+        verdict = self._verdicts.get(name)
+        if verdict is None or fresh and self._age(verdict) >= self.fresh_interval:
+            with self._locks[name]:
+                # Another request may have checked while we waited
+                latest = self._verdicts.get(name)
+                if latest is verdict:
+                    latest = self._run(name)
+                verdict = latest
+        return verdict
+
+    @staticmethod
+    def age_millis(verdict: Verdict) -> int:
+        return int(HealthChecker._age(verdict) * 1000)
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    @staticmethod
+    def _age(verdict: Verdict) -> float:
+        return time.monotonic() - verdict.checked_at
+
+    def _start(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._stopped = threading.Event()
+                threading.Thread(target=self._loop, args=(self._stopped,),
+                                 name='health-checker', daemon=True).start()
+
+    def _loop(self, stopped: threading.Event) -> None:
+        while not stopped.wait(self.interval):
+            for name in self._checks:
+                with self._locks[name]:
+                    self._run(name)
+
+    def _run(self, name: str) -> Verdict:
+        start = time.perf_counter()
+        try:
+            self._checks[name]()
+            error = None
+        except falcon.HTTPError as ex:
+            error = ex.description or ex.title
+        except Exception as ex:  # pylint: disable=broad-except
+            error = str(ex) or type(ex).__name__
+        return self._store(name, start, error)
+
+    def _store(self, name: str, start: float, error: str) -> Verdict:
+        now = time.monotonic()
+        verdict = Verdict(error is None, now, int((time.perf_counter() - start) * 1000000), error)
+        previous = self._verdicts.get(name)
+        if previous is not None and previous.ok != verdict.ok:
+            self._info("Health check {} is now {}".format(name, 'ok' if verdict.ok else 'failing'),
+                       error=error)
+        self._verdicts[name] = verdict
+        return verdict
+
+
+class AsyncHealthChecker(HealthChecker):
+    """ HealthChecker for coroutine checks, run as a task on the event loop """
+    def __init__(self, checks: Dict[str, Callable[[], object]]):
+        super(AsyncHealthChecker, self).__init__(checks)
+        self._async_locks = None
+        self._task = None
+
+    async def verdict(self, name: str, fresh: bool = False) -> Verdict:
+        self._start()
+        verdict = self._verdicts.get(name)
+        if verdict is None or fresh and self._age(verdict) >= self.fresh_interval:
+            async with self._async_locks[name]:
+                latest = self._verdicts.get(name)
+                if latest is verdict:
+                    latest = await self._run(name)
+                verdict = latest
+        return verdict
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        self._task = None
+
+    def _start(self) -> None:
+        if self._task is None:
+            self._async_locks = {name: asyncio.Lock() for name in self._checks}
+            self._task = asyncio.ensure_future(self._loop_async())
+
+    async def _loop_async(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            for name in self._checks:
+                async with self._async_locks[name]:
+                    await self._run(name)
+
+    async def _run(self, name: str) -> Verdict:
+        start = time.perf_counter()
+        try:
+            await self._checks[name]()
+            error = None
+        except falcon.HTTPError as ex:
+            error = ex.description or ex.title
+        except Exception as ex:  # pylint: disable=broad-except
+            error = str(ex) or type(ex).__name__
+        return self._store(name, start, error)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Gunicorn server hooks.
+
+Per-worker resources that must not be shared across fork are created here.
+Add the following to the gunicorn start command to use these hooks::
+
+    --config python:app.gunicorn_conf
+
+The metrics directory (PROMETHEUS_MULTIPROC_DIR) is cleared when gunicorn
+starts, and the live gauges of each worker that exits are dropped. So are the
+admission control file (ADMISSION_DIR) and the requests each exiting worker
+had in progress.
+
+With SERVER_MODE=asgi the workers run app/asgi.py, which creates its Motor
+client on lifespan startup, so no synchronous client is created here.
+
+REFERENCES:
+    http://docs.gunicorn.org/en/stable/settings.html#server-hooks
+"""
+import os
+
+from app.common import metrics
+from app.common.admission import Admission
+from app.common.log_queue import LogQueue
+from app.controller.coherence import Coherence
+from app.repository.mongo_pool import MongoPool
+from app.repository.write_behind import InsertQueue
+
+
+def _is_asgi() -> bool:
+    return os.getenv('SERVER_MODE', 'wsgi') == 'asgi'
+
+
+def on_starting(_) -> None:
+    """ Called in the master process before the workers are started """
+    metrics.clear_multiprocess_dir()
+    Admission.clear_shared_dir()
+
+
+def post_fork(_, __) -> None:
+    """ Called in each worker just after it is forked, before the app is loaded """
+    if not _is_asgi():
+        MongoPool.initialize()
+
+
+def worker_exit(_, __) -> None:
+    """ Called in each worker just before it exits """
+    Coherence.stop()
+    # Write queued contacts while the client is still open
+    InsertQueue.flush()
+    MongoPool.close()
+    LogQueue.flush()
+
+
+def child_exit(_, worker) -> None:
+    """ Called in the master process after a worker exits """
+    metrics.mark_process_dead(worker.pid)
+    Admission.mark_process_dead(worker.pid)
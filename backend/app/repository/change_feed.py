@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+The feed of changes to the contacts collection, made by any worker or replica.
+
+CONTACTS_COHERENCE selects where changes are read from:
+    * off (default): nowhere; in-process caches only see this worker's writes
+    * stream: a MongoDB change stream. Needs a replica set (or sharded
+      cluster); a single member replica set will do
+    * poll: every CONTACTS_COHERENCE_POLL_SEC (default 1) seconds, the
+      contacts whose updatedAt is recent, and the tombstones of deleted
+      contacts (see ContactsRepoMongo). Works with a standalone mongod
+    * auto: stream, or poll if the server does not support change streams
+
+Every write stamps the contact's updatedAt. Polls re-read the last
+CONTACTS_COHERENCE_POLL_OVERLAP_SEC (default 5) seconds of changes, so writes
+committed late, or stamped by a server whose clock is behind, are not missed.
+With poll or auto, deletes record a tombstone, kept for
+CONTACTS_COHERENCE_TOMBSTONE_SEC (default 86400) seconds; every worker and
+replica sharing a datastore must use the same setting.
+
+The change stream is resumed after connection failures. When changes were
+missed, because the resume token has fallen off the oplog, the collection was
+dropped, or polling stopped for longer than tombstones are kept, the feed
+yields RESYNC and the consumer must reload whatever it derived from the
+collection.
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator
+
+from pymongo import ASCENDING
+from pymongo import errors as pymongoErrors
+
+from ..common.config import env_float, env_int
+from ..common.logging import LoggerMixin
+from .mongo_pool import MongoPool
+
+MODES = ('off', 'stream', 'poll', 'auto')
+
+# Server error codes
+CHANGE_STREAM_HISTORY_LOST = 286
+CHANGE_STREAM_FATAL = 280
+INVALID_RESUME_TOKEN = 260
+NOT_A_REPLICA_SET = 40573
+CHANGE_STREAM_UNSUPPORTED = (NOT_A_REPLICA_SET, 40324, 136)
+
+# A change to one contact.
+#   contact_id: the contact's id, as a str
+#   contact: the contact as written, None if it was deleted
+#   at: when it was written, a naive UTC datetime
+Change = namedtuple('Change', 'contact_id contact at')
+
+# Changes were missed: reload everything derived from the collection
+RESYNC = Change(None, None, None)
+
+
+def mode() -> str:
+    """ CONTACTS_COHERENCE: off (default), stream, poll or auto """
+    result = os.getenv('CONTACTS_COHERENCE', 'off')
+    if result not in MODES:
+        raise ValueError('CONTACTS_COHERENCE must be one of {}, not "{}"'.format(
+            ', '.join(MODES), result))
+    return result
+
+
+def tombstones() -> bool:
+    """ Whether deletes must record a tombstone for polling """
+    return mode() in ('poll', 'auto')
+
+
+def tombstone_sec() -> int:
+    return env_int('CONTACTS_COHERENCE_TOMBSTONE_SEC', 86400)
+
+
+class ContactsChangeFeed(LoggerMixin):
+    """
+    Follows the contacts collection with a synchronous client; iterate
+    follow() on a background thread.
+    """
+    def __init__(self, fields: Iterable[str] = None):
+        """
+        Args:
+            fields: the contact fields changes should hold; None for all
+        """
+        super(ContactsChangeFeed, self).__init__()
+        self.mode = mode()
+        self.source = None
+        self.errors = 0
+        self._fields = list(fields) if fields is not None else None
+        self._poll_sec = env_float('CONTACTS_COHERENCE_POLL_SEC', 1.0)
+        self._overlap = timedelta(seconds=env_float('CONTACTS_COHERENCE_POLL_OVERLAP_SEC', 5.0))
+        self._tombstone_ttl = timedelta(seconds=tombstone_sec())
+
+    def follow(self, stopped: threading.Event) -> Iterator[Change]:
+        """ Yield every change until stopped is set """
+        if self.mode in ('stream', 'auto'):
+            yield from self._follow_stream(stopped)
+        if self.mode in ('poll', 'auto') and not stopped.is_set():
+            yield from self._poll(stopped)
+
+    def _follow_stream(self, stopped: threading.Event) -> Iterator[Change]:
+        """ Follow the change stream; returns early if auto and change streams are unsupported """
+        token = None
+        failures = 0
+        while not stopped.is_set():
+            try:
+                with self._contacts().watch(full_document='updateLookup', resume_after=token,
+                                            max_await_time_ms=int(self._poll_sec * 1000)) as stream:
+                    self.source = 'stream'
+                    failures = 0
+                    while not stopped.is_set():
+                        change = stream.try_next()
+                        token = stream.resume_token
+                        if change is None:
+                            continue
+                        if change['operationType'] in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+                            # The stream ends; a new one starts from the collection as it is now
+                            token = None
+                            yield RESYNC
+                            break
+                        if 'documentKey' in change:
+                            yield self._make_change(change)
+            except pymongoErrors.OperationFailure as ex:
+                if ex.code in CHANGE_STREAM_UNSUPPORTED and self.mode == 'auto':
+                    self._info("Change streams unsupported; polling for contact changes")
+                    return
+                if ex.code in (CHANGE_STREAM_HISTORY_LOST, CHANGE_STREAM_FATAL, INVALID_RESUME_TOKEN):
+                    self._warning("Contacts change stream lost its place: {}".format(ex))
+                    token = None
+                    yield RESYNC
+                    continue
+                failures = self._failed(stopped, ex, failures)
+            except pymongoErrors.PyMongoError as ex:
+                failures = self._failed(stopped, ex, failures)
+
+    def _make_change(self, change: Dict) -> Change:
+        contact = change.get('fullDocument')
+        if contact is not None and self._fields is not None:
+            contact = {field: contact[field] for field in self._fields if field in contact}
+        at = change.get('wallTime')
+        if at is None:
+            at = datetime.utcfromtimestamp(change['clusterTime'].time)
+        return Change(str(change['documentKey']['_id']), contact, at)
+
+    def _poll(self, stopped: threading.Event) -> Iterator[Change]:
+        """ Poll for contacts updated, and tombstones recorded, since the last poll """
+        since = datetime.utcnow()
+        polled_at = time.monotonic()
+        # contact id -> the time of the change last yielded for it, while it may be read again
+        seen = {}
+        failures = 0
+        self.source = 'poll'
+        while not stopped.wait(self._poll_sec):
+            try:
+                now = datetime.utcnow()
+                if time.monotonic() - polled_at > self._tombstone_ttl.total_seconds():
+                    # Tombstones of deletes since the last poll may have expired
+                    yield RESYNC
+                    since = now
+                changes = self._read_changes(since - self._overlap)
+                since = now
+                polled_at = time.monotonic()
+                failures = 0
+            except pymongoErrors.PyMongoError as ex:
+                failures = self._failed(stopped, ex, failures)
+                continue
+            for change in changes:
+                if seen.get(change.contact_id) != change.at:
+                    seen[change.contact_id] = change.at
+                    yield change
+            seen = {contact_id: at for contact_id, at in seen.items() if at >= since - self._overlap}
+
+    def _read_changes(self, since: datetime) -> list:
+        """ Contacts updated and deleted since, oldest first """
+        projection = dict.fromkeys(self._fields, True) if self._fields is not None else None
+        if projection is not None:
+            projection['updatedAt'] = True
+        changes = [Change(str(contact['_id']), contact, contact['updatedAt'])
+                   for contact in self._contacts().find({'updatedAt': {'$gte': since}},
+                                                        projection=projection)
+                   .sort('updatedAt', ASCENDING)]
+        changes.extend(Change(str(tombstone['_id']), None, tombstone['deletedAt'])
+                       for tombstone in self._deleted().find({'deletedAt': {'$gte': since}}))
+        changes.sort(key=lambda change: change.at)
+        return changes
+
+    def _failed(self, stopped: threading.Event, ex: Exception, failures: int) -> int:
+        """ Count and log a failure, then back off before the next attempt """
+        self.errors += 1
+        if failures == 0:
+            self._warning("Reading contact changes failed: {}".format(ex))
+        stopped.wait(min(self._poll_sec * 2 ** failures, 30.0))
+        return failures + 1
+
+    @staticmethod
+    def _contacts():
+        return MongoPool.client().test.contacts
+
+    @staticmethod
+    def _deleted():
+        return MongoPool.client().test.contacts_deleted
@@ -2,16 +2,52 @@
 """
 All operations on the MongoDB contacts collection
 """
-import os
-from typing import List, Dict
+from collections import namedtuple
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Tuple
 
+import bson
 import falcon
 from bson import errors as bsonErrors
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
 from bson.objectid import ObjectId
-from pymongo import MongoClient, ReturnDocument
+from pymongo import (ASCENDING, TEXT, DeleteOne, IndexModel, InsertOne, MongoClient,
+                     ReturnDocument, UpdateOne)
 from pymongo import errors as pymongoErrors
 
+from ..common.config import env_int
 from ..common.logging import LoggerMixin
+from . import change_feed
+from .mongo_pool import MongoPool
+from .resilience import Resilience, resilient
+from .write_behind import InsertQueue
+
+
+# One validated operation in a bulk request.
+#   index: position in the client's list of operations
+#   op: 'add', 'update' or 'remove'
+#   object_id: the contact id for update and remove, None for add
+#   attributes: contact fields for add and update, None for remove
+BulkOperation = namedtuple('BulkOperation', 'index op object_id attributes')
+
+# A validated collection query.
+#   filters: {field: [values]}, contacts whose field equals any of the values
+#   sort: [(field, ASCENDING or DESCENDING)], applied before the _id tie break
+#   fields: the contact fields to return, None for all
+ListQuery = namedtuple('ListQuery', 'filters sort fields')
+
+
+class _ObjectIdAsStr(TypeDecoder):
+    """ Decode ObjectIds as their hex str """
+    bson_type = ObjectId
+
+    def transform_bson(self, value: ObjectId) -> str:
+        return str(value)
+
+
+# Decodes contacts read for clients (see ContactsRepoMongo)
+CONTACT_TYPE_REGISTRY = TypeRegistry([_ObjectIdAsStr()])
+CONTACT_CODEC_OPTIONS = CodecOptions(type_registry=CONTACT_TYPE_REGISTRY)
 
 
 class ContactsRepoMongo(LoggerMixin):
@@ -19,78 +55,352 @@ class ContactsRepoMongo(LoggerMixin):
     Handles all interactions with the MongoDB contacts collection
 
     NOTES:
-    MongoDB bson ObjectIds are not json serializable, however, you can cast
-    the ObjectId to a str, which is, and use that str to construct an ObjectId
-    for searching.
+    Contacts read for clients are decoded with str _ids (CONTACT_TYPE_REGISTRY):
+    the json codecs encode a str natively, while each ObjectId costs a call
+    back into Python, twice per contact in a json:api response. Other reads,
+    whose _ids go back to the datastore, return bson ObjectIds. Ids arrive from
+    clients as the hex str, which we use to construct an ObjectId for searching.
+
+    With CONTACTS_RAW_READS=1, get_list and iter_list read raw BSON batches
+    (find_raw_batches) and decode each with one bson.decode_all call, instead
+    of pymongo handing out every contact through its cursor. Responses are
+    the same.
+
+    Repositories are cheap to construct: they share the process-wide
+    MongoClient and its connection pool (see MongoPool).
+
+    INDEXED_FIELDS are the fields get_list may filter and sort on; INDEXES
+    serve those queries, with _id last for keyset pagination. The TEXT_INDEX
+    serving search_text is only created by ensure_text_index.
+
+    Every write stamps the contact's updatedAt, a UTC datetime, and, when
+    changes are polled for (see change_feed), deletes record a tombstone in
+    the contacts_deleted collection, so other workers and replicas can follow
+    the writes.
+
+    Methods running datastore operations are @resilient (see resilience):
+    they are bounded by the request's time budget, reads are retried and
+    connection failures feed the circuit breaker, which fails them fast
+    with a 503 while the datastore is down.
     """
+    INDEXED_FIELDS = ('state', 'lastName', 'email', 'companyName')
+    INDEXES = (
+        IndexModel([('state', ASCENDING), ('lastName', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([('lastName', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([('email', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([('companyName', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([('updatedAt', ASCENDING)]),
+    )
 
-    def __init__(self):
-        # 'mongodb://localhost:27017/'
-        self._uri = os.getenv('MONGO_URI', '')
-        if not self._uri:
-            raise ValueError('MONGO_URI env var not set; required to connect to mongodb')
-        self._mongo = MongoClient(self._uri,
-                                  # Set the mongo connect timeout to 1s < gunicorn
-                                  # worker timeout so we will fire a 503 when db is down
-                                  serverSelectionTimeoutMS=29000)
+    TEXT_INDEX = 'contacts_search'
+    TEXT_SORT = [('score', {'$meta': 'textScore'}), ('_id', ASCENDING)]
+
+    def __init__(self, mongo: MongoClient = None):
+        self._mongo = mongo if mongo is not None else MongoPool.client()
         self._contacts = self._mongo.test.contacts
+        self._deleted = self._mongo.test.contacts_deleted
+        self._contact_reads = self._make_contact_reads(self._contacts)
+        self._raw_reads = env_int('CONTACTS_RAW_READS', 0) > 0
+        self._tombstones = change_feed.tombstones()
 
-    def create_item(self, req: falcon.Request):
+    @staticmethod
+    def _make_contact_reads(contacts):
+        """
+        The contacts collection, decoding with CONTACT_TYPE_REGISTRY. Datastores
+        without custom type support, e.g. test doubles, decode ObjectIds; the
+        responses are the same.
+        """
         try:
-            result = self._contacts.insert_one(
-                req.context['body_json']
-            )
-            return str(result.inserted_id)
-        except (pymongoErrors.AutoReconnect,
-                pymongoErrors.ConnectionFailure,
-                pymongoErrors.NetworkTimeout):
-            self._handle_service_unavailable()
+            return contacts.with_options(codec_options=contacts.codec_options.with_options(
+                type_registry=CONTACT_TYPE_REGISTRY))
+        except NotImplementedError:
+            return contacts
+
+    @staticmethod
+    def _decode_batches(batches: Iterable[bytes]) -> List[Dict]:
+        """ The contacts in raw BSON batches """
+        contacts = []
+        for batch in batches:
+            contacts.extend(bson.decode_all(batch, CONTACT_CODEC_OPTIONS))
+        return contacts
+
+    @staticmethod
+    def _iter_batches(batches: Iterable[bytes]) -> Iterator[Dict]:
+        """ Iterate over the contacts in raw BSON batches, decoding a batch at a time """
+        for batch in batches:
+            yield from bson.decode_all(batch, CONTACT_CODEC_OPTIONS)
+
+    @resilient(read=False)
+    def bulk_write(self, _: falcon.Request, operations: List[BulkOperation],
+                   ordered: bool) -> Dict[int, Dict]:
+        """
+        Apply many add, update and remove operations in one bulk_write round trip.
+
+        Ordered mode stops at the first failing operation; unordered mode applies
+        every operation it can. Ids for added contacts are generated here so each
+        result can report its id.
+
+        Returns:
+            dict: operation index -> result dict with a 'status' str and either
+            the contact 'id' or an error 'title' and 'detail'. Operations that
+            were never attempted (ordered mode, after a failure) have no entry.
+        """
+        results = {}
+        existing = self._find_existing_ids([op.object_id for op in operations
+                                            if op.object_id is not None])
+        requests, indexes = self._plan_bulk(operations, existing, ordered, results)
+        if requests:
+            try:
+                self._contacts.bulk_write(requests, ordered=ordered)
+            except pymongoErrors.BulkWriteError as ex:
+                self._apply_bulk_errors(ex, indexes, ordered, results)
+            self._record_deleted(self._bulk_deleted(operations, results))
+        return results
 
+    def _find_existing_ids(self, object_ids: List[str]) -> set:
+        """ The subset of object_ids that exist in the collection, as ObjectIds """
+        if not object_ids:
+            return set()
+        cursor = self._contacts.find(self._make_in_filter(object_ids), projection={'_id': True},
+                                     max_time_ms=Resilience.operation_timeout_ms())
+        return {contact['_id'] for contact in cursor}
+
+    @staticmethod
+    def _make_in_filter(object_ids: List[str]) -> Dict:
+        return {'_id': {'$in': [ObjectId(object_id) for object_id in object_ids]}}
+
+    def _plan_bulk(self, operations: List[BulkOperation], existing: set, ordered: bool,
+                   results: Dict[int, Dict]) -> tuple:
+        """
+        The pymongo requests for operations and the operation index of each request.
+        Records a tentative result for every operation considered. A contact
+        removed by an operation does not exist for the operations after it.
+        """
+        requests = []
+        indexes = []
+        existing = set(existing)
+        for operation in operations:
+            request, result = self._make_bulk_request(operation, existing)
+            results[operation.index] = result
+            if request is None:
+                if ordered:
+                    break
+                continue
+            requests.append(request)
+            indexes.append(operation.index)
+            if operation.op == 'remove':
+                existing.discard(ObjectId(operation.object_id))
+        return requests, indexes
+
+    @staticmethod
+    def _make_bulk_request(operation: BulkOperation, existing: set) -> tuple:
+        """ The pymongo request and tentative result for an operation; no request on error """
+        if operation.op == 'add':
+            contact = ContactsRepoMongo._stamp(operation.attributes)
+            contact['_id'] = ObjectId()
+            return InsertOne(contact), dict(status='201', id=str(contact['_id']))
+        object_id = ObjectId(operation.object_id)
+        if object_id not in existing:
+            return None, dict(status='404',
+                              title='Contact not found',
+                              detail='Contact {} not found'.format(operation.object_id))
+        if operation.op == 'update':
+            request = UpdateOne({'_id': object_id},
+                                {'$set': ContactsRepoMongo._stamp(operation.attributes)})
+            return request, dict(status='200', id=operation.object_id)
+        return DeleteOne({'_id': object_id}), dict(status='204', id=operation.object_id)
+
+    @staticmethod
+    def _apply_bulk_errors(ex: pymongoErrors.BulkWriteError, indexes: List[int], ordered: bool,
+                           results: Dict[int, Dict]) -> None:
+        """ Replace tentative results with the bulk write's errors """
+        write_errors = ex.details.get('writeErrors', [])
+        for error in write_errors:
+            results[indexes[error['index']]] = dict(
+                status='409' if error.get('code') == 11000 else '422',
+                title='Contact write failed',
+                detail=error.get('errmsg', ''))
+        if ordered and write_errors:
+            # Operations after the first failure were not attempted
+            for index in indexes[write_errors[0]['index'] + 1:]:
+                results.pop(index, None)
+
+    @staticmethod
+    def _bulk_deleted(operations: List[BulkOperation], results: Dict[int, Dict]) -> List[ObjectId]:
+        """ The ids of the contacts removed by a bulk write """
+        return [ObjectId(operation.object_id) for operation in operations
+                if operation.op == 'remove' and results.get(operation.index, {}).get('status') == '204']
+
+    @staticmethod
+    def _stamp(contact: Dict) -> Dict:
+        """ A copy of contact, or of the fields to set, with updatedAt set to now """
+        return dict(contact, updatedAt=datetime.utcnow())
+
+    def _record_deleted(self, object_ids: List[ObjectId]) -> None:
+        """ Record tombstones for deleted contacts, if changes are polled for """
+        if self._tombstones and object_ids:
+            self._deleted.bulk_write(self._make_tombstones(object_ids), ordered=False)
+
+    @staticmethod
+    def _make_tombstones(object_ids: List[ObjectId]) -> List[UpdateOne]:
+        now = datetime.utcnow()
+        return [UpdateOne({'_id': object_id}, {'$set': {'deletedAt': now}}, upsert=True)
+                for object_id in object_ids]
+
+    @resilient(read=False)
+    def create_item(self, req: falcon.Request):
+        result = self._contacts.insert_one(
+            self._stamp(req.context['body_json'])
+        )
+        return str(result.inserted_id)
+
+    @staticmethod
+    def queue_item(req: falcon.Request) -> str:
+        """ Queue the contact for a batched insert (see write_behind); returns its id """
+        return InsertQueue.submit(ContactsRepoMongo._stamp(req.context['body_json']))
+
+    @resilient(read=False)
     def delete_item(self, _: falcon.Request, object_id: str) -> None:
-        try:
-            self._contacts.delete_one(
-                {'_id': self._make_objectid(object_id)}
-            )
-        except (pymongoErrors.AutoReconnect,
-                pymongoErrors.ConnectionFailure,
-                pymongoErrors.NetworkTimeout):
-            self._handle_service_unavailable()
+        object_id = self._make_objectid(object_id)
+        self._contacts.delete_one(
+            {'_id': object_id}
+        )
+        self._record_deleted([object_id])
 
+    @resilient(read=True)
     def find_one(self) -> Dict:
-        try:
-            return self._contacts.find_one()
-        except (pymongoErrors.AutoReconnect,
-                pymongoErrors.ConnectionFailure,
-                pymongoErrors.NetworkTimeout):
-            self._handle_service_unavailable()
+        return self._contacts.find_one(max_time_ms=Resilience.operation_timeout_ms())
 
-    def get_list(self, _: falcon.Request) -> List[Dict]:
+    def ensure_indexes(self) -> None:
+        """
+        Create INDEXES if they do not exist. Called at startup; a datastore that
+        is down is logged and left for the health checks to report.
+        """
         try:
-            self._info("Fetching all contacts from datastore")
-            result = []
-            for contact in self._contacts.find():
-                contact['_id'] = str(contact['_id'])
-                result.append(contact)
-            return result
-        except (pymongoErrors.AutoReconnect,
-                pymongoErrors.ConnectionFailure,
-                pymongoErrors.NetworkTimeout):
-            self._handle_service_unavailable()
+            names = self._contacts.create_indexes(list(self.INDEXES))
+            if self._tombstones:
+                names.extend(self._deleted.create_indexes(self._make_tombstone_indexes()))
+            self._info("Contacts indexes ensured", indexes=names)
+        except pymongoErrors.PyMongoError as ex:
+            self._warning("Could not ensure contacts indexes: {}".format(ex))
+
+    @staticmethod
+    def _make_tombstone_indexes() -> List[IndexModel]:
+        """ Tombstones expire once polling workers no longer need them """
+        return [IndexModel([('deletedAt', ASCENDING)],
+                           expireAfterSeconds=change_feed.tombstone_sec())]
 
+    @resilient(read=True)
+    def get_list(self, _: falcon.Request, limit: int, after: str = None,
+                 query: ListQuery = None) -> List[Dict]:
+        """
+        Fetch one page of contacts using keyset pagination.
+
+        Args:
+            limit: max number of contacts to return
+            after: return contacts following the one with this _id, in sort
+                order; None for the first page
+            query: filters, sort order and fields to return; None for all
+                contacts, all fields, in _id order
+        """
+        query = query or ListQuery(None, None, None)
+        last = self._find_after(after, query.sort)
+        find = self._contacts.find_raw_batches if self._raw_reads else self._contact_reads.find
+        cursor = find(self._make_list_filter(query, last),
+                      projection=self._make_projection(query),
+                      max_time_ms=Resilience.operation_timeout_ms())
+        cursor = cursor.sort(self._make_sort(query)).limit(limit)
+        return self._decode_batches(cursor) if self._raw_reads else list(cursor)
+
+    @resilient(read=True)
     def get_item(self, _: falcon.Request, object_id: str) -> Dict:
+        contact = self._contact_reads.find_one(
+            {'_id': self._make_objectid(object_id)},
+            max_time_ms=Resilience.operation_timeout_ms()
+        )
+        if contact is None:
+            self._handle_not_found(object_id)
+        return contact
+
+    @resilient(read=True)
+    def iter_list(self, _: falcon.Request, batch_size: int) -> Iterator[Dict]:
+        """
+        Iterate over every contact in _id order, fetching batch_size documents
+        per round trip so only one batch is held in memory at a time.
+
+        The query runs before this returns so an unreachable datastore raises
+        a 503 before any of the response has been sent.
+        """
+        self._info("Exporting all contacts from datastore", batchSize=batch_size)
+        if self._raw_reads:
+            cursor = self._iter_batches(self._contacts.find_raw_batches()
+                                        .sort('_id', ASCENDING).batch_size(batch_size))
+        else:
+            cursor = self._contact_reads.find().sort('_id', ASCENDING).batch_size(batch_size)
+        first = next(cursor, None)
+        return self._iter_cursor(first, cursor)
+
+    def _iter_cursor(self, first: Dict, cursor) -> Iterator[Dict]:
+        if first is None:
+            return
+        yield first
         try:
-            contact = self._contacts.find_one(
-                {'_id': self._make_objectid(object_id)}
-            )
-            if contact is None:
-                self._handle_not_found(object_id)
-            contact['_id'] = str(contact['_id'])
-            return contact
-        except (pymongoErrors.AutoReconnect,
-                pymongoErrors.ConnectionFailure,
-                pymongoErrors.NetworkTimeout):
+            for contact in cursor:
+                yield contact
+        except pymongoErrors.PyMongoError as ex:
+            # Headers are already sent; all we can do is log and abort the response
+            self._error("Contacts export failed mid-stream: {}".format(ex), exc_info=ex)
+            raise
+
+    def iter_fields(self, fields: Iterable[str], batch_size: int) -> Iterator[Dict]:
+        """
+        Iterate over the _id and fields of every contact, batch_size documents
+        per round trip; e.g. to build an in-process index. Raises 503 if the
+        datastore fails.
+        """
+        try:
+            for contact in self._contacts.find(projection=dict.fromkeys(fields, True)) \
+                    .batch_size(batch_size):
+                yield contact
+        except pymongoErrors.PyMongoError:
             self._handle_service_unavailable()
 
+    def ensure_text_index(self, weights: Dict[str, float]) -> None:
+        """
+        Create the text index search_text uses, over the fields weighted by
+        weights, if it does not exist. A datastore that is down is logged.
+        """
+        try:
+            name = self._contacts.create_index([(field, TEXT) for field in weights],
+                                               weights={field: max(1, int(weight))
+                                                        for field, weight in weights.items()},
+                                               name=self.TEXT_INDEX)
+            self._info("Contacts text index ensured", index=name)
+        except pymongoErrors.PyMongoError as ex:
+            self._warning("Could not ensure contacts text index: {}".format(ex))
+
+    @resilient(read=True)
+    def search_text(self, _: falcon.Request, query: str, fields: Iterable[str], limit: int,
+                    offset: int) -> Tuple[int, List[Dict]]:
+        """
+        The number of contacts matching query in the text index, and the _id
+        and fields of the limit best from offset on, by text score then _id.
+        """
+        search = {'$text': {'$search': query}}
+        total = self._contacts.count_documents(search, maxTimeMS=Resilience.operation_timeout_ms())
+        cursor = self._contact_reads.find(search, projection=self._make_text_projection(fields),
+                                          max_time_ms=Resilience.operation_timeout_ms())
+        contacts = list(cursor.sort(self.TEXT_SORT).skip(offset).limit(limit))
+        for contact in contacts:
+            del contact['score']
+        return total, contacts
+
+    @staticmethod
+    def _make_text_projection(fields: Iterable[str]) -> Dict:
+        projection = dict.fromkeys(fields, True)
+        projection['score'] = {'$meta': 'textScore'}
+        return projection
+
     def ping(self) -> None:
         """
         A very light weight database connectivity check used with liveness and
@@ -102,35 +412,35 @@ class ContactsRepoMongo(LoggerMixin):
         except:  # pylint: disable=bare-except
             self._handle_service_unavailable()
 
-    def replace_item(self, req: falcon.Request, object_id: str) -> Dict:
-        try:
-            result = self._contacts.find_one_and_replace(
-                {'_id': self._make_objectid(object_id)},
-                req.context['body_json'],
-                return_document=ReturnDocument.AFTER)
-            if result is None:
-                self._handle_not_found(object_id)
-            result['_id'] = str(result['_id'])
-            return result
-        except (pymongoErrors.AutoReconnect,
-                pymongoErrors.ConnectionFailure,
-                pymongoErrors.NetworkTimeout):
-            self._handle_service_unavailable()
+    @resilient(read=False)
+    def replace_item(self, req: falcon.Request, object_id: str, expected: Dict = None) -> Dict:
+        """
+        Replace a contact. If expected is given, replace it only if the stored
+        contact still equals expected (compare and swap).
+        """
+        result = self._contacts.find_one_and_replace(
+            self._make_filter(object_id, expected),
+            self._stamp(req.context['body_json']),
+            return_document=ReturnDocument.AFTER,
+            maxTimeMS=Resilience.operation_timeout_ms())
+        if result is None:
+            self._handle_write_missed(object_id, expected)
+        return result
 
-    def update_item(self, req: falcon.Request, object_id: str) -> Dict:
-        try:
-            result = self._contacts.find_one_and_update(
-                {'_id': self._make_objectid(object_id)},
-                {'$set': req.context['body_json']},
-                return_document=ReturnDocument.AFTER)
-            if result is None:
-                self._handle_not_found(object_id)
-            result['_id'] = str(result['_id'])
-            return result
-        except (pymongoErrors.AutoReconnect,
-                pymongoErrors.ConnectionFailure,
-                pymongoErrors.NetworkTimeout):
-            self._handle_service_unavailable()
+    @resilient(read=False)
+    def update_item(self, req: falcon.Request, object_id: str, expected: Dict = None) -> Dict:
+        """
+        Update contact fields. If expected is given, update it only if the stored
+        contact still equals expected (compare and swap).
+        """
+        result = self._contacts.find_one_and_update(
+            self._make_filter(object_id, expected),
+            {'$set': self._stamp(req.context['body_json'])},
+            return_document=ReturnDocument.AFTER,
+            maxTimeMS=Resilience.operation_timeout_ms())
+        if result is None:
+            self._handle_write_missed(object_id, expected)
+        return result
 
     def _make_objectid(self, object_id: str) -> ObjectId:
         try:
@@ -140,17 +450,116 @@ class ContactsRepoMongo(LoggerMixin):
                 title='Invalid contact id: {}'.format(object_id),
                 description=str(ex))
 
+    def _find_after(self, after: str, sort: List) -> Dict:
+        """ The sort key of the contact a page follows, or None for the first page """
+        if not after:
+            return None
+        object_id = self._make_objectid(after)
+        if not sort:
+            return {'_id': object_id}
+        last = self._contacts.find_one({'_id': object_id},
+                                       projection={field: True for field, _ in sort},
+                                       max_time_ms=Resilience.operation_timeout_ms())
+        return self._check_after(after, last)
+
+    @staticmethod
+    def _check_after(after: str, last: Dict) -> Dict:
+        if last is None:
+            raise falcon.HTTPInvalidParam('Contact {} no longer exists'.format(after), 'page[after]')
+        return last
+
+    @staticmethod
+    def _make_sort(query: ListQuery) -> List:
+        """ The query's sort order with _id breaking ties, in the last key's direction """
+        sort = list(query.sort or ())
+        sort.append(('_id', sort[-1][1] if sort else ASCENDING))
+        return sort
+
+    def _make_list_filter(self, query: ListQuery, last: Dict) -> Dict:
+        """
+        The query's filters and, for pages after the first, a keyset condition
+        selecting contacts that sort after last::
+
+            {'$or': [{'lastName': {'$gt': 'Smith'}},
+                     {'lastName': 'Smith', '_id': {'$gt': ObjectId(...)}}]}
+
+        Contacts missing a sort field sort as null, before every value.
+        """
+        result = {field: values[0] if len(values) == 1 else {'$in': values}
+                  for field, values in (query.filters or {}).items()}
+        if last is None:
+            return result
+        keyset = []
+        equal = {}
+        for field, direction in self._make_sort(query):
+            after = self._make_after(field, direction, last.get(field))
+            if after is not None:
+                keyset.append(dict(equal, **after))
+            # Matches null and missing alike
+            equal[field] = last.get(field)
+        if len(keyset) == 1:
+            result.update(keyset[0])
+        else:
+            result = {'$and': [result, {'$or': keyset}]} if result else {'$or': keyset}
+        return result
+
+    @staticmethod
+    def _make_after(field: str, direction: int, value) -> Dict:
+        """
+        The condition on field selecting contacts that sort after value, None
+        if none can. Comparisons only match values of the same type, so null,
+        which sorts first, is matched explicitly.
+        """
+        if value is None:
+            return {field: {'$ne': None}} if direction == ASCENDING else None
+        if direction == ASCENDING:
+            return {field: {'$gt': value}}
+        return {'$or': [{field: {'$lt': value}}, {field: None}]}
+
+    @staticmethod
+    def _make_projection(query: ListQuery) -> Dict:
+        if not query.fields:
+            return None
+        return {field: True for field in query.fields}
+
+    def _make_filter(self, object_id: str, expected: Dict = None) -> Dict:
+        """ Match the contact by id and, if given, by every field of expected """
+        query = dict(expected) if expected else {}
+        query['_id'] = self._make_objectid(object_id)
+        return query
+
+    def _handle_write_missed(self, object_id: str, expected: Dict) -> None:
+        """ A conditional write matched nothing: the contact is gone or has changed """
+        exists = expected and self._contacts.find_one({'_id': self._make_objectid(object_id)},
+                                                      projection={'_id': True},
+                                                      max_time_ms=Resilience.operation_timeout_ms())
+        self._handle_write_missed_result(object_id, exists)
+
+    def _handle_write_missed_result(self, object_id: str, exists: bool) -> None:
+        if exists:
+            raise falcon.HTTPPreconditionFailed(
+                title='Contact has changed',
+                description='Contact {} was modified by another request; '
+                            'fetch it again and retry'.format(object_id))
+        self._handle_not_found(object_id)
+
     def _handle_not_found(self, object_id) -> None:
         raise falcon.HTTPNotFound(
             title='Contact not found',
             description="Contact {} not found".format(object_id))
 
-    def _handle_service_unavailable(self) -> None:
+    def _handle_service_unavailable(self, retry_after: int = 30) -> None:
         raise falcon.HTTPServiceUnavailable(
             title='Datastore is unreachable',
             description="MongoDB at {} failed to respond to ping. "
                         "This is a transient, future attempts will work "
-                        "when the datastore returns to service".format(self._uri),
+                        "when the datastore returns to service".format(MongoPool.uri()),
             href='https://www.ctl.io/api-docs/v2/#firewall',
-            retry_after=30
+            retry_after=retry_after
         )
+
+    def _handle_deadline_exceeded(self) -> None:
+        raise falcon.HTTPGatewayTimeout(
+            title='Datastore timed out',
+            description="MongoDB at {} did not complete the operation within "
+                        "the request's time budget".format(MongoPool.uri()))
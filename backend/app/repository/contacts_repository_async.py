@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+All operations on the MongoDB contacts collection, for the asyncio (ASGI) app.
+
+Each method mirrors the ContactsRepoMongo method of the same name, using the
+process-wide Motor client so datastore calls yield to the event loop instead
+of blocking a worker. Query construction, bulk planning and error handling are
+inherited from ContactsRepoMongo, and methods are @resilient as there.
+Queued creates share the process's InsertQueue, whose writer thread uses the
+synchronous client.
+"""
+from typing import AsyncIterator, Dict, Iterable, List, Tuple
+
+import bson
+import falcon
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, TEXT, ReturnDocument
+from pymongo import errors as pymongoErrors
+
+from . import change_feed
+from ..common.config import env_int
+from .contacts_repository import (CONTACT_CODEC_OPTIONS, BulkOperation, ContactsRepoMongo,
+                                  ListQuery)
+from .mongo_pool import MotorPool
+from .resilience import Resilience, resilient
+from .write_behind import InsertQueue
+
+
+class AsyncContactsRepoMongo(ContactsRepoMongo):
+    """
+    Handles all interactions with the MongoDB contacts collection, asynchronously
+    """
+
+    def __init__(self, mongo: 'AsyncIOMotorClient' = None):  # pylint: disable=super-init-not-called
+        # Resources are created before the event loop runs; the pool's client
+        # is looked up per call so it is only created on lifespan startup.
+        self._client = mongo
+        self._tombstones = change_feed.tombstones()
+        self._raw_reads = env_int('CONTACTS_RAW_READS', 0) > 0
+
+    @property
+    def _mongo(self) -> 'AsyncIOMotorClient':
+        return self._client if self._client is not None else MotorPool.client()
+
+    @property
+    def _contacts(self):
+        return self._mongo.test.contacts
+
+    @property
+    def _contact_reads(self):
+        return self._make_contact_reads(self._contacts)
+
+    @property
+    def _deleted(self):
+        return self._mongo.test.contacts_deleted
+
+    @resilient(read=False)
+    async def bulk_write(self, _: falcon.Request, operations: List[BulkOperation],
+                         ordered: bool) -> Dict[int, Dict]:
+        results = {}
+        existing = await self._find_existing_ids([op.object_id for op in operations
+                                                  if op.object_id is not None])
+        requests, indexes = self._plan_bulk(operations, existing, ordered, results)
+        if requests:
+            try:
+                await self._contacts.bulk_write(requests, ordered=ordered)
+            except pymongoErrors.BulkWriteError as ex:
+                self._apply_bulk_errors(ex, indexes, ordered, results)
+            await self._record_deleted(self._bulk_deleted(operations, results))
+        return results
+
+    async def _find_existing_ids(self, object_ids: List[str]) -> set:
+        if not object_ids:
+            return set()
+        cursor = self._contacts.find(self._make_in_filter(object_ids), projection={'_id': True},
+                                     max_time_ms=Resilience.operation_timeout_ms())
+        return {contact['_id'] async for contact in cursor}
+
+    async def _record_deleted(self, object_ids: List[ObjectId]) -> None:
+        if self._tombstones and object_ids:
+            await self._deleted.bulk_write(self._make_tombstones(object_ids), ordered=False)
+
+    @resilient(read=False)
+    async def create_item(self, req: falcon.Request):
+        result = await self._contacts.insert_one(
+            self._stamp(req.context['body_json'])
+        )
+        return str(result.inserted_id)
+
+    @staticmethod
+    async def queue_item(req: falcon.Request) -> str:
+        return InsertQueue.submit(ContactsRepoMongo._stamp(req.context['body_json']))
+
+    @resilient(read=False)
+    async def delete_item(self, _: falcon.Request, object_id: str) -> None:
+        object_id = self._make_objectid(object_id)
+        await self._contacts.delete_one(
+            {'_id': object_id}
+        )
+        await self._record_deleted([object_id])
+
+    @resilient(read=True)
+    async def find_one(self) -> Dict:
+        return await self._contacts.find_one(max_time_ms=Resilience.operation_timeout_ms())
+
+    async def ensure_indexes(self) -> None:
+        try:
+            names = await self._contacts.create_indexes(list(self.INDEXES))
+            if self._tombstones:
+                names.extend(await self._deleted.create_indexes(self._make_tombstone_indexes()))
+            self._info("Contacts indexes ensured", indexes=names)
+        except pymongoErrors.PyMongoError as ex:
+            self._warning("Could not ensure contacts indexes: {}".format(ex))
+
+    @resilient(read=True)
+    async def get_list(self, _: falcon.Request, limit: int, after: str = None,
+                       query: ListQuery = None) -> List[Dict]:
+        query = query or ListQuery(None, None, None)
+        last = await self._find_after(after, query.sort)
+        find = self._contacts.find_raw_batches if self._raw_reads else self._contact_reads.find
+        cursor = find(self._make_list_filter(query, last),
+                      projection=self._make_projection(query),
+                      max_time_ms=Resilience.operation_timeout_ms())
+        cursor = cursor.sort(self._make_sort(query)).limit(limit)
+        if self._raw_reads:
+            return await self._decode_batches_async(cursor)
+        return await cursor.to_list(length=limit)
+
+    @staticmethod
+    async def _decode_batches_async(batches) -> List[Dict]:
+        contacts = []
+        async for batch in batches:
+            contacts.extend(bson.decode_all(batch, CONTACT_CODEC_OPTIONS))
+        return contacts
+
+    @staticmethod
+    async def _iter_batches_async(batches) -> AsyncIterator[Dict]:
+        async for batch in batches:
+            for contact in bson.decode_all(batch, CONTACT_CODEC_OPTIONS):
+                yield contact
+
+    async def _find_after(self, after: str, sort: List) -> Dict:
+        if not after:
+            return None
+        object_id = self._make_objectid(after)
+        if not sort:
+            return {'_id': object_id}
+        last = await self._contacts.find_one({'_id': object_id},
+                                             projection={field: True for field, _ in sort},
+                                             max_time_ms=Resilience.operation_timeout_ms())
+        return self._check_after(after, last)
+
+    @resilient(read=True)
+    async def get_item(self, _: falcon.Request, object_id: str) -> Dict:
+        contact = await self._contact_reads.find_one(
+            {'_id': self._make_objectid(object_id)},
+            max_time_ms=Resilience.operation_timeout_ms()
+        )
+        if contact is None:
+            self._handle_not_found(object_id)
+        return contact
+
+    @resilient(read=True)
+    async def iter_list(self, _: falcon.Request, batch_size: int) -> AsyncIterator[Dict]:
+        """
+        Iterate over every contact in _id order, batch_size documents per round trip.
+
+        As with ContactsRepoMongo.iter_list, the first batch is fetched before this
+        returns so an unreachable datastore raises a 503 before streaming starts.
+        """
+        self._info("Exporting all contacts from datastore", batchSize=batch_size)
+        if self._raw_reads:
+            cursor = self._iter_batches_async(self._contacts.find_raw_batches()
+                                              .sort('_id', ASCENDING).batch_size(batch_size))
+        else:
+            cursor = self._contact_reads.find().sort('_id', ASCENDING).batch_size(batch_size)
+        first = await self._next(cursor)
+        return self._iter_cursor_async(first, cursor)
+
+    @staticmethod
+    async def _next(cursor) -> Dict:
+        """ The cursor's next document, or None when it is exhausted """
+        try:
+            return await cursor.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    async def _iter_cursor_async(self, first: Dict, cursor) -> AsyncIterator[Dict]:
+        if first is None:
+            return
+        yield first
+        try:
+            async for contact in cursor:
+                yield contact
+        except pymongoErrors.PyMongoError as ex:
+            # Headers are already sent; all we can do is log and abort the response
+            self._error("Contacts export failed mid-stream: {}".format(ex), exc_info=ex)
+            raise
+
+    async def iter_fields(self, fields: Iterable[str], batch_size: int) -> AsyncIterator[Dict]:
+        try:
+            async for contact in self._contacts.find(projection=dict.fromkeys(fields, True)) \
+                    .batch_size(batch_size):
+                yield contact
+        except pymongoErrors.PyMongoError:
+            self._handle_service_unavailable()
+
+    async def ensure_text_index(self, weights: Dict[str, float]) -> None:
+        try:
+            name = await self._contacts.create_index([(field, TEXT) for field in weights],
+                                                     weights={field: max(1, int(weight))
+                                                              for field, weight in weights.items()},
+                                                     name=self.TEXT_INDEX)
+            self._info("Contacts text index ensured", index=name)
+        except pymongoErrors.PyMongoError as ex:
+            self._warning("Could not ensure contacts text index: {}".format(ex))
+
+    @resilient(read=True)
+    async def search_text(self, _: falcon.Request, query: str, fields: Iterable[str], limit: int,
+                          offset: int) -> Tuple[int, List[Dict]]:
+        search = {'$text': {'$search': query}}
+        total = await self._contacts.count_documents(search,
+                                                     maxTimeMS=Resilience.operation_timeout_ms())
+        cursor = self._contact_reads.find(search, projection=self._make_text_projection(fields),
+                                          max_time_ms=Resilience.operation_timeout_ms())
+        contacts = await cursor.sort(self.TEXT_SORT).skip(offset).limit(limit).to_list(length=limit)
+        for contact in contacts:
+            del contact['score']
+        return total, contacts
+
+    async def ping(self) -> None:
+        try:
+            await self._mongo.admin.command('ping')
+        except:  # pylint: disable=bare-except
+            self._handle_service_unavailable()
+
+    @resilient(read=False)
+    async def replace_item(self, req: falcon.Request, object_id: str,
+                           expected: Dict = None) -> Dict:
+        result = await self._contacts.find_one_and_replace(
+            self._make_filter(object_id, expected),
+            self._stamp(req.context['body_json']),
+            return_document=ReturnDocument.AFTER,
+            maxTimeMS=Resilience.operation_timeout_ms())
+        if result is None:
+            await self._handle_write_missed(object_id, expected)
+        return result
+
+    @resilient(read=False)
+    async def update_item(self, req: falcon.Request, object_id: str,
+                          expected: Dict = None) -> Dict:
+        result = await self._contacts.find_one_and_update(
+            self._make_filter(object_id, expected),
+            {'$set': self._stamp(req.context['body_json'])},
+            return_document=ReturnDocument.AFTER,
+            maxTimeMS=Resilience.operation_timeout_ms())
+        if result is None:
+            await self._handle_write_missed(object_id, expected)
+        return result
+
+    async def _handle_write_missed(self, object_id: str, expected: Dict) -> None:
+        exists = expected and await self._contacts.find_one(
+            {'_id': self._make_objectid(object_id)}, projection={'_id': True},
+            max_time_ms=Resilience.operation_timeout_ms())
+        self._handle_write_missed_result(object_id, exists)
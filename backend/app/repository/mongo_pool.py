@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide MongoDB connection management.
+
+A MongoClient owns a connection pool and background server monitors. Creating
+one per request (or per health probe) opens fresh sockets and repeats server
+discovery every time. Instead, each gunicorn worker creates a single client
+after fork and every repository shares it.
+
+Gunicorn calls our post_fork hook (see app/gunicorn_conf.py) which calls
+MongoPool.initialize(). If the app is used outside gunicorn, the client is
+created lazily on first use. A client created in a parent process is never
+reused in a forked child: MongoClient is not fork-safe.
+
+The ASGI app uses MotorPool instead: a Motor client is bound to the event loop
+it is created in, so it is created by the ASGI lifespan startup event (see
+app/asgi.py). Both pools use the same settings and report the same stats.
+Motor is only imported when a MotorPool client is created, so the WSGI app
+does not depend on it.
+
+Both pools report connection pool counters (see MongoPool.stats()) and time
+every command (metrics.MONGODB_COMMAND_DURATION).
+
+Pool tuning is read from the environment:
+    * MONGO_URI: required, e.g. 'mongodb://localhost:27017/'
+    * MONGO_MAX_POOL_SIZE: max connections per server (default 100)
+    * MONGO_MIN_POOL_SIZE: connections kept open when idle (default 0)
+    * MONGO_MAX_IDLE_TIME_MS: close connections idle longer than this (default: never)
+    * MONGO_WAIT_QUEUE_TIMEOUT_MS: max wait for a free connection (default: forever)
+    * MONGO_WAIT_QUEUE_MULTIPLE: max waiters = this * max pool size (default: unlimited)
+    * MONGO_SERVER_SELECTION_TIMEOUT_MS: server selection timeout (default
+      MONGO_OPERATION_TIMEOUT_MS, see resilience)
+    * MONGO_SOCKET_TIMEOUT_MS: max wait for a reply on a connection (default:
+      forever). It applies to every operation of the client, including bulk
+      writes, write-behind batches, index builds, export batches and change
+      streams, which have no maxTimeMS; a write cut off by it may still have
+      been applied. Requests bound their operations with maxTimeMS instead
+      (see resilience)
+
+Creating a client also (re)reads the resilience settings (see resilience).
+"""
+import os
+import threading
+import time
+from typing import Dict
+
+from pymongo import MongoClient, monitoring
+
+from ..common import metrics, tracing
+from ..common.config import env_int
+from ..common.logging import Logger
+from .resilience import Resilience
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """
+    Connection pool event listener that keeps running counters.
+
+    Pool events are published synchronously on the thread that checks out the
+    connection, so checkout wait time is measured with a thread local start time.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tls = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._checked_out = 0
+            self._checkouts = 0
+            self._checkout_failures = 0
+            self._connections_created = 0
+            self._connections_closed = 0
+            self._pools_cleared = 0
+            self._wait_micros_total = 0
+            self._wait_micros_max = 0
+
+    def as_dict(self) -> Dict:
+        """ A snapshot of the current counters """
+        with self._lock:
+            checkouts = self._checkouts
+            return dict(
+                checkedOut=self._checked_out,
+                checkouts=checkouts,
+                checkoutFailures=self._checkout_failures,
+                connectionsCreated=self._connections_created,
+                connectionsClosed=self._connections_closed,
+                connectionsOpen=self._connections_created - self._connections_closed,
+                poolsCleared=self._pools_cleared,
+                waitMicrosTotal=self._wait_micros_total,
+                waitMicrosMax=self._wait_micros_max,
+                waitMicrosAvg=int(self._wait_micros_total / checkouts) if checkouts else 0,
+            )
+
+    def _end_wait(self) -> int:
+        start = getattr(self._tls, 'checkout_started', None)
+        self._tls.checkout_started = None
+        if start is None:
+            return 0
+        return int((time.perf_counter() - start) * 1000000)
+
+    def connection_check_out_started(self, event) -> None:
+        self._tls.checkout_started = time.perf_counter()
+
+    def connection_checked_out(self, event) -> None:
+        wait = self._end_wait()
+        with self._lock:
+            self._checked_out += 1
+            self._checkouts += 1
+            self._wait_micros_total += wait
+            self._wait_micros_max = max(self._wait_micros_max, wait)
+
+    def connection_check_out_failed(self, event) -> None:
+        self._end_wait()
+        with self._lock:
+            self._checkout_failures += 1
+
+    def connection_checked_in(self, event) -> None:
+        with self._lock:
+            self._checked_out -= 1
+
+    def connection_created(self, event) -> None:
+        with self._lock:
+            self._connections_created += 1
+
+    def connection_closed(self, event) -> None:
+        with self._lock:
+            self._connections_closed += 1
+
+    def pool_cleared(self, event) -> None:
+        with self._lock:
+            self._pools_cleared += 1
+
+    def connection_ready(self, event) -> None:
+        pass  # counted in connection_created
+
+    def pool_created(self, event) -> None:
+        pass  # nothing to count
+
+    def pool_closed(self, event) -> None:
+        pass  # nothing to count
+
+
+class CommandTimer(monitoring.CommandListener):
+    """
+    Command event listener that records the duration of every MongoDB command
+    run by the repositories in metrics.MONGODB_COMMAND_DURATION, and as a
+    mongo.<command> span of the current request's trace.
+
+    Events are published on the thread running the command, so the span is
+    only recorded where that thread runs in the request's context: always
+    with pymongo, but not with Motor, which runs commands in an executor.
+    """
+    def started(self, event) -> None:
+        pass  # duration is reported on completion
+
+    def succeeded(self, event) -> None:
+        self._completed(event, 'success')
+
+    def failed(self, event) -> None:
+        self._completed(event, 'failure')
+
+    @staticmethod
+    def _completed(event, outcome: str) -> None:
+        seconds = event.duration_micros / 1000000
+        metrics.MONGODB_COMMAND_DURATION.labels(event.command_name, outcome).observe(seconds)
+        tracing.record('mongo.' + event.command_name, seconds,
+                       **{'db.system': 'mongodb',
+                          'db.name': event.database_name,
+                          'db.operation': event.command_name,
+                          'db.outcome': outcome})
+
+
+class MongoPool:
+    """
+    Owner of the single MongoClient shared by all repositories in a worker process.
+
+    All members are class level: there is exactly one pool per process.
+    """
+    _LOCK = threading.Lock()
+    _LOG = Logger(__name__)
+    _CLIENT = None
+    _PID = None
+    _OPTIONS = {}
+    _STATS = PoolStats()
+    _LISTENERS = [_STATS, CommandTimer()]
+
+    @staticmethod
+    def uri() -> str:
+        uri = os.getenv('MONGO_URI', '')
+        if not uri:
+            raise ValueError('MONGO_URI env var not set; required to connect to mongodb')
+        return uri
+
+    @staticmethod
+    def client_options() -> Dict:
+        """ MongoClient keyword arguments built from the environment """
+        operation_timeout_ms = env_int('MONGO_OPERATION_TIMEOUT_MS', Resilience.OPERATION_TIMEOUT_MS)
+        options = dict(
+            maxPoolSize=env_int('MONGO_MAX_POOL_SIZE', 100),
+            minPoolSize=env_int('MONGO_MIN_POOL_SIZE', 0),
+            # An unreachable datastore fails an operation attempt within its
+            # timeout, rather than holding the worker; see resilience
+            serverSelectionTimeoutMS=env_int('MONGO_SERVER_SELECTION_TIMEOUT_MS',
+                                             operation_timeout_ms),
+        )
+        optional = (('maxIdleTimeMS', 'MONGO_MAX_IDLE_TIME_MS'),
+                    ('socketTimeoutMS', 'MONGO_SOCKET_TIMEOUT_MS'),
+                    ('waitQueueTimeoutMS', 'MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+                    ('waitQueueMultiple', 'MONGO_WAIT_QUEUE_MULTIPLE'))
+        for option, env_var in optional:
+            value = env_int(env_var)
+            if value is not None:
+                options[option] = value
+        return options
+
+    @staticmethod
+    def initialize() -> MongoClient:
+        """
+        Create this process's MongoClient. Call once per worker, after fork.
+        Safe to call repeatedly; an existing client for this process is reused.
+        """
+        with MongoPool._LOCK:
+            if MongoPool._CLIENT is not None and MongoPool._PID == os.getpid():
+                return MongoPool._CLIENT
+            # A client inherited across fork shares sockets with the parent; drop it
+            # without closing so we don't disturb the parent's connections.
+            options = MongoPool.client_options()
+            Resilience.configure()
+            MongoPool._STATS.reset()
+            MongoPool._CLIENT = MongoClient(MongoPool.uri(),
+                                            event_listeners=MongoPool._LISTENERS,
+                                            **options)
+            MongoPool._PID = os.getpid()
+            MongoPool._OPTIONS = options
+            MongoPool._LOG.info("MongoDB connection pool created", pid=MongoPool._PID, **options)
+            return MongoPool._CLIENT
+
+    @staticmethod
+    def client() -> MongoClient:
+        """ The shared MongoClient for this process, created on first use """
+        client = MongoPool._CLIENT
+        if client is not None and MongoPool._PID == os.getpid():
+            return client
+        return MongoPool.initialize()
+
+    @staticmethod
+    def close() -> None:
+        """ Close this process's client and its pooled connections; e.g. on worker exit """
+        with MongoPool._LOCK:
+            if MongoPool._CLIENT is not None and MongoPool._PID == os.getpid():
+                MongoPool._CLIENT.close()
+                MongoPool._LOG.info("MongoDB connection pool closed", pid=MongoPool._PID)
+            MongoPool._CLIENT = None
+            MongoPool._PID = None
+
+    @staticmethod
+    def stats() -> Dict:
+        """ Connection pool counters for this process """
+        result = MongoPool._STATS.as_dict()
+        result['maxPoolSize'] = MongoPool._OPTIONS.get('maxPoolSize')
+        result['pid'] = os.getpid()
+        return result
+
+
+class MotorPool:
+    """
+    Owner of the single asyncio Motor client shared by all asynchronous
+    repositories in a worker process.
+    """
+    _LOG = Logger(__name__)
+    _CLIENT = None
+    _PID = None
+
+    @staticmethod
+    def initialize() -> 'AsyncIOMotorClient':
+        """
+        Create this process's Motor client. Call from the event loop that will
+        use it, e.g. on ASGI lifespan startup.
+        """
+        if MotorPool._CLIENT is not None and MotorPool._PID == os.getpid():
+            return MotorPool._CLIENT
+        from motor.motor_asyncio import AsyncIOMotorClient  # pylint: disable=import-outside-toplevel
+        options = MongoPool.client_options()
+        Resilience.configure()
+        MongoPool._STATS.reset()
+        MotorPool._CLIENT = AsyncIOMotorClient(MongoPool.uri(),
+                                               event_listeners=MongoPool._LISTENERS,
+                                               **options)
+        MotorPool._PID = os.getpid()
+        MongoPool._OPTIONS = options
+        MotorPool._LOG.info("MongoDB asyncio connection pool created", pid=MotorPool._PID, **options)
+        return MotorPool._CLIENT
+
+    @staticmethod
+    def client() -> 'AsyncIOMotorClient':
+        """ The shared Motor client for this process, created on first use """
+        client = MotorPool._CLIENT
+        if client is not None and MotorPool._PID == os.getpid():
+            return client
+        return MotorPool.initialize()
+
+    @staticmethod
+    def close() -> None:
+        if MotorPool._CLIENT is not None and MotorPool._PID == os.getpid():
+            MotorPool._CLIENT.close()
+            MotorPool._LOG.info("MongoDB asyncio connection pool closed", pid=MotorPool._PID)
+        MotorPool._CLIENT = None
+        MotorPool._PID = None
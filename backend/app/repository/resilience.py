@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Deadlines, retries and a circuit breaker for MongoDB operations.
+
+Repository methods decorated with resilient() are run as follows:
+    * deadline: each request has a time budget, REQUEST_BUDGET_MS (default
+      10000), started by middleware.RequestBudget. Each attempt of an
+      operation gets at most MONGO_OPERATION_TIMEOUT_MS (default 2000) of it,
+      passed to the server as maxTimeMS (Resilience.operation_timeout_ms()).
+      An operation started with no budget left, or stopped by maxTimeMS,
+      fails with 504. The same timeout is the default server selection
+      timeout (see MongoPool), so an unreachable datastore fails an attempt
+      within it instead of pinning the worker for the whole worker timeout
+    * retries: reads failing with a connection error are retried up to
+      MONGO_READ_RETRIES times (default 2), after a random delay of up to
+      MONGO_RETRY_BACKOFF_MS (default 50) doubling per retry ("full jitter"),
+      as long as the budget allows. Writes are never retried: we can't tell
+      whether a write that lost its connection was applied
+    * circuit breaker: after MONGO_BREAKER_FAILURES (default 5) consecutive
+      connection failures the breaker opens and operations fail fast with
+      503, without waiting on the datastore. After MONGO_BREAKER_RESET_SEC
+      (default 10) it half-opens: one operation is let through as a probe;
+      if the datastore answers, even with an error, the breaker closes; if
+      the connection fails it opens again. An operation failing without
+      reaching the datastore, e.g. with 400 for a malformed id, decides
+      nothing and lets the next operation probe.
+
+There is one breaker per worker process, shared by the sync and async
+repositories; its state is reported by /readiness and /metrics.
+"""
+import asyncio
+import functools
+import math
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict
+
+from pymongo import errors as pymongoErrors
+
+from ..common.config import env_float, env_int
+
+# ConnectionFailure covers AutoReconnect, NetworkTimeout and ServerSelectionTimeoutError
+CONNECTION_ERRORS = (pymongoErrors.ConnectionFailure,)
+
+_DEADLINE = ContextVar('deadline', default=None)
+
+
+class CircuitBreaker:
+    """
+    Closed: operations run. Open: operations are refused until reset_sec
+    after the last failure. Half-open: one probe operation runs at a time.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int, reset_sec: float):
+        self.failure_threshold = failure_threshold
+        self.reset_sec = reset_sec
+        self._lock = threading.Lock()
+        self._state = CircuitBreaker.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_at = None
+        self._opened = 0
+        self._rejected = 0
+
+    def allow(self) -> bool:
+        """ May an operation run now? In half-open state, the first caller becomes the probe """
+        with self._lock:
+            if self._state == CircuitBreaker.CLOSED:
+                return True
+            now = time.monotonic()
+            if self._state == CircuitBreaker.OPEN and now - self._opened_at >= self.reset_sec:
+                self._state = CircuitBreaker.HALF_OPEN
+                self._probe_at = None
+            # A probe that never reported back (e.g. cancelled) is replaced after reset_sec
+            if self._state == CircuitBreaker.HALF_OPEN and (
+                    self._probe_at is None or now - self._probe_at >= self.reset_sec):
+                self._probe_at = now
+                return True
+            self._rejected += 1
+            return False
+
+    def succeeded(self) -> None:
+        with self._lock:
+            self._state = CircuitBreaker.CLOSED
+            self._failures = 0
+            self._probe_at = None
+
+    def released(self) -> None:
+        """ An operation ended without reaching the datastore: a probe it was is not decided """
+        with self._lock:
+            if self._state == CircuitBreaker.HALF_OPEN:
+                self._probe_at = None
+
+    def failed(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == CircuitBreaker.HALF_OPEN or (
+                    self._state == CircuitBreaker.CLOSED and self._failures >= self.failure_threshold):
+                self._state = CircuitBreaker.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_at = None
+                self._opened += 1
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def retry_after(self) -> int:
+        """ Whole seconds until the breaker half-opens; 1 if it is not open """
+        with self._lock:
+            if self._state != CircuitBreaker.OPEN:
+                return 1
+            return max(1, math.ceil(self.reset_sec - (time.monotonic() - self._opened_at)))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(state=self._state,
+                        open=self._state != CircuitBreaker.CLOSED,
+                        consecutiveFailures=self._failures,
+                        opened=self._opened,
+                        rejected=self._rejected)
+
+
+class Resilience:
+    """
+    The process-wide resilience settings and circuit breaker.
+
+    All members are class level: there is exactly one breaker per process.
+    """
+    OPERATION_TIMEOUT_MS = 2000
+    READ_RETRIES = 2
+    RETRY_BACKOFF_MS = 50.0
+    BREAKER = CircuitBreaker(5, 10.0)
+
+    @staticmethod
+    def configure() -> None:
+        """ Read the settings from the environment and reset the breaker """
+        Resilience.OPERATION_TIMEOUT_MS = env_int('MONGO_OPERATION_TIMEOUT_MS', 2000)
+        Resilience.READ_RETRIES = env_int('MONGO_READ_RETRIES', 2)
+        Resilience.RETRY_BACKOFF_MS = env_float('MONGO_RETRY_BACKOFF_MS', 50.0)
+        Resilience.BREAKER = CircuitBreaker(env_int('MONGO_BREAKER_FAILURES', 5),
+                                            env_float('MONGO_BREAKER_RESET_SEC', 10.0))
+
+    @staticmethod
+    def start_budget(budget_ms: float):
+        """ Start the current request's time budget; returns a token for end_budget """
+        return _DEADLINE.set(time.monotonic() + budget_ms / 1000)
+
+    @staticmethod
+    def end_budget(token) -> None:
+        _DEADLINE.reset(token)
+
+    @staticmethod
+    def remaining_ms() -> float:
+        """ Budget left for the current request, None outside a request """
+        deadline = _DEADLINE.get()
+        return None if deadline is None else (deadline - time.monotonic()) * 1000
+
+    @staticmethod
+    def operation_timeout_ms() -> int:
+        """ maxTimeMS for an operation started now: the operation timeout, within the budget """
+        remaining = Resilience.remaining_ms()
+        if remaining is None:
+            return Resilience.OPERATION_TIMEOUT_MS
+        return max(1, min(Resilience.OPERATION_TIMEOUT_MS, int(remaining)))
+
+    @staticmethod
+    def stats() -> Dict:
+        return Resilience.BREAKER.stats()
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """
+        Seconds to wait before retry attempt + 1, or None if the read should
+        not be retried
+        """
+        if attempt >= Resilience.READ_RETRIES or Resilience.BREAKER.state != CircuitBreaker.CLOSED:
+            return None
+        delay_ms = random.uniform(0, Resilience.RETRY_BACKOFF_MS * 2 ** attempt)
+        remaining = Resilience.remaining_ms()
+        if remaining is not None and remaining <= delay_ms:
+            return None
+        return delay_ms / 1000
+
+    @staticmethod
+    def _admit(repo) -> None:
+        if not Resilience.BREAKER.allow():
+            repo._handle_service_unavailable(Resilience.BREAKER.retry_after())  # pylint: disable=protected-access
+        remaining = Resilience.remaining_ms()
+        if remaining is not None and remaining <= 0:
+            repo._handle_deadline_exceeded()  # pylint: disable=protected-access
+
+
+def resilient(read: bool):
+    """
+    Decorator for repository methods, plain or coroutine, that run MongoDB
+    operations: see the module doc. read=True marks the method as safe to retry.
+    The repository provides _handle_service_unavailable(retry_after) and
+    _handle_deadline_exceeded().
+    """
+    def decorate(method):
+        if asyncio.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def resilient_coroutine(self, *args, **kwargs):
+                attempt = 0
+                while True:
+                    Resilience._admit(self)  # pylint: disable=protected-access
+                    try:
+                        result = await method(self, *args, **kwargs)
+                    except CONNECTION_ERRORS:
+                        delay = _failed(self, read, attempt)
+                        await asyncio.sleep(delay)
+                        attempt += 1
+                        continue
+                    except pymongoErrors.ExecutionTimeout:
+                        Resilience.BREAKER.succeeded()
+                        self._handle_deadline_exceeded()  # pylint: disable=protected-access
+                    except pymongoErrors.PyMongoError:
+                        Resilience.BREAKER.succeeded()
+                        raise
+                    except Exception:
+                        # Raised before or without a round trip, e.g. 400 for a malformed id
+                        Resilience.BREAKER.released()
+                        raise
+                    Resilience.BREAKER.succeeded()
+                    return result
+            return resilient_coroutine
+
+        @functools.wraps(method)
+        def resilient_method(self, *args, **kwargs):
+            attempt = 0
+            while True:
+                Resilience._admit(self)  # pylint: disable=protected-access
+                try:
+                    result = method(self, *args, **kwargs)
+                except CONNECTION_ERRORS:
+                    delay = _failed(self, read, attempt)
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                except pymongoErrors.ExecutionTimeout:
+                    Resilience.BREAKER.succeeded()
+                    self._handle_deadline_exceeded()  # pylint: disable=protected-access
+                except pymongoErrors.PyMongoError:
+                    Resilience.BREAKER.succeeded()
+                    raise
+                except Exception:
+                    # Raised before or without a round trip, e.g. 400 for a malformed id
+                    Resilience.BREAKER.released()
+                    raise
+                Resilience.BREAKER.succeeded()
+                return result
+        return resilient_method
+    return decorate
+
+
+def _failed(repo, read: bool, attempt: int) -> float:
+    """ Record a connection failure; the delay before retrying, or raise 503 """
+    Resilience.BREAKER.failed()
+    delay = Resilience._backoff(attempt) if read else None  # pylint: disable=protected-access
+    if delay is None:
+        repo._handle_service_unavailable(Resilience.BREAKER.retry_after())  # pylint: disable=protected-access
+    return delay
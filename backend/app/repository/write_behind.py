@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind contact creation.
+
+With CONTACTS_WRITE_BEHIND=1, POST /contacts does not wait for the insert:
+the contact's ObjectId is generated here, the contact is added to a bounded
+queue and the request returns 202 Accepted with the id. A background thread
+inserts queued contacts with insert_many, in batches of up to
+WRITE_BEHIND_BATCH_SIZE (default 500) contacts, waiting at most
+WRITE_BEHIND_FLUSH_MS (default 50) for a batch to fill. Many small inserts
+become a few large ones, at the cost of the contact being readable, and
+durable, up to WRITE_BEHIND_FLUSH_MS plus one round trip later.
+
+When WRITE_BEHIND_QUEUE_SIZE (default 10000) contacts are waiting, further
+creates are refused with 503 so a datastore that can't keep up pushes back
+on clients instead of growing the queue.
+
+A batch failing with a connection error is retried up to WRITE_BEHIND_RETRIES
+(default 3) times; as ids are generated here, a contact the failed attempt
+did insert shows up as a duplicate key and is counted as written. Any other
+error fails the whole batch at once. Contacts that still fail are logged,
+listed by GET /contacts/writes, along with the queue counters, and passed to
+the on_failed() callbacks; each worker reports its own queue.
+
+The queue and its writer thread are a common.worker_queue.WorkerQueue,
+started on first use in each process. Queued contacts are flushed when a
+worker exits (app/gunicorn_conf.py) and at interpreter exit.
+"""
+import atexit
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+import falcon
+from bson.objectid import ObjectId
+from pymongo import errors as pymongoErrors
+
+from ..common.config import env_int
+from ..common.logging import Logger
+from ..common.worker_queue import WorkerQueue
+from .mongo_pool import MongoPool
+
+DUPLICATE_KEY = 11000
+
+
+class InsertQueue:
+    """
+    The process-wide write-behind queue and its writer thread.
+
+    All members are class level: there is exactly one queue per process.
+    """
+    MAX_FAILURES = 100
+
+    _LOG = Logger(__name__)
+    _LOCK = threading.Lock()
+    # The queue and writer thread of this process, set below
+    _WRITER = None
+    _MAX_SIZE = 10000
+    _BATCH_SIZE = 500
+    _FLUSH_SEC = 0.05
+    _RETRIES = 3
+    _PENDING = set()
+    _FAILURES = deque(maxlen=MAX_FAILURES)
+    _WRITTEN = 0
+    _FAILED = 0
+    _BATCHES = 0
+    _RETRIED = 0
+    _FAILED_CALLBACKS = []
+
+    @staticmethod
+    def reset() -> None:
+        """ Flush, then start over: the next submit re-reads the settings """
+        InsertQueue.flush()
+        InsertQueue._WRITER.reset()
+
+    @staticmethod
+    def submit(document: Dict) -> str:
+        """ Queue the contact for insertion; returns its new id, or raises 503 if the queue is full """
+        object_id = ObjectId()
+        contacts = InsertQueue._WRITER.queue(InsertQueue._start)
+        with InsertQueue._LOCK:
+            InsertQueue._PENDING.add(object_id)
+        try:
+            contacts.put_nowait(dict(document, _id=object_id))
+        except queue.Full:
+            with InsertQueue._LOCK:
+                InsertQueue._PENDING.discard(object_id)
+            raise falcon.HTTPServiceUnavailable(
+                title='Too many pending writes',
+                description='{} contacts are waiting to be written; retry shortly'.format(
+                    InsertQueue._MAX_SIZE),
+                retry_after=1)
+        return str(object_id)
+
+    @staticmethod
+    def on_failed(callback: Callable[[List[str]], None]) -> None:
+        """ Call callback with the ids of the contacts of each batch that could not be written """
+        with InsertQueue._LOCK:
+            if callback not in InsertQueue._FAILED_CALLBACKS:
+                InsertQueue._FAILED_CALLBACKS.append(callback)
+
+    @staticmethod
+    def status(contact_id: str) -> str:
+        """ 'pending', 'failed', or 'unknown' for contacts written or never queued by this worker """
+        object_id = ObjectId(contact_id) if ObjectId.is_valid(contact_id) else None
+        with InsertQueue._LOCK:
+            if object_id in InsertQueue._PENDING:
+                return 'pending'
+            if any(failure['id'] == contact_id for failure in InsertQueue._FAILURES):
+                return 'failed'
+        return 'unknown'
+
+    @staticmethod
+    def failures() -> List[Dict]:
+        """ The latest MAX_FAILURES contacts that could not be written, oldest first """
+        with InsertQueue._LOCK:
+            return list(InsertQueue._FAILURES)
+
+    @staticmethod
+    def flush(timeout: float = 10.0) -> bool:
+        """
+        Wait until every contact queued so far is written or has failed.
+        Returns False if that takes longer than timeout seconds.
+        """
+        return InsertQueue._WRITER.flush(timeout)
+
+    @staticmethod
+    def stats() -> Dict:
+        """ Queue counters for this process """
+        with InsertQueue._LOCK:
+            return dict(queued=InsertQueue._WRITER.qsize(),
+                        maxSize=InsertQueue._MAX_SIZE,
+                        written=InsertQueue._WRITTEN,
+                        failed=InsertQueue._FAILED,
+                        batches=InsertQueue._BATCHES,
+                        retried=InsertQueue._RETRIED)
+
+    @staticmethod
+    def _start() -> int:
+        """ A new queue of this process: read the settings and start counting over """
+        with InsertQueue._LOCK:
+            InsertQueue._MAX_SIZE = env_int('WRITE_BEHIND_QUEUE_SIZE', 10000)
+            InsertQueue._BATCH_SIZE = env_int('WRITE_BEHIND_BATCH_SIZE', 500)
+            InsertQueue._FLUSH_SEC = env_int('WRITE_BEHIND_FLUSH_MS', 50) / 1000
+            InsertQueue._RETRIES = env_int('WRITE_BEHIND_RETRIES', 3)
+            InsertQueue._PENDING = set()
+            InsertQueue._FAILURES = deque(maxlen=InsertQueue.MAX_FAILURES)
+            InsertQueue._WRITTEN = InsertQueue._FAILED = 0
+            InsertQueue._BATCHES = InsertQueue._RETRIED = 0
+        return InsertQueue._MAX_SIZE
+
+    @staticmethod
+    def _write(contacts: queue.Queue) -> None:
+        """ Writer thread: insert queued contacts one batch at a time """
+        while True:
+            batch, flushed = InsertQueue._next_batch(contacts)
+            if batch:
+                try:
+                    InsertQueue._insert(batch)
+                except Exception as ex:  # pylint: disable=broad-except
+                    # Keep the writer alive; the contacts are reported as failed
+                    InsertQueue._LOG.error("Write-behind batch failed", error=repr(ex))
+                    InsertQueue._record(batch, {index: repr(ex) for index in range(len(batch))})
+            for event in flushed:
+                event.set()
+
+    @staticmethod
+    def _next_batch(contacts: queue.Queue) -> tuple:
+        """
+        The contacts queued until the batch is full, WRITE_BEHIND_FLUSH_MS has
+        passed since the first, or a flush is requested; and the flush requests
+        """
+        batch = []
+        flushed = []
+        item = contacts.get()
+        deadline = time.monotonic() + InsertQueue._FLUSH_SEC
+        while True:
+            if isinstance(item, threading.Event):
+                flushed.append(item)
+                return batch, flushed
+            batch.append(item)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= InsertQueue._BATCH_SIZE or remaining <= 0:
+                return batch, flushed
+            try:
+                item = contacts.get(timeout=remaining)
+            except queue.Empty:
+                return batch, flushed
+
+    @staticmethod
+    def _insert(batch: List[Dict]) -> None:
+        collection = MongoPool.client().test.contacts
+        failed = {}
+        for attempt in range(InsertQueue._RETRIES + 1):
+            try:
+                collection.insert_many(batch, ordered=False)
+                failed = {}
+                break
+            except pymongoErrors.BulkWriteError as ex:
+                failed = {error['index']: error['errmsg'] for error in ex.details['writeErrors']
+                          if attempt == 0 or error['code'] != DUPLICATE_KEY}
+                break
+            except pymongoErrors.ConnectionFailure as ex:
+                failed = {index: str(ex) for index in range(len(batch))}
+                if attempt < InsertQueue._RETRIES:
+                    with InsertQueue._LOCK:
+                        InsertQueue._RETRIED += 1
+                    time.sleep(min(0.1 * 2 ** attempt, 2.0))
+            except pymongoErrors.PyMongoError as ex:
+                failed = {index: str(ex) for index in range(len(batch))}
+                break
+        InsertQueue._record(batch, failed)
+
+    @staticmethod
+    def _record(batch: List[Dict], failed: Dict[int, str]) -> None:
+        now = datetime.now(timezone.utc).isoformat()
+        with InsertQueue._LOCK:
+            for index, document in enumerate(batch):
+                InsertQueue._PENDING.discard(document['_id'])
+                if index in failed:
+                    InsertQueue._FAILURES.append(dict(id=str(document['_id']),
+                                                      error=failed[index],
+                                                      failedAt=now))
+            InsertQueue._WRITTEN += len(batch) - len(failed)
+            InsertQueue._FAILED += len(failed)
+            InsertQueue._BATCHES += 1
+        for index in failed:
+            InsertQueue._LOG.error("Write-behind insert failed",
+                                   contactId=str(batch[index]['_id']), error=failed[index])
+        if failed:
+            contact_ids = [str(batch[index]['_id']) for index in sorted(failed)]
+            for callback in list(InsertQueue._FAILED_CALLBACKS):
+                try:
+                    callback(contact_ids)
+                except Exception as ex:  # pylint: disable=broad-except
+                    InsertQueue._LOG.error("Write-behind failure callback failed", error=repr(ex))
+
+
+InsertQueue._WRITER = WorkerQueue('insert-writer', InsertQueue._write)  # pylint: disable=protected-access
+atexit.register(InsertQueue.flush)
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the JSON codecs available to app.common.json_codec.
+
+Each codec encodes and decodes the us-500 contacts, with ObjectId _ids, as a
+single json:api collection response: the GET /contacts payload.
+
+Run from backend/::
+
+    python -m benchmark.codecs [--repeat 200]
+"""
+import argparse
+import timeit
+
+from bson.objectid import ObjectId
+
+from app.common import json_api, json_codec
+from .datasets import load_us500
+
+
+def run(repeat: int) -> None:
+    contacts = [dict(contact, _id=ObjectId()) for contact in load_us500()]
+    body = json_api.make_response('contacts', '_id', contacts)
+    print('{} contacts, {} bytes per response, {} iterations'.format(
+        len(contacts), len(body.encode('utf-8')), repeat))
+    print('{:<8} {:>12} {:>12} {:>12} {:>12}'.format(
+        'codec', 'encode ms', 'encode/s', 'decode ms', 'decode/s'))
+    for codec in json_codec.available():
+        json_codec.select(codec)
+        encode = min(timeit.repeat(lambda: json_api.make_response('contacts', '_id', contacts),
+                                   number=repeat, repeat=3)) / repeat
+        decode = min(timeit.repeat(lambda: json_codec.loads(body),
+                                   number=repeat, repeat=3)) / repeat
+        print('{:<8} {:>12.3f} {:>12.0f} {:>12.3f} {:>12.0f}'.format(
+            codec, encode * 1000, 1 / encode, decode * 1000, 1 / decode))
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--repeat', type=int, default=200, help='iterations per measurement')
+    run(PARSER.parse_args().repeat)
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the contact representation on a large list: decoding it from BSON and
+encoding it as a json:api collection response.
+
+Compares:
+    * documents: pymongo's default decoding, with ObjectIds, which the JSON
+      codecs encode through a Python fallback
+    * repository: the decoding ContactsRepoMongo reads contacts for clients
+      with: ObjectIds decoded as their hex str (CONTACT_TYPE_REGISTRY)
+    * slots: a Contact class with a slot per field, decoded straight from BSON
+      as pymongo's document_class, reconstructed below. It holds a contact in
+      half the memory, but is filled through Python level __setitem__ calls,
+      and has to become a dict again for the JSON codecs
+
+The contacts are encoded to BSON once, as the datastore would send them, then
+for each model decoded with bson.decode_all, as pymongo decodes each batch,
+and encoded with make_response. Memory is the size of the decoded list, as
+measured by tracemalloc. Every model must encode the same response.
+
+Run from backend/::
+
+    python -m benchmark.contacts_model [--contacts 100000] [--repeat 3]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from collections.abc import MutableMapping
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List
+
+import bson
+from bson.codec_options import DEFAULT_CODEC_OPTIONS, CodecOptions
+
+from app.common import json_api, json_codec
+from app.repository.contacts_repository import CONTACT_TYPE_REGISTRY
+from .datasets import synthetic_contacts
+
+# In the order the datastore holds them, _id first, so every model encodes alike
+FIELDS = ('_id', 'firstName', 'lastName', 'companyName', 'address', 'city', 'county', 'state',
+          'zip', 'phone1', 'phone2', 'email', 'website', 'updatedAt')
+
+
+class SlotsContact(MutableMapping):
+    """ A contact with a slot per field; unknown fields are ignored """
+    __slots__ = FIELDS
+
+    def __setitem__(self, key: str, value) -> None:
+        if key in _FIELD_SET:
+            object.__setattr__(self, key, value)
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __delitem__(self, key: str) -> None:
+        delattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return (field for field in FIELDS if hasattr(self, field))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+_FIELD_SET = frozenset(FIELDS)
+
+
+def _encode_documents(contacts: List[Dict]) -> str:
+    return json_api.make_response('contacts', '_id', contacts)
+
+
+def _encode_slots(contacts: List[SlotsContact]) -> str:
+    # The JSON codecs only encode dicts as objects
+    return json_api.make_response('contacts', '_id', [dict(contact) for contact in contacts])
+
+
+# name -> (decoding options, encoder)
+MODELS = dict(
+    documents=(DEFAULT_CODEC_OPTIONS, _encode_documents),
+    repository=(CodecOptions(type_registry=CONTACT_TYPE_REGISTRY), _encode_documents),
+    slots=(CodecOptions(document_class=SlotsContact), _encode_slots),
+)
+
+
+def _best(function: Callable, repeat: int) -> tuple:
+    """ The result of function and its fastest run, in seconds """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def _decoded_bytes(data: bytes, options: CodecOptions) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        contacts = bson.decode_all(data, options)
+        return tracemalloc.get_traced_memory()[0] if contacts else 0
+    finally:
+        tracemalloc.stop()
+
+
+def run(count: int, repeat: int) -> None:
+    now = datetime.utcnow()
+    data = b''.join(bson.encode(dict(contact, updatedAt=now))
+                    for contact in synthetic_contacts(count))
+    print('{} contacts, {} BSON bytes, {} codec, best of {}'.format(
+        count, len(data), json_codec.active(), repeat))
+    print('{:<10} {:>10} {:>10} {:>10} {:>12} {:>10}'.format(
+        'model', 'decode ms', 'encode ms', 'total ms', 'contacts/s', 'memory MB'))
+    bodies = set()
+    for name, (options, encode) in MODELS.items():
+        contacts, decode_sec = _best(lambda: bson.decode_all(data, options), repeat)
+        body, encode_sec = _best(lambda: encode(contacts), repeat)
+        bodies.add(body)
+        del contacts
+        print('{:<10} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.0f} {:>10.1f}'.format(
+            name, decode_sec * 1000, encode_sec * 1000, (decode_sec + encode_sec) * 1000,
+            count / (decode_sec + encode_sec), _decoded_bytes(data, options) / 1000000))
+    if len(bodies) != 1:
+        raise AssertionError('The models encoded different responses')
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--contacts', type=int, default=100000, help='contacts per list')
+    PARSER.add_argument('--repeat', type=int, default=3, help='runs per measurement')
+    ARGS = PARSER.parse_args()
+    run(ARGS.contacts, ARGS.repeat)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark data sets.
+
+The us-500 contacts are read from the mongo shell seed script used to build the
+datastore image: datastore/us-500.mongo.js. synthetic_contacts scales them up
+to any size.
+"""
+import json
+import os
+import re
+from typing import Dict, List
+
+from bson.objectid import ObjectId
+
+US500_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'datastore', 'us-500.mongo.js')
+
+# Keys in the seed script are unquoted javascript identifiers: {firstName:"James",...
+_JS_KEY = re.compile(r'([{,])(\w+):"')
+
+
+def load_us500() -> List[Dict]:
+    """ The 500 contacts from datastore/us-500.mongo.js, without _ids """
+    contacts = []
+    with open(US500_PATH, encoding='utf-8') as seed:
+        for line in seed:
+            line = line.strip().rstrip(',')
+            if line.startswith('{'):
+                contacts.append(json.loads(_JS_KEY.sub(r'\1"\2":"', line)))
+    return contacts
+
+
+def synthetic_contacts(count: int) -> List[Dict]:
+    """
+    count contacts built by cycling through us-500, with unique emails and
+    deterministic _ids so separate processes seeded alike hold the same ids.
+    """
+    us500 = load_us500()
+    contacts = []
+    for i in range(count):
+        contact = dict(us500[i % len(us500)])
+        if i >= len(us500):
+            user, domain = contact['email'].split('@', 1)
+            contact['email'] = '{}+{}@{}'.format(user, i // len(us500), domain)
+        contact['_id'] = contact_id(i)
+        contacts.append(contact)
+    return contacts
+
+
+def contact_id(i: int) -> ObjectId:
+    """ The _id synthetic_contacts gives the i'th contact """
+    return ObjectId('{:024x}'.format(i + 1))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the benchmarks that drive a real server: starting gunicorn,
+issuing requests over keep-alive connections and summarizing latencies.
+"""
+import http.client
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+WSGI_APP = 'app.app:run()'
+ASGI_APP = 'app.asgi:run()'
+ASGI_WORKER_ARGS = ['--worker-class', 'uvicorn.workers.UvicornWorker']
+
+
+def start_gunicorn(app: str, port: int, workers: int, worker_args: List[str] = (),
+                   env: Dict = None) -> subprocess.Popen:
+    """ Start gunicorn as build/docker-entrypoint.sh does, listening on localhost:port """
+    env = dict(os.environ, **(env or {}))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [env.get('PYTHONPATH'), '.']))
+    command = [sys.executable, '-m', 'gunicorn', '-b', '127.0.0.1:{}'.format(port),
+               '--workers', str(workers), '--config', 'python:app.gunicorn_conf',
+               '--log-level', 'warning'] + list(worker_args) + [app]
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop(server: subprocess.Popen) -> None:
+    server.terminate()
+    server.wait()
+
+
+def connect(port: int) -> http.client.HTTPConnection:
+    return http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+
+def request(connection: http.client.HTTPConnection, method: str, path: str,
+            body: str = None) -> tuple:
+    """ Issue one request; returns the status and the body read """
+    headers = {'Content-Type': 'application/vnd.api+json'} if body is not None else {}
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    return response.status, response.read()
+
+
+def get(port: int, path: str) -> tuple:
+    connection = connect(port)
+    try:
+        return request(connection, 'GET', path)
+    finally:
+        connection.close()
+
+
+def wait_ready(port: int, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if get(port, '/readiness')[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError('server on port {} not ready after {}s'.format(port, timeout))
+
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    """ Throughput and latency percentiles, in ms, for latencies in seconds """
+    latencies = sorted(latencies)
+    return dict(requests=len(latencies),
+                errors=errors,
+                reqPerSec=round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+                p50Ms=round(percentile(latencies, 0.50) * 1000, 3),
+                p95Ms=round(percentile(latencies, 0.95) * 1000, 3),
+                p99Ms=round(percentile(latencies, 0.99) * 1000, 3))
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""
+Load test every route of app.app.initialize() and report latency percentiles
+and throughput per endpoint.
+
+The datastore is seeded with --contacts synthetic contacts scaled up from
+datastore/us-500.mongo.js (see benchmark.datasets). Targets:
+
+    testclient: the app in this process, driven one request at a time through
+                falcon's TestClient against a mongomock datastore. Measures
+                the service's own CPU cost per request.
+    gunicorn:   a real gunicorn server driven over http by --concurrency
+                clients. The datastore is mongomock, seeded identically in
+                each worker, or with --mongo-uri a real mongod; add --seed to
+                replace its test.contacts collection with the synthetic data.
+
+Results are printed and, with --output, saved as JSON that a later run can
+be compared against with --compare.
+
+Run from backend/::
+
+    python -m benchmark.load --target testclient --contacts 100000 --output before.json
+    python -m benchmark.load --target testclient --contacts 100000 --compare before.json
+    python -m benchmark.load --target gunicorn --mongo-uri mongodb://localhost:27017/ --seed
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, List
+
+from . import driver
+from .datasets import contact_id, synthetic_contacts
+
+# One route to load.
+#   name: reported name
+#   method: http method
+#   path: callable(rng) -> the path and query string of the next request
+#   body: callable(rng) -> the request body, or None
+#   weight: fraction of --requests issued for this endpoint
+Endpoint = namedtuple('Endpoint', 'name method path body weight')
+
+STATES = ('CA', 'NY', 'TX', 'FL', 'MO', 'NJ', 'PA', 'OH')
+
+
+def make_endpoints(count: int) -> List[Endpoint]:
+    """
+    The endpoints to load, for a datastore seeded with count synthetic contacts.
+    The last tenth of the contacts are reserved for DELETE.
+    """
+    readable = max(1, count - count // 10)
+
+    def any_id(rng: random.Random) -> str:
+        return str(contact_id(rng.randrange(readable)))
+
+    def disposable_id(rng: random.Random) -> str:
+        return str(contact_id(rng.randrange(readable, count) if readable < count else 0))
+
+    template = synthetic_contacts(1)[0]
+    del template['_id']
+
+    def contact_body(rng: random.Random) -> str:
+        contact = dict(template)
+        contact['zip'] = '{:05d}'.format(rng.randrange(100000))
+        return json.dumps(contact)
+
+    def bulk_body(rng: random.Random) -> str:
+        operations = [{'op': 'update', 'ref': {'type': 'contacts', 'id': any_id(rng)},
+                       'data': {'type': 'contacts', 'attributes': {'phone2': '555-0100'}}}
+                      for _ in range(10)]
+        return json.dumps({'atomic:operations': operations})
+
+    return [
+        Endpoint('GET /contacts', 'GET',
+                 lambda rng: '/contacts?page%5Bsize%5D=100&page%5Bafter%5D=' + any_id(rng),
+                 None, 1.0),
+        Endpoint('GET /contacts?filter&sort&fields', 'GET',
+                 lambda rng: '/contacts?filter%5Bstate%5D={}&sort=lastName'
+                             '&fields%5Bcontacts%5D=firstName,lastName,email'
+                             '&page%5Bsize%5D=100'.format(rng.choice(STATES)),
+                 None, 1.0),
+        Endpoint('GET /contacts/{id}', 'GET', lambda rng: '/contacts/' + any_id(rng), None, 1.0),
+        Endpoint('POST /contacts', 'POST', lambda rng: '/contacts', contact_body, 1.0),
+        Endpoint('PATCH /contacts/{id}', 'PATCH', lambda rng: '/contacts/' + any_id(rng),
+                 lambda rng: json.dumps({'zip': '{:05d}'.format(rng.randrange(100000))}), 1.0),
+        Endpoint('PUT /contacts/{id}', 'PUT', lambda rng: '/contacts/' + any_id(rng),
+                 contact_body, 1.0),
+        Endpoint('DELETE /contacts/{id}', 'DELETE', lambda rng: '/contacts/' + disposable_id(rng),
+                 None, 1.0),
+        Endpoint('POST /contacts/bulk', 'POST', lambda rng: '/contacts/bulk', bulk_body, 0.2),
+        Endpoint('GET /contacts/export', 'GET', lambda rng: '/contacts/export', None, 0.01),
+        Endpoint('GET /liveness', 'GET', lambda rng: '/liveness', None, 1.0),
+        Endpoint('GET /metrics', 'GET', lambda rng: '/metrics', None, 0.2),
+        Endpoint('GET /readiness', 'GET', lambda rng: '/readiness', None, 1.0),
+        Endpoint('GET /ping', 'GET', lambda rng: '/ping', None, 1.0),
+    ]
+
+
+def seed(mongo, count: int) -> None:
+    """ Replace test.contacts with count synthetic contacts """
+    collection = mongo.test.contacts
+    collection.drop()
+    contacts = synthetic_contacts(count)
+    for start in range(0, count, 10000):
+        collection.insert_many(contacts[start:start + 10000])
+
+
+def _install_mongomock(count: int) -> None:
+    """ Seed a mongomock datastore and make it this process's shared client """
+    import mongomock  # pylint: disable=import-outside-toplevel
+    from app.repository.mongo_pool import MongoPool  # pylint: disable=import-outside-toplevel
+
+    os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017/')
+    client = mongomock.MongoClient()
+    seed(client, count)
+    MongoPool._CLIENT = client  # pylint: disable=protected-access
+    MongoPool._PID = os.getpid()  # pylint: disable=protected-access
+
+
+def mongomock_app():
+    """
+    Gunicorn app factory for the gunicorn target without --mongo-uri:
+    app.app:run() over a mongomock datastore of BENCHMARK_CONTACTS contacts.
+    """
+    from app import app  # pylint: disable=import-outside-toplevel
+    _install_mongomock(int(os.environ['BENCHMARK_CONTACTS']))
+    return app.run()
+
+
+def _counts(endpoints: List[Endpoint], requests: int) -> List[int]:
+    return [max(1, int(requests * endpoint.weight)) for endpoint in endpoints]
+
+
+def run_testclient(count: int, requests: int) -> Dict:
+    # Render log records as in production but discard them
+    logging.basicConfig(stream=open(os.devnull, 'w'), format='%(message)s', level='INFO')
+    from falcon import testing  # pylint: disable=import-outside-toplevel
+    from app import app  # pylint: disable=import-outside-toplevel
+    from app.common.logging import initialize_logging  # pylint: disable=import-outside-toplevel
+    initialize_logging()
+    _install_mongomock(count)
+    client = testing.TestClient(app.initialize())
+
+    results = {}
+    endpoints = make_endpoints(count)
+    for endpoint, number in zip(endpoints, _counts(endpoints, requests)):
+        rng = random.Random(endpoint.name)
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(number):
+            path, _, query = endpoint.path(rng).partition('?')
+            body = endpoint.body(rng) if endpoint.body else None
+            start = time.perf_counter()
+            response = client.simulate_request(endpoint.method, path, query_string=query or None,
+                                               body=body)
+            latency = time.perf_counter() - start
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(latency)
+        results[endpoint.name] = driver.summarize(latencies, errors,
+                                                  time.perf_counter() - started)
+        _print_row(endpoint.name, results[endpoint.name])
+    return results
+
+
+def _http_client(port: int, endpoint: Endpoint, remaining: List[int], lock: threading.Lock,
+                 rng: random.Random, latencies: List[float], errors: List) -> None:
+    connection = driver.connect(port)
+    while True:
+        with lock:
+            if remaining[0] <= 0:
+                break
+            remaining[0] -= 1
+        body = endpoint.body(rng) if endpoint.body else None
+        start = time.perf_counter()
+        try:
+            status, _ = driver.request(connection, endpoint.method, endpoint.path(rng), body)
+        except (OSError, http.client.HTTPException) as ex:
+            errors.append(type(ex).__name__)
+            connection.close()
+            connection = driver.connect(port)
+            continue
+        latency = time.perf_counter() - start
+        if status >= 400:
+            errors.append(status)
+        else:
+            latencies.append(latency)
+    connection.close()
+
+
+def run_gunicorn(count: int, requests: int, concurrency: int, workers: int, port: int,
+                 mongo_uri: str, reseed: bool) -> Dict:
+    if mongo_uri:
+        env = dict(MONGO_URI=mongo_uri)
+        app = driver.WSGI_APP
+        if reseed:
+            from pymongo import MongoClient  # pylint: disable=import-outside-toplevel
+            mongo = MongoClient(mongo_uri)
+            seed(mongo, count)
+            mongo.close()
+    else:
+        env = dict(MONGO_URI=os.getenv('MONGO_URI', 'mongodb://localhost:27017/'),
+                   BENCHMARK_CONTACTS=str(count))
+        app = 'benchmark.load:mongomock_app()'
+
+    server = driver.start_gunicorn(app, port, workers, env=env)
+    results = {}
+    try:
+        driver.wait_ready(port, timeout=600)
+        endpoints = make_endpoints(count)
+        for endpoint, number in zip(endpoints, _counts(endpoints, requests)):
+            latencies, errors = [], []
+            remaining, lock = [number], threading.Lock()
+            threads = [threading.Thread(target=_http_client,
+                                        args=(port, endpoint, remaining, lock,
+                                              random.Random('{}{}'.format(endpoint.name, i)),
+                                              latencies, errors))
+                       for i in range(min(concurrency, number))]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[endpoint.name] = driver.summarize(latencies, len(errors),
+                                                      time.perf_counter() - started)
+            _print_row(endpoint.name, results[endpoint.name])
+    finally:
+        driver.stop(server)
+    return results
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_header() -> None:
+    print('{:<36} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9}'.format(
+        'endpoint', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+
+
+def _print_row(name: str, result: Dict) -> None:
+    print('{:<36} {requests:>8} {errors:>7} {reqPerSec:>10.1f} '
+          '{p50Ms:>9.2f} {p95Ms:>9.2f} {p99Ms:>9.2f}'.format(name, **result))
+
+
+def compare(previous: Dict, current: Dict) -> None:
+    """ Print the change in req/s and p95 per endpoint from a previous run """
+    print('\ncompared to {} ({}):'.format(previous['meta'].get('commit'),
+                                          previous['meta'].get('date')))
+    print('{:<36} {:>10} {:>10}'.format('endpoint', 'req/s', 'p95'))
+    for name, result in current['endpoints'].items():
+        before = previous['endpoints'].get(name)
+        if not before:
+            continue
+        print('{:<36} {:>+9.1f}% {:>+9.1f}%'.format(
+            name, _change(before['reqPerSec'], result['reqPerSec']),
+            _change(before['p95Ms'], result['p95Ms'])))
+
+
+def _change(before: float, after: float) -> float:
+    return (after - before) / before * 100 if before else 0.0
+
+
+def main(args: argparse.Namespace) -> None:
+    print('{} target, {} contacts, {} requests per endpoint'.format(
+        args.target, args.contacts, args.requests))
+    _print_header()
+    if args.target == 'testclient':
+        endpoints = run_testclient(args.contacts, args.requests)
+    else:
+        endpoints = run_gunicorn(args.contacts, args.requests, args.concurrency, args.workers,
+                                 args.port, args.mongo_uri, args.seed)
+
+    from app.common import json_codec  # pylint: disable=import-outside-toplevel
+    result = dict(
+        meta=dict(commit=_commit(),
+                  date=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                  target=args.target,
+                  datastore='mongod' if args.mongo_uri and args.target == 'gunicorn' else 'mongomock',
+                  contacts=args.contacts,
+                  requests=args.requests,
+                  concurrency=args.concurrency if args.target == 'gunicorn' else 1,
+                  workers=args.workers if args.target == 'gunicorn' else None,
+                  python=platform.python_version(),
+                  jsonCodec=json_codec.active()),
+        endpoints=endpoints)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(result, output, indent=2)
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), result)
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--target', choices=('testclient', 'gunicorn'), default='testclient')
+    PARSER.add_argument('--contacts', type=int, default=100000, help='contacts to seed')
+    PARSER.add_argument('--requests', type=int, default=500,
+                        help='requests per endpoint, scaled by the endpoint weight')
+    PARSER.add_argument('--concurrency', type=int, default=16, help='gunicorn target: clients')
+    PARSER.add_argument('--workers', type=int, default=2, help='gunicorn target: workers')
+    PARSER.add_argument('--port', type=int, default=8124, help='gunicorn target: port')
+    PARSER.add_argument('--mongo-uri', help='gunicorn target: use this mongod, not mongomock')
+    PARSER.add_argument('--seed', action='store_true',
+                        help='with --mongo-uri: replace test.contacts with synthetic contacts')
+    PARSER.add_argument('--output', help='save the results to this JSON file')
+    PARSER.add_argument('--compare', help='compare with the results saved in this JSON file')
+    main(PARSER.parse_args())
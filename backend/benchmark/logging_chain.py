@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Measure structlog events/sec through the JSON logging chain.
+
+Compares the chain initialize_logging builds with the chain it replaced,
+reconstructed below as LEGACY_CHAIN, logging the two records Telemetry
+writes for every request. Records go through the stdlib logging package to a
+discarded stream, as they would to stdout.
+
+Run from backend/::
+
+    python -m benchmark.logging_chain [--events 50000]
+"""
+import argparse
+import datetime
+import logging
+import os
+import threading
+import time
+
+import structlog
+
+from app.common import json_codec
+from app.common.logging import LogEntryProcessor
+from .datasets import load_us500
+
+
+def _legacy_add_app_info(_, __, event_dict: dict) -> dict:
+    event_dict.update(LogEntryProcessor.app_info())
+    event_dict['logThreadId'] = threading.current_thread().name
+    if LogEntryProcessor.get_request_id():
+        event_dict['logRequestId'] = LogEntryProcessor.get_request_id()
+    return event_dict
+
+
+def _legacy_add_logger_name(logger, _, event_dict: dict) -> dict:
+    record = event_dict.get("_record")
+    event_dict["loggerName"] = logger.name if record is None else record.name
+    return event_dict
+
+
+def _legacy_add_timestamp(_, __, event_dict: dict) -> dict:
+    now = datetime.datetime.utcnow()
+    millis = '{:3d}'.format(int(now.microsecond / 1000))
+    event_dict["timestamp"] = "%s.%sZ" % (now.strftime('%Y-%m-%dT%H:%M:%S'), millis)
+    return event_dict
+
+
+def _legacy_cleanup_keynames(_, __, event_dict: dict) -> dict:
+    event_dict['logMessage'] = event_dict['event']
+    del event_dict['event']
+    return event_dict
+
+
+LEGACY_CHAIN = [
+    _legacy_add_app_info,
+    _legacy_add_logger_name,
+    _legacy_add_timestamp,
+    LogEntryProcessor.censor_password,
+    structlog.processors.StackInfoRenderer(),
+    structlog.processors.format_exc_info,
+    _legacy_cleanup_keynames,
+    json_codec.render_log,
+]
+
+CURRENT_CHAIN = [
+    LogEntryProcessor.add_context,
+    LogEntryProcessor.censor_password,
+    LogEntryProcessor.format_exc_info,
+    LogEntryProcessor.cleanup_keynames,
+    LogEntryProcessor.render,
+]
+
+
+def _logger(chain: list):
+    stdlib = logging.getLogger('benchmark.logging_chain')
+    stdlib.propagate = False
+    stdlib.setLevel(logging.INFO)
+    if not stdlib.handlers:
+        stdlib.addHandler(logging.StreamHandler(open(os.devnull, 'w')))
+    return structlog.wrap_logger(stdlib, processors=chain,
+                                 wrapper_class=structlog.stdlib.BoundLogger,
+                                 context_class=dict)
+
+
+def measure(chain: list, events: int, body: dict) -> float:
+    """ events/sec, logging a request and a response record per request """
+    logger = _logger(chain)
+    start = time.perf_counter()
+    for _ in range(events // 2):
+        logger.info("Request received", level="Info", logCategory='apiRequest',
+                    reqReferrer='127.0.0.1', reqVerb='PUT', reqPath='/contacts/5970fc55f33a80de48ba7a54',
+                    reqQuery='', reqBody=body)
+        logger.info("Request completed", level="Info", logCategory='apiResponse',
+                    reqDurationMicros=1234, reqStatusCode=200)
+    return events / (time.perf_counter() - start)
+
+
+def run(events: int) -> None:
+    body = load_us500()[0]
+    print('{} events, json codec {}'.format(events, json_codec.active()))
+    legacy = max(measure(LEGACY_CHAIN, events, body) for _ in range(3))
+    current = max(measure(CURRENT_CHAIN, events, body) for _ in range(3))
+    print('{:<8} {:>12}'.format('chain', 'events/s'))
+    print('{:<8} {:>12.0f}'.format('before', legacy))
+    print('{:<8} {:>12.0f} {:>+8.1f}%'.format('after', current, (current - legacy) / legacy * 100))
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--events', type=int, default=50000, help='events to log per measurement')
+    run(PARSER.parse_args().events)
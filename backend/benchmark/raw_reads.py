@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Compare large list responses read through pymongo's cursor and through raw
+BSON batches (CONTACTS_RAW_READS=1).
+
+The app runs in this process, driven through falcon's TestClient, against
+the MongoDB at MONGO_URI, which must hold the contacts collection; add
+--seed to replace it with --contacts synthetic contacts. For each mode, every
+page of GET /contacts?page[size]=1000 is fetched, following links.next, then
+GET /contacts/export, best of --repeat. Both modes must serve the same
+responses.
+
+Run from backend/::
+
+    MONGO_URI='mongodb://localhost:27017/' \
+    python -m benchmark.raw_reads [--seed] [--contacts 100000] [--repeat 3]
+"""
+import argparse
+import logging
+import os
+import time
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+from falcon import testing
+
+from app import app
+from app.common.logging import initialize_logging
+from app.repository.mongo_pool import MongoPool
+from .load import seed
+
+PAGE_QUERY = 'page[size]=1000'
+
+
+def _pages(client: testing.TestClient) -> List[bytes]:
+    """ Every page of the contacts list """
+    pages = []
+    path, query = '/contacts', PAGE_QUERY
+    while path:
+        response = client.simulate_get(path, query_string=query)
+        pages.append(response.content)
+        next_link = response.json.get('links', {}).get('next')
+        if next_link:
+            parts = urlsplit(next_link)
+            path, query = parts.path, parts.query
+        else:
+            path = None
+    return pages
+
+
+def _export(client: testing.TestClient) -> List[bytes]:
+    return [client.simulate_get('/contacts/export').content]
+
+
+def _best(function, client: testing.TestClient, repeat: int) -> tuple:
+    """ The responses of function and its fastest run, in seconds """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        responses = function(client)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return responses, best
+
+
+def measure(raw: bool, repeat: int) -> Dict:
+    os.environ['CONTACTS_RAW_READS'] = '1' if raw else '0'
+    client = testing.TestClient(app.initialize())
+    pages, list_sec = _best(_pages, client, repeat)
+    export, export_sec = _best(_export, client, repeat)
+    return dict(pages=pages, list_sec=list_sec, export=export, export_sec=export_sec)
+
+
+def run(repeat: int) -> None:
+    # Render log records as in production but discard them
+    logging.basicConfig(stream=open(os.devnull, 'w'), format='%(message)s', level='INFO')
+    initialize_logging()
+    count = MongoPool.client().test.contacts.count_documents({})
+    if not count:
+        raise RuntimeError('the contacts collection is empty; add --seed')
+    print('{} contacts, {}, best of {}'.format(count, PAGE_QUERY, repeat))
+    print('{:<8} {:>8} {:>10} {:>12} {:>10} {:>12}'.format(
+        'reads', 'pages', 'list ms', 'contacts/s', 'export ms', 'contacts/s'))
+    results = []
+    for raw in (False, True):
+        result = measure(raw, repeat)
+        results.append(result)
+        print('{:<8} {:>8} {:>10.1f} {:>12.0f} {:>10.1f} {:>12.0f}'.format(
+            'raw' if raw else 'cursor', len(result['pages']), result['list_sec'] * 1000,
+            count / result['list_sec'], result['export_sec'] * 1000, count / result['export_sec']))
+    if any(results[0][key] != results[1][key] for key in ('pages', 'export')):
+        raise AssertionError('Raw reads served different responses')
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--seed', action='store_true', help='replace test.contacts first')
+    PARSER.add_argument('--contacts', type=int, default=100000, help='contacts to seed')
+    PARSER.add_argument('--repeat', type=int, default=3, help='runs per measurement')
+    ARGS = PARSER.parse_args()
+    if ARGS.seed:
+        seed(MongoPool.client(), ARGS.contacts)
+    run(ARGS.repeat)
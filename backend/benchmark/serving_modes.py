@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the WSGI (sync workers) and ASGI (uvicorn workers) serving modes.
+
+Each mode is started with gunicorn as build/docker-entrypoint.sh starts it,
+against the MongoDB at MONGO_URI, which must hold the contacts collection
+(e.g. the datastore image seeded with us-500). Clients then issue GET
+/contacts/{id} and GET /contacts?page[size]=20 requests from --concurrency
+threads for --duration seconds, and the throughput and latency are reported.
+
+Run from backend/::
+
+    MONGO_URI='mongodb://localhost:27017/' \
+    python -m benchmark.serving_modes [--workers 2] [--concurrency 64] [--duration 10]
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from typing import Dict, List
+
+from . import driver
+
+MODES = (
+    ('wsgi', [], driver.WSGI_APP),
+    ('asgi', driver.ASGI_WORKER_ARGS, driver.ASGI_APP),
+)
+
+
+def _client(port: int, paths: List[str], stop_at: float, latencies: List[float], errors: List) -> None:
+    connection = driver.connect(port)
+    i = 0
+    while time.monotonic() < stop_at:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            status, _ = driver.request(connection, 'GET', path)
+            if status != 200:
+                errors.append(status)
+                continue
+        except (OSError, http.client.HTTPException) as ex:
+            errors.append(type(ex).__name__)
+            connection.close()
+            connection = driver.connect(port)
+            continue
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+
+
+def measure(port: int, concurrency: int, duration: float) -> Dict:
+    body = json.loads(driver.get(port, '/contacts?page%5Bsize%5D=100')[1])
+    ids = [item['id'] for item in body['data']]
+    if not ids:
+        raise RuntimeError('the contacts collection is empty; seed it first')
+    paths = ['/contacts/{}'.format(contact_id) for contact_id in ids]
+    paths.append('/contacts?page%5Bsize%5D=20')
+
+    latencies, errors = [], []
+    stop_at = time.monotonic() + duration
+    threads = [threading.Thread(target=_client, args=(port, paths, stop_at, latencies, errors))
+               for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return driver.summarize(latencies, len(errors), duration)
+
+
+def run(workers: int, concurrency: int, duration: float, port: int) -> None:
+    print('{} workers, {} concurrent clients, {}s per mode'.format(workers, concurrency, duration))
+    print('{:<6} {:>10} {:>8} {:>10} {:>10} {:>10} {:>10}'.format(
+        'mode', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for mode, worker_args, app in MODES:
+        server = driver.start_gunicorn(app, port, workers, worker_args, env=dict(SERVER_MODE=mode))
+        try:
+            driver.wait_ready(port)
+            result = measure(port, concurrency, duration)
+        finally:
+            driver.stop(server)
+        print('{:<6} {requests:>10} {errors:>8} {reqPerSec:>10.0f} '
+              '{p50Ms:>10.2f} {p95Ms:>10.2f} {p99Ms:>10.2f}'.format(mode, **result))
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    PARSER.add_argument('--workers', type=int, default=2, help='gunicorn workers per mode')
+    PARSER.add_argument('--concurrency', type=int, default=64, help='concurrent client connections')
+    PARSER.add_argument('--duration', type=float, default=10, help='seconds to measure each mode')
+    PARSER.add_argument('--port', type=int, default=8123, help='port to serve on')
+    ARGS = PARSER.parse_args()
+    run(ARGS.workers, ARGS.concurrency, ARGS.duration, ARGS.port)
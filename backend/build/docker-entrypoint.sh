@@ -1,8 +1,26 @@
 #!/usr/bin/env bash
 
+# SERVER_MODE selects the app: 'wsgi' (default) runs app/app.py on sync
+# workers, 'asgi' runs app/asgi.py on uvicorn asyncio workers (Python 3.7+)
+if [ "${SERVER_MODE:-wsgi}" = "asgi" ]; then
+    WORKER_ARGS="--worker-class uvicorn.workers.UvicornWorker"
+    APP='app.asgi:run()'
+else
+    WORKER_ARGS=""
+    APP='app.app:run()'
+fi
+
+# Workers share /metrics through the files in this directory
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-metrics}
+# and rate limits and requests in progress through the file in this one
+export ADMISSION_DIR=${ADMISSION_DIR:-/tmp/admission}
+mkdir -p "${PROMETHEUS_MULTIPROC_DIR}" "${ADMISSION_DIR}"
+
 PYTHONPATH=$PYTHONPATH:. \
 gunicorn \
     -b 0.0.0.0:8000 \
     --workers 5 \
+    ${WORKER_ARGS} \
+    --config python:app.gunicorn_conf \
     --logger-class app.common.logging.GunicornLogger \
-    'app.app:run()'
+    "${APP}"
@@ -7,6 +7,7 @@ LOG_MODE=LOCAL \
 MONGO_URI='mongodb://localhost:27017/' \
 gunicorn \
     --reload \
+    --config python:app.gunicorn_conf \
     --logger-class src.common.logging.GunicornLogger \
     'app.app:run()'
 
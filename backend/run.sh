@@ -5,6 +5,7 @@
 PYTHONPATH=$PYTHONPATH:. \
 MONGO_URI='mongodb://localhost:27017/' \
 gunicorn \
+    --config python:app.gunicorn_conf \
     --logger-class src.common.logging.GunicornLogger \
     'app.app:run()'
 
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures: an in-memory mongomock datastore installed as the process-wide
+MongoClient, with an empty contacts search index, and falcon test clients for
+the full WSGI and ASGI applications.
+"""
+import os
+
+import mongomock
+import pytest
+from falcon import testing
+from mongomock_motor import AsyncMongoMockClient
+
+from app import app, asgi
+from app.common.logging import initialize_logging
+from app.common.search_index import SearchIndex
+from app.controller.contacts_controller import ContactsController
+from app.repository.mongo_pool import MongoPool, MotorPool
+
+# Gunicorn initializes logging before loading the app; do the same for tests
+initialize_logging()
+
+
+def make_contact(i: int) -> dict:
+    """ A synthetic contact shaped like the datastore/us-500 records """
+    return dict(firstName='First{}'.format(i),
+                lastName='Last{}'.format(i),
+                companyName='Company {}'.format(i % 10),
+                address='{} Main St'.format(i),
+                city='City{}'.format(i % 7),
+                county='County{}'.format(i % 5),
+                state=('MO', 'CA', 'NY')[i % 3],
+                zip='{:05d}'.format(i),
+                phone1='555-000-{:04d}'.format(i),
+                phone2='555-111-{:04d}'.format(i),
+                email='contact{}@example.com'.format(i),
+                website='http://www.example{}.com'.format(i))
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    monkeypatch.setenv('MONGO_URI', 'mongodb://localhost:27017/')
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(MongoPool, '_CLIENT', client)
+    monkeypatch.setattr(MongoPool, '_PID', os.getpid())
+    # A search index of the new, empty, datastore, built on first search
+    monkeypatch.setattr(ContactsController, '_SEARCH', SearchIndex(ContactsController.SEARCH_FIELDS))
+    yield client
+
+
+@pytest.fixture
+def contacts(mongo):
+    """ Seed 25 contacts and return their ids as strings, in insertion (_id) order """
+    result = mongo.test.contacts.insert_many([make_contact(i) for i in range(25)])
+    return [str(object_id) for object_id in result.inserted_ids]
+
+
+@pytest.fixture
+def api_client(mongo):
+    return testing.TestClient(app.initialize())
+
+
+@pytest.fixture
+def asgi_client(mongo, monkeypatch):
+    monkeypatch.setattr(MotorPool, '_CLIENT', AsyncMongoMockClient(mock_mongo_client=mongo))
+    monkeypatch.setattr(MotorPool, '_PID', os.getpid())
+    # TestClient runs lifespan shutdown after every simulated request
+    monkeypatch.setattr(MotorPool, 'close', staticmethod(lambda: None))
+    return testing.TestClient(asgi.initialize())
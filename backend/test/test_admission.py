@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import time
+
+import pytest
+from falcon import testing
+
+from app import app
+from app.common.admission import Admission, SharedStore
+
+
+@pytest.fixture(autouse=True)
+def admission():
+    Admission.reset()
+    yield
+    Admission.reset()
+
+
+def _client(monkeypatch, **env):
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return testing.TestClient(app.initialize())
+
+
+def test_rate_limited_per_client_and_route(mongo, contacts, monkeypatch):
+    client = _client(monkeypatch, RATE_LIMIT_PER_SEC='0.5', RATE_LIMIT_BURST='3',
+                     RATE_LIMIT_ROUTE_COSTS='GET /contacts=2')
+    assert client.simulate_get('/contacts').status_code == 200
+    refused = client.simulate_get('/contacts')
+    assert refused.status_code == 429
+    assert refused.headers['retry-after'] == '2'
+    assert refused.json['errors'][0]['title'] == 'Rate limit exceeded'
+
+    # Cheaper routes still fit; other clients and health probes are not limited
+    assert client.simulate_get('/contacts/{}'.format(contacts[0])).status_code == 200
+    assert client.simulate_get('/contacts', headers={'X-Api-Key': 'other'}).status_code == 200
+    assert client.simulate_get('/contacts', remote_addr='10.0.0.2').status_code == 200
+    assert client.simulate_get('/readiness').status_code == 200
+    assert Admission.stats()['limited'] == 1
+
+
+def test_refused_before_body_is_read(mongo, contacts, monkeypatch):
+    client = _client(monkeypatch, RATE_LIMIT_PER_SEC='0.1', RATE_LIMIT_BURST='1')
+    assert client.simulate_get('/contacts').status_code == 200
+    # A body that is not JSON would be refused with 400 if it were parsed
+    assert client.simulate_post('/contacts', body='{not json').status_code == 429
+    # and the refusal is measured
+    assert 'method="POST",route="/contacts",status="429"' in client.simulate_get('/metrics').text
+
+
+def test_rate_limited_asgi(mongo, contacts, monkeypatch, request):
+    monkeypatch.setenv('RATE_LIMIT_PER_SEC', '0.5')
+    monkeypatch.setenv('ADMISSION_MAX_IN_FLIGHT', '2')
+    client = request.getfixturevalue('asgi_client')
+    assert client.simulate_get('/contacts').status_code == 200
+    assert client.simulate_get('/contacts').status_code == 429
+    assert Admission.stats()['inFlight'] == 0
+
+
+def test_client_behind_trusted_proxy(mongo, contacts, monkeypatch):
+    client = _client(monkeypatch, RATE_LIMIT_PER_SEC='0.1', RATE_LIMIT_BURST='1',
+                     RATE_LIMIT_TRUSTED_PROXIES='1')
+    forwarded = dict(headers={'X-Forwarded-For': '1.1.1.1, 2.2.2.2'}, remote_addr='10.0.0.1')
+    assert client.simulate_get('/contacts', **forwarded).status_code == 200
+    # The proxy forwarded for 2.2.2.2; the address claimed before it is not trusted
+    forwarded['headers'] = {'X-Forwarded-For': '3.3.3.3, 2.2.2.2'}
+    assert client.simulate_get('/contacts', **forwarded).status_code == 429
+    forwarded['headers'] = {'X-Forwarded-For': '4.4.4.4'}
+    assert client.simulate_get('/contacts', **forwarded).status_code == 200
+
+
+def test_shed_over_max_in_flight(mongo, contacts, monkeypatch):
+    client = _client(monkeypatch, ADMISSION_MAX_IN_FLIGHT='1', ADMISSION_RETRY_AFTER_SEC='3')
+    assert Admission.enter(1)
+    shed = client.simulate_get('/contacts')
+    assert shed.status_code == 503
+    assert shed.headers['retry-after'] == '3'
+    assert client.simulate_get('/liveness').status_code == 200
+
+    Admission.leave()
+    assert client.simulate_get('/contacts').status_code == 200
+    assert client.simulate_get('/contacts').status_code == 200
+    assert Admission.stats() == dict(store='memory', limited=0, shed=1, inFlight=0)
+
+
+def _spend_and_hold(path: str, done) -> None:
+    store = SharedStore(path, 64)
+    store.take('addr:1.1.1.1', 1, 0.001, 2, time.time())
+    store.enter(10)
+    done.set()
+
+
+def test_shared_across_processes(tmpdir, monkeypatch):
+    monkeypatch.setenv('ADMISSION_DIR', str(tmpdir))
+    monkeypatch.setenv('RATE_LIMIT_CLIENTS', '64')
+    Admission.clear_shared_dir()
+    context = multiprocessing.get_context('fork')
+    done = context.Event()
+    worker = context.Process(target=_spend_and_hold,
+                             args=(os.path.join(str(tmpdir), 'admission.mmap'), done))
+    worker.start()
+    worker.join(10)
+    assert done.is_set()
+
+    # The other worker spent a token of this client's bucket, and holds a request
+    assert Admission.take('addr:1.1.1.1', 1, 0.001, 2) == 0
+    assert Admission.take('addr:1.1.1.1', 1, 0.001, 2) > 0
+    assert Admission.stats()['store'] == 'shared'
+    assert Admission.stats()['inFlight'] == 1
+    Admission.mark_process_dead(worker.pid)
+    assert Admission.stats()['inFlight'] == 0
+
+    # Without the gunicorn hooks, the requests of a worker that is gone are dropped when full
+    worker = context.Process(target=_spend_and_hold,
+                             args=(os.path.join(str(tmpdir), 'admission.mmap'), context.Event()))
+    worker.start()
+    worker.join(10)
+    assert Admission.stats()['inFlight'] == 1
+    assert Admission.enter(1)
+    assert not Admission.enter(1)
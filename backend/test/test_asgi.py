@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+The ASGI app serves the same responses as the WSGI app.
+
+The Motor client is a mongomock-motor client over the same in-memory
+datastore the WSGI app's MongoClient uses (see conftest.asgi_client).
+"""
+import sys
+
+import falcon
+import pytest
+
+from app import asgi
+
+
+def test_asgi_matches_wsgi(api_client, asgi_client, contacts):
+    for path, query in (('/contacts', 'page[size]=10'),
+                        ('/contacts', 'page[size]=10&page[after]={}'.format(contacts[9])),
+                        ('/contacts', 'filter[state]=MO&sort=-lastName&fields[contacts]=zip'
+                                      '&page[size]=3&page[after]={}'.format(contacts[21])),
+                        ('/contacts/{}'.format(contacts[3]), None),
+                        ('/contacts/search', 'q=last1&page[size]=5&page[offset]=5'),
+                        ('/contacts/export', None)):
+        expected = api_client.simulate_get(path, query_string=query)
+        response = asgi_client.simulate_get(path, query_string=query)
+        assert response.status == expected.status == falcon.HTTP_OK
+        assert response.content == expected.content
+        assert response.headers.get('etag') == expected.headers.get('etag')
+
+
+def test_asgi_writes(asgi_client, contacts):
+    path = '/contacts/{}'.format(contacts[0])
+    etag = asgi_client.simulate_get(path).headers['etag']
+    response = asgi_client.simulate_patch(path, body='{"city":"Kansas City"}',
+                                          headers={'If-Match': etag})
+    assert response.json['data']['attributes']['city'] == 'Kansas City'
+    response = asgi_client.simulate_put(path, body='{"firstName":"Lost","lastName":"Found"}',
+                                        headers={'If-Match': etag})
+    assert response.status == falcon.HTTP_PRECONDITION_FAILED
+
+    response = asgi_client.simulate_post('/contacts/bulk', body='{"atomic:operations":['
+                                         '{"op":"remove","ref":{"id":"%s"}}]}' % contacts[1])
+    assert response.json['meta']['succeeded'] == 1
+    assert asgi_client.simulate_get('/contacts/{}'.format(contacts[1])).status == falcon.HTTP_NOT_FOUND
+    assert asgi_client.simulate_get('/readiness').status == falcon.HTTP_OK
+
+
+def test_asgi_traced(asgi_client, contacts):
+    response = asgi_client.simulate_get('/contacts/{}'.format(contacts[0]),
+                                        headers={'x-request-id': 'abc'})
+    assert response.headers['x-request-id'] == 'abc'
+    assert 'controller.get_item;dur=' in response.headers['server-timing']
+    assert response.headers['traceparent'].startswith('00-')
+
+
+def test_asgi_refused_before_python_3_7(monkeypatch):
+    monkeypatch.setattr(sys, 'version_info', (3, 6, 2))
+    with pytest.raises(RuntimeError):
+        asgi.initialize()
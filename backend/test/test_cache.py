@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+from bson.objectid import ObjectId
+
+from app.common.cache import LruCache
+from app.controller.contacts_controller import ContactsController
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction():
+    cache = LruCache(max_size=2, ttl_sec=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1      # 'b' is now least recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    stats = cache.stats()
+    assert (stats['size'], stats['hits'], stats['misses'], stats['evictions']) == (2, 3, 1, 1)
+
+
+def test_ttl_expiry():
+    clock = FakeClock()
+    cache = LruCache(max_size=10, ttl_sec=5, clock=clock)
+    cache.put('a', 1)
+    clock.now = 4.9
+    assert cache.get('a') == 1
+    clock.now = 5.0
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_get_or_load_does_not_store_across_invalidation():
+    cache = LruCache(max_size=10, ttl_sec=60)
+
+    def stale_loader():
+        cache.invalidate('a')       # a write lands while we were reading
+        return 'stale'
+
+    assert cache.get_or_load('a', stale_loader) == 'stale'
+    assert cache.get_or_load('a', lambda: 'fresh') == 'fresh'
+    assert cache.get('a') == 'fresh'
+
+
+def test_disabled_cache_always_loads():
+    cache = LruCache(max_size=0, ttl_sec=60)
+    calls = []
+    for _ in range(3):
+        cache.get_or_load('a', lambda: calls.append(1))
+    assert len(calls) == 3
+    assert cache.stats()['size'] == 0
+
+
+def test_concurrent_use_stays_bounded():
+    cache = LruCache(max_size=50, ttl_sec=60)
+
+    def worker(offset):
+        for i in range(2000):
+            key = (i + offset) % 200
+            cache.get_or_load(key, lambda: key)
+            if i % 7 == 0:
+                cache.invalidate(key)
+
+    threads = [threading.Thread(target=worker, args=(n * 13,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert cache.stats()['size'] <= 50
+
+
+@pytest.fixture
+def contacts_cache(monkeypatch):
+    cache = LruCache(max_size=100, ttl_sec=60)
+    monkeypatch.setattr(ContactsController, '_CACHE', cache)
+    return cache
+
+
+def test_contact_reads_are_cached_and_writes_invalidate(api_client, contacts, contacts_cache):
+    path = '/contacts/{}'.format(contacts[0])
+    api_client.simulate_get(path)
+    api_client.simulate_get(path)
+    assert contacts_cache.stats()['hits'] == 1
+
+    api_client.simulate_patch(path, body='{"firstName":"Patched"}')
+    response = api_client.simulate_get(path)
+    assert response.json['data']['attributes']['firstName'] == 'Patched'
+
+    api_client.simulate_delete(path)
+    assert api_client.simulate_get(path).status_code == 404
+
+
+def test_if_match_checked_against_stored_contact(api_client, mongo, contacts, contacts_cache, monkeypatch):
+    path = '/contacts/{}'.format(contacts[0])
+    api_client.simulate_get(path)
+    # Another worker updates the contact; this worker's cached copy is stale
+    mongo.test.contacts.update_one({'_id': ObjectId(contacts[0])}, {'$set': {'firstName': 'Elsewhere'}})
+    with monkeypatch.context() as uncached:
+        uncached.setattr(ContactsController, '_CACHE', LruCache(max_size=0, ttl_sec=60))
+        current = api_client.simulate_get(path).headers['etag']
+
+    response = api_client.simulate_patch(path, body='{"city":"Kansas City"}', headers={'If-Match': current})
+    assert response.status_code == 200
+    assert response.json['data']['attributes']['firstName'] == 'Elsewhere'
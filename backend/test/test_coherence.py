@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Writes made by other workers reach this worker's cache and search index.
+
+mongomock has no change streams, so these follow changes by polling.
+"""
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+import pytest
+from bson.objectid import ObjectId
+
+from app.common.cache import LruCache
+from app.controller.coherence import Coherence
+from app.controller.contacts_controller import ContactsController
+from app.controller.contacts_controller_async import AsyncContactsController
+from app.repository import change_feed
+
+
+@pytest.fixture
+def polling(mongo, monkeypatch):
+    monkeypatch.setenv('CONTACTS_COHERENCE', 'poll')
+    monkeypatch.setenv('CONTACTS_COHERENCE_POLL_SEC', '0.01')
+    monkeypatch.setattr(ContactsController, '_CACHE', LruCache(max_size=100, ttl_sec=300))
+    yield mongo
+    Coherence.stop()
+
+
+def _follow(feed: change_feed.ContactsChangeFeed, seconds: float) -> list:
+    stopped = threading.Event()
+    threading.Timer(seconds, stopped.set).start()
+    return list(feed.follow(stopped))
+
+
+def _wait_for(condition) -> None:
+    deadline = time.monotonic() + 2
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_poll_feed_reports_each_write_once(polling, api_client, contacts):
+    api_client.simulate_patch('/contacts/{}'.format(contacts[0]), json={'city': 'Kansas City'})
+    api_client.simulate_delete('/contacts/{}'.format(contacts[1]))
+    assert polling.test.contacts_deleted.count_documents({}) == 1
+
+    changes = _follow(change_feed.ContactsChangeFeed(['lastName', 'city']), 0.2)
+    assert [change.contact_id for change in changes] == contacts[:2]
+    assert changes[0].contact['city'] == 'Kansas City'
+    assert changes[1].contact is None
+
+
+def test_poll_feed_resyncs_after_gap(polling, monkeypatch):
+    monkeypatch.setenv('CONTACTS_COHERENCE_TOMBSTONE_SEC', '0')
+    assert change_feed.RESYNC in _follow(change_feed.ContactsChangeFeed(), 0.05)
+
+
+def test_coherence_applies_other_workers_writes(polling, contacts):
+    controller = ContactsController()
+    assert controller.get_item(None, contacts[0])['lastName'] == 'Last0'
+    assert controller.search(None, 'moved', 10) == (0, [])
+    Coherence.start()
+
+    # Another worker's writes
+    polling.test.contacts.update_one({'_id': ObjectId(contacts[0])},
+                                     {'$set': {'lastName': 'Moved', 'updatedAt': datetime.utcnow()}})
+    _wait_for(lambda: controller.get_item(None, contacts[0])['lastName'] == 'Moved')
+    _wait_for(lambda: controller.search(None, 'moved', 10)[0] == 1)
+    assert Coherence.stats()['source'] == 'poll'
+    assert Coherence.stats()['running']
+
+
+def test_resync_rebuilds(polling, contacts):
+    controller = ContactsController()
+    controller.get_item(None, contacts[0])
+    controller.search(None, 'last', 10)
+    polling.test.contacts.delete_many({})
+    controller.resync()
+    assert ContactsController.cache_stats()['size'] == 0
+    assert controller.search(None, 'last', 10) == (0, [])
+
+
+def test_async_resync_rebuilds(polling, contacts, asgi_client):
+    controller = AsyncContactsController()
+
+    async def resync():
+        await controller.search(None, 'last', 10)
+        polling.test.contacts.delete_many({})
+        await controller.resync()
+        return await controller.search(None, 'last', 10)
+    assert asyncio.new_event_loop().run_until_complete(resync()) == (0, [])
+    assert ContactsController.cache_stats()['size'] == 0
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+from urllib.parse import urlsplit
+
+import falcon
+import pytest
+
+
+def _next_path(body: dict) -> str:
+    parts = urlsplit(body['links']['next'])
+    return '{}?{}'.format(parts.path, parts.query)
+
+
+def test_get_contacts_paginates_by_id(api_client, contacts):
+    response = api_client.simulate_get('/contacts', query_string='page[size]=10')
+    assert response.status == falcon.HTTP_OK
+    assert [item['id'] for item in response.json['data']] == contacts[:10]
+
+    path, query = _next_path(response.json).split('?')
+    response = api_client.simulate_get(path, query_string=query)
+    assert [item['id'] for item in response.json['data']] == contacts[10:20]
+
+    path, query = _next_path(response.json).split('?')
+    response = api_client.simulate_get(path, query_string=query)
+    assert [item['id'] for item in response.json['data']] == contacts[20:]
+    assert 'links' not in response.json
+
+
+def test_get_contacts_enforces_max_page_size(api_client, contacts, monkeypatch):
+    from app.api.contacts_api import ContactsApi
+    monkeypatch.setattr(ContactsApi, 'MAX_PAGE_SIZE', 5)
+    response = api_client.simulate_get('/contacts', query_string='page[size]=500')
+    assert len(response.json['data']) == 5
+    assert 'page%5Bsize%5D=5' in response.json['links']['next']
+
+
+def test_get_contacts_rejects_bad_page_params(api_client, contacts):
+    response = api_client.simulate_get('/contacts', query_string='page[size]=0')
+    assert response.status == falcon.HTTP_BAD_REQUEST
+    response = api_client.simulate_get('/contacts', query_string='page[after]=nope')
+    assert response.status == falcon.HTTP_BAD_REQUEST
+
+
+def test_get_contact_if_none_match(api_client, contacts):
+    path = '/contacts/{}'.format(contacts[0])
+    response = api_client.simulate_get(path)
+    etag = response.headers['etag']
+
+    response = api_client.simulate_get(path, headers={'If-None-Match': etag})
+    assert response.status == falcon.HTTP_NOT_MODIFIED
+    assert response.content == b''
+
+    response = api_client.simulate_get('/contacts', query_string='page[size]=5')
+    response = api_client.simulate_get('/contacts', query_string='page[size]=5',
+                                       headers={'If-None-Match': 'W/"x", ' + response.headers['etag']})
+    assert response.status == falcon.HTTP_NOT_MODIFIED
+
+
+def test_update_contact_if_match(api_client, contacts):
+    path = '/contacts/{}'.format(contacts[0])
+    etag = api_client.simulate_get(path).headers['etag']
+
+    response = api_client.simulate_patch(path, body='{"city":"Kansas City"}',
+                                         headers={'If-Match': etag})
+    assert response.status == falcon.HTTP_OK
+    assert response.headers['etag'] != etag
+    assert api_client.simulate_get(path).headers['etag'] == response.headers['etag']
+
+    # The original ETag is now stale
+    response = api_client.simulate_put(path, body='{"firstName":"Lost","lastName":"Found"}',
+                                       headers={'If-Match': etag})
+    assert response.status == falcon.HTTP_PRECONDITION_FAILED
+
+
+def test_put_back_attributes_read(api_client):
+    created = api_client.simulate_post('/contacts', json={'firstName': 'Round', 'lastName': 'Trip'})
+    contact_id = created.json['data']['id']
+    path = '/contacts/{}'.format(contact_id)
+    read = api_client.simulate_get(path)
+    attributes = read.json['data']['attributes']
+    assert {'_id', 'updatedAt'}.issubset(attributes)
+    attributes['city'] = 'Kansas City'
+
+    response = api_client.simulate_put(path, json=attributes, headers={'If-Match': read.headers['etag']})
+    assert response.status == falcon.HTTP_OK
+    written = response.json['data']['attributes']
+    assert written['city'] == 'Kansas City' and written['_id'] == contact_id
+
+    # Read-only fields alone don't make a patch
+    response = api_client.simulate_patch(path, json={'_id': contact_id})
+    assert response.status == falcon.HTTP_BAD_REQUEST
+
+
+def test_conditional_write_detects_concurrent_change(contacts, mongo):
+    from bson.objectid import ObjectId
+    from falcon import testing
+    from app.repository.contacts_repository import ContactsRepoMongo
+
+    repo = ContactsRepoMongo()
+    read = mongo.test.contacts.find_one({'_id': ObjectId(contacts[0])})
+    mongo.test.contacts.update_one({'_id': read['_id']}, {'$set': {'zip': '99999'}})
+
+    req = falcon.Request(testing.create_environ())
+    req.context['body_json'] = {'city': 'Nowhere'}
+    with pytest.raises(falcon.HTTPPreconditionFailed):
+        repo.update_item(req, contacts[0], expected=read)
+    with pytest.raises(falcon.HTTPNotFound):
+        repo.update_item(req, str(ObjectId()), expected=read)
+
+
+def test_get_contacts_filter_sort_fields(api_client, contacts, mongo):
+    # Duplicate lastNames make the _id tie break part of the keyset
+    mongo.test.contacts.update_many({'zip': {'$in': ['00003', '00006', '00009']}},
+                                    {'$set': {'lastName': 'Same'}})
+    expected = sorted(mongo.test.contacts.find({'state': {'$in': ['MO', 'NY']}}),
+                      key=lambda c: (c['lastName'], str(c['_id'])), reverse=True)
+
+    seen = []
+    query = 'filter[state]=MO,NY&sort=-lastName&fields[contacts]=lastName,state&page[size]=4'
+    path = '/contacts'
+    while True:
+        response = api_client.simulate_get(path, query_string=query)
+        assert response.status == falcon.HTTP_OK
+        for item in response.json['data']:
+            assert set(item['attributes']) == {'_id', 'lastName', 'state'}
+            seen.append(item['id'])
+        if 'links' not in response.json:
+            break
+        path, query = _next_path(response.json).split('?')
+    assert seen == [str(c['_id']) for c in expected]
+
+
+@pytest.mark.parametrize('sort', ['companyName', '-companyName', 'companyName,-email'])
+def test_get_contacts_pages_through_missing_sort_fields(api_client, contacts, mongo, sort):
+    # Contacts without a value sort first, as null
+    mongo.test.contacts.update_many({'zip': {'$in': ['00002', '00005', '00011', '00020']}},
+                                    {'$unset': {'companyName': ''}})
+    mongo.test.contacts.update_many({'zip': {'$in': ['00005', '00007']}}, {'$unset': {'email': ''}})
+    mongo.test.contacts.update_one({'zip': '00013'}, {'$set': {'companyName': None}})
+
+    # Stable sorts, least significant key first: _id, in the last key's direction, breaks ties
+    keys = sort.split(',')
+    expected = sorted(mongo.test.contacts.find(), key=lambda c: str(c['_id']),
+                      reverse=keys[-1].startswith('-'))
+    for key in reversed(keys):
+        field = key.lstrip('-')
+        expected.sort(key=lambda c: (c.get(field) is not None, c.get(field) or ''),
+                      reverse=key.startswith('-'))
+
+    seen = []
+    path, query = '/contacts', 'sort={}&page[size]=3'.format(sort)
+    while True:
+        response = api_client.simulate_get(path, query_string=query)
+        assert response.status == falcon.HTTP_OK
+        seen.extend(item['id'] for item in response.json['data'])
+        if 'links' not in response.json:
+            break
+        path, query = _next_path(response.json).split('?')
+    assert seen == [str(c['_id']) for c in expected]
+
+
+@pytest.mark.parametrize('query', ['filter[city]=Town', 'sort=zip', 'sort=state,-state',
+                                   'fields[contacts]=password'])
+def test_get_contacts_rejects_unknown_fields(api_client, contacts, query):
+    response = api_client.simulate_get('/contacts', query_string=query)
+    assert response.status == falcon.HTTP_BAD_REQUEST
+
+
+def test_ensure_indexes(mongo):
+    from app.repository.contacts_repository import ContactsRepoMongo
+    ContactsRepoMongo().ensure_indexes()
+    keys = [list(index['key']) for index in mongo.test.contacts.index_information().values()]
+    for field in ContactsRepoMongo.INDEXED_FIELDS:
+        assert any(key[0][0] == field for key in keys)
+
+
+def test_contact_schema_accepts_us500():
+    from app.api.contact_schema import CONTACT
+    from benchmark.datasets import load_us500
+    assert not [contact for contact in load_us500() if CONTACT.errors(contact)]
+
+
+@pytest.mark.parametrize('body, detail', [
+    ({'firstName': 'A'}, '"lastName" is required'),
+    ({'firstName': 'A', 'lastName': 'B', 'password': 'x'}, '"password" is not a contact field'),
+    ({'firstName': 'A', 'lastName': 'B' * 51}, '"lastName" must be at most 50 characters'),
+    ({'firstName': 'A', 'lastName': 'B', 'email': 'nobody'}, '"email" must match'),
+    ({'firstName': 1, 'lastName': 'B'}, '"firstName" must be a string'),
+    (['A', 'B'], 'The body must be a JSON object'),
+])
+def test_post_contact_validated(api_client, mongo, body, detail):
+    response = api_client.simulate_post('/contacts', json=body)
+    assert response.status == falcon.HTTP_BAD_REQUEST
+    assert detail in response.json['errors'][0]['detail']
+    assert mongo.test.contacts.count_documents({}) == 0
+
+
+def test_patch_contact_validated_partially(api_client, contacts):
+    path = '/contacts/{}'.format(contacts[0])
+    assert api_client.simulate_patch(path, json={'state': 'KS'}).status == falcon.HTTP_OK
+    assert api_client.simulate_patch(path, json={'state': 'Kansas'}).status == \
+        falcon.HTTP_BAD_REQUEST
+    assert api_client.simulate_patch(path, json={'_id': contacts[1]}).status == \
+        falcon.HTTP_BAD_REQUEST
+    assert api_client.simulate_patch(path, json={}).status == falcon.HTTP_BAD_REQUEST
+    assert api_client.simulate_put(path, json={'city': 'Nowhere'}).status == \
+        falcon.HTTP_BAD_REQUEST
+
+
+def test_request_body_limited(mongo, monkeypatch):
+    from falcon import testing
+    from app import app
+    monkeypatch.setenv('REQUEST_BODY_MAX_BYTES', '64')
+    client = testing.TestClient(app.initialize())
+    response = client.simulate_post('/contacts', json={'firstName': 'A' * 50, 'lastName': 'B'})
+    assert response.status == falcon.HTTP_REQUEST_ENTITY_TOO_LARGE
+    response = client.simulate_post('/contacts', body='{"firstName": ')
+    assert response.status == falcon.HTTP_BAD_REQUEST
+    assert response.json['errors'][0]['title'] == 'Malformed JSON'
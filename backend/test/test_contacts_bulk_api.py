@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import json
+
+import falcon
+from bson.objectid import ObjectId
+
+from benchmark.datasets import load_us500
+
+
+def _add(attributes: dict) -> dict:
+    return dict(op='add', data=dict(type='contacts', attributes=attributes))
+
+
+def _update(contact_id: str, attributes: dict) -> dict:
+    return dict(op='update', ref=dict(type='contacts', id=contact_id),
+                data=dict(type='contacts', attributes=attributes))
+
+
+def _remove(contact_id: str) -> dict:
+    return dict(op='remove', ref=dict(type='contacts', id=contact_id))
+
+
+def _post(api_client, operations: list, ordered: bool = True):
+    return api_client.simulate_post('/contacts/bulk',
+                                    query_string='ordered={}'.format(str(ordered).lower()),
+                                    body=json.dumps({'atomic:operations': operations}))
+
+
+def test_bulk_loads_us500_in_one_request(api_client, mongo):
+    response = _post(api_client, [_add(contact) for contact in load_us500()])
+    assert response.status == falcon.HTTP_OK
+    assert response.json['meta'] == dict(ordered=True, succeeded=500, failed=0, notAttempted=0)
+    assert mongo.test.contacts.count_documents({}) == 500
+    first = response.json['atomic:results'][0]
+    assert first['meta']['status'] == '201'
+    assert mongo.test.contacts.find_one({'_id': ObjectId(first['data']['id'])})['lastName'] == 'Butt'
+
+
+def test_bulk_ordered_stops_at_first_failure(api_client, contacts, mongo):
+    missing = str(ObjectId())
+    response = _post(api_client, [_update(contacts[0], {'city': 'A'}),
+                                  _remove(missing),
+                                  _remove(contacts[1])])
+    statuses = [result.get('meta', {}).get('status') or result['errors'][0]['status']
+                for result in response.json['atomic:results']]
+    assert statuses == ['200', '404', '424']
+    assert response.json['atomic:results'][1]['errors'][0]['source']['pointer'] == \
+        '/atomic:operations/1'
+    assert mongo.test.contacts.find_one({'_id': ObjectId(contacts[0])})['city'] == 'A'
+    assert mongo.test.contacts.find_one({'_id': ObjectId(contacts[1])}) is not None
+
+
+def test_bulk_unordered_applies_every_valid_operation(api_client, contacts, mongo):
+    response = _post(api_client, [dict(op='upsert'),
+                                  _remove(contacts[1]),
+                                  _add({'firstName': 'New', 'lastName': 'Contact'})], ordered=False)
+    assert response.json['meta'] == dict(ordered=False, succeeded=2, failed=1, notAttempted=0)
+    assert response.json['atomic:results'][0]['errors'][0]['status'] == '400'
+    assert mongo.test.contacts.find_one({'_id': ObjectId(contacts[1])}) is None
+
+
+def test_bulk_contact_removed_earlier_in_the_request_is_not_found(api_client, contacts, mongo):
+    response = _post(api_client, [_remove(contacts[0]),
+                                  _update(contacts[0], {'city': 'A'}),
+                                  _remove(contacts[0]),
+                                  _update(contacts[1], {'city': 'B'})], ordered=False)
+    statuses = [result.get('meta', {}).get('status') or result['errors'][0]['status']
+                for result in response.json['atomic:results']]
+    assert statuses == ['204', '404', '404', '200']
+    assert response.json['atomic:results'][1]['errors'][0]['title'] == 'Contact not found'
+    assert mongo.test.contacts.find_one({'_id': ObjectId(contacts[0])}) is None
+
+
+def test_bulk_rejects_oversized_requests(api_client, mongo, monkeypatch):
+    monkeypatch.setenv('CONTACTS_BULK_MAX_OPERATIONS', '2')
+    from falcon import testing
+    from app import app
+    client = testing.TestClient(app.initialize())
+    response = _post(client, [_add({'a': 1})] * 3)
+    assert response.status == falcon.HTTP_BAD_REQUEST
+
+
+def test_bulk_operations_validated(api_client, contacts, mongo):
+    response = _post(api_client, [_add({'firstName': 'New'}),
+                                  _update(contacts[0], {'zip': 'ABCDE'}),
+                                  _update(contacts[1], {'zip': '64105'})], ordered=False)
+    assert response.json['meta'] == dict(ordered=False, succeeded=1, failed=2, notAttempted=0)
+    assert '"lastName" is required' in response.json['atomic:results'][0]['errors'][0]['detail']
+    assert '"zip" must match' in response.json['atomic:results'][1]['errors'][0]['detail']
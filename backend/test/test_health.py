@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import time
+
+import falcon
+import pytest
+from falcon import testing
+
+from app import app
+from app.controller.health_checker import HealthChecker
+from app.repository.contacts_repository import ContactsRepoMongo
+
+
+@pytest.fixture
+def checks(monkeypatch):
+    """ A checker whose check counts its calls and fails while failing[0] is set """
+    monkeypatch.setenv('HEALTH_CHECK_INTERVAL_SEC', '0.05')
+    monkeypatch.setenv('HEALTH_FRESH_MIN_INTERVAL_SEC', '0.2')
+    calls = []
+    failing = [False]
+
+    def check():
+        calls.append(1)
+        if failing[0]:
+            raise falcon.HTTPServiceUnavailable(title='down', description='ping failed')
+    checker = HealthChecker(dict(mongodbPing=check))
+    yield checker, calls, failing
+    checker.stop()
+
+
+def test_probes_served_from_cache(mongo, monkeypatch):
+    monkeypatch.setenv('HEALTH_CHECK_INTERVAL_SEC', '60')
+    monkeypatch.setenv('HEALTH_FRESH_MIN_INTERVAL_SEC', '0')
+    calls = []
+    ping = ContactsRepoMongo.ping
+    monkeypatch.setattr(ContactsRepoMongo, 'ping', lambda self: calls.append(1) or ping(self))
+    client = testing.TestClient(app.initialize())
+
+    for _ in range(20):
+        result = client.simulate_get('/readiness')
+        assert result.status == falcon.HTTP_OK
+    assert len(calls) == 1
+    attributes = result.json['data']['attributes']
+    assert attributes['checkIntervalSec'] == 60
+    assert attributes['checkAgeMillis'] >= 0
+    assert 'mongodbPingDurationMicros' in attributes
+
+    assert client.simulate_get('/readiness', query_string='fresh=1').status == falcon.HTTP_OK
+    assert len(calls) == 2
+    assert client.simulate_get('/liveness').json['data']['attributes']['mongodb'] == 'ok'
+
+
+def test_fresh_checks_rate_limited(checks):
+    checker, calls, _ = checks
+    first = checker.verdict('mongodbPing')
+    assert checker.verdict('mongodbPing', fresh=True) is first
+    assert len(calls) == 1
+    time.sleep(0.25)
+    assert checker.verdict('mongodbPing', fresh=True) is not first
+
+
+def test_background_checks_refresh_verdict(checks):
+    checker, calls, failing = checks
+    assert checker.verdict('mongodbPing').ok
+    failing[0] = True
+    time.sleep(0.2)
+    verdict = checker.verdict('mongodbPing')
+    assert not verdict.ok
+    assert verdict.error == 'ping failed'
+    assert len(calls) > 1
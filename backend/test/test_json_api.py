@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from app.common import json_api, json_codec
+from app.common.json_api import make_response, stream_response
+
+
+def _contacts(count: int) -> list:
+    return [dict(_id='{:024x}'.format(i), firstName='Zoë', lastName='Ø{}'.format(i),
+                 companyName='Ümlaut "Quoted" & Co')
+            for i in range(count)]
+
+
+@pytest.fixture(params=json_codec.available())
+def codec(request):
+    previous = json_codec.active()
+    yield json_codec.select(request.param)
+    json_codec.select(previous)
+
+
+@pytest.mark.parametrize('count', [0, 1, 3, 2000])
+@pytest.mark.parametrize('links', [None, dict(next='/contacts?page%5Bafter%5D=1')])
+def test_stream_response_matches_make_response(codec, count, links):
+    data = _contacts(count)
+    buffered = make_response('contacts', '_id', data, links).encode('utf-8')
+    streamed = b''.join(stream_response('contacts', '_id', iter(data), links))
+    assert streamed == buffered
+
+
+def test_stream_response_is_chunked(monkeypatch):
+    monkeypatch.setattr(json_api, 'STREAM_CHUNK_BYTES', 1024)
+    chunks = list(stream_response('contacts', '_id', iter(_contacts(100))))
+    assert len(chunks) > 1
+    assert len(json.loads(b''.join(chunks).decode('utf-8'))['data']) == 100
+
+
+def test_export_matches_buffered_list(api_client, contacts, mongo):
+    response = api_client.simulate_get('/contacts/export')
+    expected = list(mongo.test.contacts.find().sort('_id'))
+    assert response.content == make_response('contacts', '_id', expected).encode('utf-8')
+    assert [item['id'] for item in response.json['data']] == contacts
+
+
+def test_contacts_decoded_with_str_ids_encode_alike(codec):
+    import bson
+    from bson.codec_options import CodecOptions
+    from bson.objectid import ObjectId
+    from app.repository.contacts_repository import CONTACT_TYPE_REGISTRY
+
+    data = b''.join(bson.encode(dict(contact, _id=ObjectId())) for contact in _contacts(3))
+    contacts = bson.decode_all(data, CodecOptions(type_registry=CONTACT_TYPE_REGISTRY))
+    assert all(isinstance(contact['_id'], str) for contact in contacts)
+    assert make_response('contacts', '_id', contacts) == \
+        make_response('contacts', '_id', bson.decode_all(data))
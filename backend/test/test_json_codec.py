@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import datetime
+import io
+
+import pytest
+from bson.objectid import ObjectId
+
+from app.common import json_codec
+
+
+@pytest.fixture(params=json_codec.available())
+def codec(request):
+    previous = json_codec.active()
+    yield json_codec.select(request.param)
+    json_codec.select(previous)
+
+
+def test_codecs_agree_on_documents(codec):
+    object_id = ObjectId('5970fc55f33a80de48ba7a54')
+    doc = dict(_id=object_id,
+               name='Zoë / "Ø"',
+               created=datetime.datetime(2017, 7, 20, 18, 4, 5, 123000),
+               tags=[1, 2.5, None, True])
+    assert json_codec.dumps(doc) == (
+        '{"_id":"5970fc55f33a80de48ba7a54","name":"Zoë / \\"Ø\\"",'
+        '"created":"2017-07-20T18:04:05.123000","tags":[1,2.5,null,true]}')
+
+
+def test_load_reads_streams(codec):
+    assert json_codec.load(io.BytesIO('{"a":"é"}'.encode('utf-8'))) == dict(a='é')
+
+
+def test_unknown_types_raise_but_logs_render(codec):
+    with pytest.raises(TypeError):
+        json_codec.dumps(dict(x=object()))
+    assert json_codec.render_log(None, None, dict(x=ValueError('boom'))) == \
+        '{"x":"ValueError(\'boom\')"}'
+
+
+def test_non_str_keys_written_as_strings(codec):
+    results = {0: dict(status=201), 1: dict(status=404)}
+    expected = '{"0":{"status":201},"1":{"status":404}}'
+    assert json_codec.dumps(results) == expected
+    assert json_codec.render_log(None, None, results) == expected
+
+
+def test_select_rejects_unknown_codec():
+    with pytest.raises(ValueError):
+        json_codec.select('simplejson')
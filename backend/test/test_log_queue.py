@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import io
+import threading
+
+import pytest
+import structlog
+
+from app.common import json_codec
+from app.common.log_queue import LogQueue
+
+
+class _BlockedStream(io.StringIO):
+    """ A stdout that stalls until released """
+    def __init__(self):
+        super(_BlockedStream, self).__init__()
+        self.release = threading.Event()
+
+    def write(self, text):
+        self.release.wait(5)
+        return super(_BlockedStream, self).write(text)
+
+
+@pytest.fixture
+def log_stream():
+    stream = _BlockedStream()
+    LogQueue.configure(3, 'drop', json_codec.render_log, stream)
+    yield stream
+    stream.release.set()
+    LogQueue.configure(0, 'drop', json_codec.render_log)
+
+
+def _log(message: str) -> None:
+    with pytest.raises(structlog.DropEvent):
+        LogQueue.enqueue(None, 'info', dict(logMessage=message))
+
+
+def test_log_queue_blocks_and_writes_in_order(log_stream):
+    LogQueue.configure(3, 'block', json_codec.render_log, log_stream)
+    log_stream.release.set()
+    for i in range(10):
+        _log('event {}'.format(i))
+    assert LogQueue.flush()
+    lines = log_stream.getvalue().splitlines()
+    assert [json_codec.loads(line)['logMessage'] for line in lines] == \
+        ['event {}'.format(i) for i in range(10)]
+    assert LogQueue.stats()['written'] == 10
+
+
+def test_log_queue_drops_when_full(log_stream):
+    # The writer takes the first event and stalls writing it; 3 more fill the queue
+    for i in range(6):
+        _log('event {}'.format(i))
+    stats = LogQueue.stats()
+    assert stats['dropped'] >= 2
+    log_stream.release.set()
+    assert LogQueue.flush()
+    assert LogQueue.stats()['written'] == 6 - LogQueue.stats()['dropped']
+
+
+def test_log_queue_survives_unrenderable_events(log_stream):
+    def render(logger, method_name, event_dict):
+        if event_dict['logMessage'] == 'bad':
+            raise TypeError('Dict key must be str')
+        return json_codec.render_log(logger, method_name, event_dict)
+
+    LogQueue.configure(3, 'block', render, log_stream)
+    log_stream.release.set()
+    for message in ('good', 'bad', 'good again'):
+        _log(message)
+    assert LogQueue.flush()
+    lines = [json_codec.loads(line) for line in log_stream.getvalue().splitlines()]
+    assert [line['logMessage'] for line in lines] == ['good', 'Unrenderable log record', 'good again']
+    assert "'bad'" in lines[1]['record']
+    assert LogQueue.stats()['written'] == 3
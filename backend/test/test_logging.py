@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+import calendar
+import time
+
+from app.common import json_codec
+from app.common.logging import LogEntryProcessor
+
+
+def test_timestamp_pads_millis():
+    now = calendar.timegm((2017, 7, 20, 18, 30, 5)) + 0.042
+    assert LogEntryProcessor.timestamp(now) == '2017-07-20T18:30:05.042Z'
+    assert LogEntryProcessor.timestamp(now + 1.5) == '2017-07-20T18:30:06.542Z'
+
+
+def test_timestamp_is_now():
+    stamp = LogEntryProcessor.timestamp()
+    assert stamp.startswith(time.strftime('%Y-%m-%dT', time.gmtime()))
+    assert len(stamp) == len('2017-07-20T18:30:05.042Z')
+
+
+def test_render_splices_app_info():
+    record = json_codec.loads(LogEntryProcessor.render(None, 'info', dict(logMessage='hi', a=1)))
+    assert record == dict(LogEntryProcessor.app_info(), logMessage='hi', a=1)
+    assert json_codec.loads(LogEntryProcessor.render(None, 'info', {})) == \
+        LogEntryProcessor.app_info()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+import falcon
+
+
+def test_metrics_endpoint(api_client, contacts):
+    api_client.simulate_get('/contacts/{}'.format(contacts[0]))
+    api_client.simulate_get('/nowhere')
+    response = api_client.simulate_get('/metrics')
+    assert response.status == falcon.HTTP_OK
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'http_request_duration_seconds_count{method="GET",route="/contacts/{contact_id}",' \
+           'status="200"}' in response.text
+    assert 'route="unmatched",status="404"' in response.text
+    assert 'route="/metrics"' not in response.text
+    assert 'contacts_cache_hits' in response.text
+    assert 'mongodb_pool_checkouts' in response.text
+
+
+def test_metrics_aggregate_across_processes(tmpdir):
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmpdir))
+    observe = ("from app.common import metrics; "
+               "metrics.REQUEST_DURATION.labels('/contacts', 'GET', '200').observe(0.01)")
+    for _ in range(2):
+        subprocess.check_call([sys.executable, '-c', observe], env=env)
+    output = subprocess.check_output(
+        [sys.executable, '-c', "from app.common import metrics; print(metrics.render()[0].decode())"],
+        env=env).decode()
+    assert 'http_request_duration_seconds_count{method="GET",route="/contacts",status="200"} 2.0' \
+        in output
+
+
+def test_gunicorn_conf_imports_with_missing_or_unset_dir(tmpdir):
+    missing = os.path.join(str(tmpdir), 'prometheus-metrics')
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=missing)
+    subprocess.check_call([sys.executable, '-c', 'import app.gunicorn_conf'], env=env)
+    assert os.path.isdir(missing)
+
+    env.pop('PROMETHEUS_MULTIPROC_DIR')
+    env.pop('prometheus_multiproc_dir', None)
+    subprocess.check_call([sys.executable, '-c', 'import app.gunicorn_conf'], env=env)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import falcon
+import pytest
+from falcon import testing
+
+from app import app
+from app.common.middleware import Telemetry
+
+
+@pytest.fixture
+def logged(monkeypatch):
+    """ The (message, fields) of every Telemetry log record """
+    records = []
+    monkeypatch.setattr(Telemetry, '_info', lambda _, msg, **kwargs: records.append((msg, kwargs)))
+    return records
+
+
+def _client(monkeypatch, **env):
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    return testing.TestClient(app.initialize())
+
+
+def test_log_body_truncated(mongo, contacts, logged, monkeypatch):
+    client = _client(monkeypatch, LOG_BODY_MAX_BYTES='16')
+    body = '{"city":"Kansas City","county":"Jackson"}'
+    client.simulate_patch('/contacts/{}'.format(contacts[0]), body=body)
+    received = logged[0][1]
+    assert received['reqBody'] == body[:16]
+    assert received['reqBodyBytes'] == len(body)
+    assert received['reqBodyTruncated'] is True
+
+    client.simulate_patch('/contacts/{}'.format(contacts[0]), body='{"zip":"1"}')
+    assert logged[2][1]['reqBody'] == {'zip': '1'}
+
+
+def test_log_exceptional_only(mongo, contacts, logged, monkeypatch):
+    client = _client(monkeypatch, LOG_REQUESTS='exceptional',
+                     LOG_ROUTE_SLOW_MS='/contacts/export=0')
+    client.simulate_get('/contacts/{}'.format(contacts[0]))
+    assert logged == []
+
+    client.simulate_get('/contacts/5970fc55f33a80de48ba7a54')
+    assert [msg for msg, _ in logged] == ['Request received', 'Request completed']
+    assert logged[1][1]['reqStatusCode'] == 404
+
+    client.simulate_get('/contacts/export')
+    assert logged[3][1]['reqStatusCode'] == 200
+
+
+def test_log_5xx_with_full_body_when_unsampled(mongo, contacts, logged, monkeypatch):
+    from app.controller.contacts_controller import ContactsController
+
+    def unavailable(*_):
+        raise falcon.HTTPServiceUnavailable(title='down')
+    monkeypatch.setattr(ContactsController, 'update_item', unavailable)
+    client = _client(monkeypatch, LOG_ROUTE_SAMPLE_RATES='/contacts/{contact_id}=0',
+                     LOG_BODY_MAX_BYTES='4')
+    client.simulate_get('/contacts/{}'.format(contacts[0]))
+    assert logged == []
+
+    client.simulate_patch('/contacts/{}'.format(contacts[0]), body='{"zip":"99999"}')
+    assert logged[0][1]['reqBody'] == {'zip': '99999'}
+    assert logged[1][1]['reqStatusCode'] == 503
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from app.repository.contacts_repository import ContactsRepoMongo
+from app.repository.mongo_pool import MongoPool, PoolStats
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setenv('MONGO_URI', 'mongodb://localhost:27017/')
+    monkeypatch.setenv('MONGO_MAX_POOL_SIZE', '7')
+    MongoPool.close()
+    yield MongoPool
+    MongoPool.close()
+
+
+def test_repositories_share_one_client(pool):
+    first = ContactsRepoMongo()
+    second = ContactsRepoMongo()
+    assert first._mongo is second._mongo
+    assert first._mongo is pool.client()
+    assert pool.stats()['maxPoolSize'] == 7
+
+
+def test_client_options_from_env(pool, monkeypatch):
+    monkeypatch.setenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '250')
+    options = pool.client_options()
+    assert options['maxPoolSize'] == 7
+    assert options['waitQueueTimeoutMS'] == 250
+    assert 'maxIdleTimeMS' not in options
+    # Long bulk, index and stream operations must not be cut off by the socket
+    assert 'socketTimeoutMS' not in options
+
+
+def test_missing_uri_raises(monkeypatch):
+    monkeypatch.delenv('MONGO_URI', raising=False)
+    with pytest.raises(ValueError):
+        MongoPool.uri()
+
+
+def test_pool_stats_counts_checkouts():
+    stats = PoolStats()
+    stats.connection_created(None)
+    stats.connection_check_out_started(None)
+    stats.connection_checked_out(None)
+    assert stats.as_dict()['checkedOut'] == 1
+    stats.connection_checked_in(None)
+    stats.connection_check_out_started(None)
+    stats.connection_check_out_failed(None)
+
+    result = stats.as_dict()
+    assert result['checkedOut'] == 0
+    assert result['checkouts'] == 1
+    assert result['checkoutFailures'] == 1
+    assert result['connectionsCreated'] == 1
+    assert result['connectionsOpen'] == 1
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+
+import falcon
+from falcon import testing
+
+from app import app
+
+AUTH = {'Authorization': 'Bearer secret'}
+
+
+def _client(monkeypatch, token='secret'):
+    if token:
+        monkeypatch.setenv('PROFILER_TOKEN', token)
+    return testing.TestClient(app.initialize())
+
+
+def _busy(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profile_disabled_without_token(mongo, monkeypatch):
+    monkeypatch.delenv('PROFILER_TOKEN', raising=False)
+    client = _client(monkeypatch, token=None)
+    assert client.simulate_get('/profile').status == falcon.HTTP_NOT_FOUND
+
+
+def test_profile_requires_token(mongo, monkeypatch):
+    client = _client(monkeypatch)
+    assert client.simulate_get('/profile').status == falcon.HTTP_UNAUTHORIZED
+    assert client.simulate_get('/profile', headers={'Authorization': 'Bearer guess'}).status == \
+        falcon.HTTP_UNAUTHORIZED
+    assert client.simulate_get('/profile', query_string='seconds=60', headers=AUTH).status == \
+        falcon.HTTP_BAD_REQUEST
+
+
+def test_profile_samples_other_threads(mongo, monkeypatch):
+    client = _client(monkeypatch)
+    stop = threading.Event()
+    busy = threading.Thread(target=_busy, args=(stop,), name='busy')
+    busy.start()
+    try:
+        result = client.simulate_get('/profile', query_string='seconds=0.2&top=500', headers=AUTH)
+        collapsed = client.simulate_get('/profile', query_string='seconds=0.1&format=collapsed',
+                                        headers=AUTH)
+    finally:
+        stop.set()
+        busy.join()
+
+    profile = json.loads(result.text)['data']['attributes']
+    assert profile['samples'] > 0
+    assert profile['top'][0]['cumulativeSec'] >= profile['top'][-1]['cumulativeSec']
+    assert any(item['function'].startswith('_busy (') for item in profile['top'])
+    assert collapsed.headers['content-type'].startswith('text/plain')
+    line = next(line for line in collapsed.text.splitlines() if line.startswith('busy;'))
+    assert '_busy (' in line
+    assert int(line.rsplit(' ', 1)[1]) > 0
+
+
+def test_request_profiled(mongo, contacts, monkeypatch):
+    client = _client(monkeypatch)
+    path = '/contacts/{}'.format(contacts[0])
+    assert json.loads(client.simulate_get(path, headers={'X-Profile': '1'}).text)['data']
+
+    result = client.simulate_get(path, headers=dict(AUTH, **{'X-Profile': '1'}))
+    assert result.status == falcon.HTTP_OK
+    assert result.headers['content-type'].startswith('text/plain')
+    assert 'cumulative' in result.text
+    assert 'get_item' in result.text
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Reads through raw BSON batches (CONTACTS_RAW_READS=1) serve the same responses.
+
+mongomock has no find_raw_batches; here it encodes the contacts its find
+cursor returns into batches of BSON, as the server sends them.
+"""
+import bson
+import falcon
+import mongomock
+import pytest
+from falcon import testing
+
+from app import app, asgi
+
+QUERIES = (('/contacts', 'page[size]=10'),
+           ('/contacts', 'page[size]=1000'),
+           ('/contacts', 'page[size]=3&page[after]={after}'),
+           ('/contacts', 'filter[state]=MO,NY&sort=-lastName&fields[contacts]=zip,state&page[size]=4'),
+           ('/contacts/export', None))
+
+
+def _encode(contact: dict) -> bytes:
+    """ contact as BSON in its field order; bson.encode would move _id first """
+    # An embedded document keeps its order: int32 size, type, 'c\0', document, '\0'
+    return bson.encode(dict(c=contact))[7:-1]
+
+
+class _RawBatches:
+    """ A find cursor's contacts in raw BSON batches """
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._batch_size = 101
+
+    def sort(self, *args, **kwargs):
+        self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, limit: int):
+        self._cursor.limit(limit)
+        return self
+
+    def batch_size(self, batch_size: int):
+        self._batch_size = batch_size
+        return self
+
+    def __iter__(self):
+        contacts = list(self._cursor)
+        for start in range(0, len(contacts), self._batch_size):
+            yield b''.join(_encode(contact) for contact in contacts[start:start + self._batch_size])
+
+    def __aiter__(self):
+        return self._iter_async()
+
+    async def _iter_async(self):
+        for batch in self:
+            yield batch
+
+
+@pytest.fixture
+def raw_batches(monkeypatch):
+    monkeypatch.setattr(mongomock.collection.Collection, 'find_raw_batches',
+                        lambda self, *args, **kwargs: _RawBatches(self.find(*args, **kwargs)),
+                        raising=False)
+
+
+def _responses(client, contacts) -> list:
+    responses = []
+    for path, query in QUERIES:
+        response = client.simulate_get(path, query_string=query and query.format(after=contacts[7]))
+        assert response.status == falcon.HTTP_OK
+        responses.append((response.content, response.headers.get('etag')))
+    return responses
+
+
+def test_raw_reads_match(api_client, contacts, raw_batches, monkeypatch):
+    expected = _responses(api_client, contacts)
+    monkeypatch.setenv('CONTACTS_RAW_READS', '1')
+    assert _responses(testing.TestClient(app.initialize()), contacts) == expected
+
+
+def test_raw_reads_match_asgi(api_client, asgi_client, contacts, raw_batches, monkeypatch):
+    expected = _responses(api_client, contacts)
+    monkeypatch.setenv('CONTACTS_RAW_READS', '1')
+    assert _responses(testing.TestClient(asgi.initialize()), contacts) == expected
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+
+import falcon
+import mongomock
+import pytest
+from falcon import testing
+from pymongo import errors as pymongoErrors
+
+from app import app
+from app.repository.contacts_repository import ContactsRepoMongo
+from app.repository.resilience import CircuitBreaker, Resilience
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    """ A fresh breaker opening after 2 failures for 50ms, and quick retries """
+    result = CircuitBreaker(2, 0.05)
+    monkeypatch.setattr(Resilience, 'BREAKER', result)
+    monkeypatch.setattr(Resilience, 'RETRY_BACKOFF_MS', 1.0)
+    return result
+
+
+def _failing(monkeypatch, name: str, failures: int):
+    """ Make the contacts collection's method fail failures times, then work """
+    calls = []
+    original = getattr(mongomock.Collection, name)
+
+    def flaky(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) <= failures:
+            raise pymongoErrors.AutoReconnect('connection reset')
+        return original(self, *args, **kwargs)
+    monkeypatch.setattr(mongomock.Collection, name, flaky)
+    return calls
+
+
+def test_reads_retried(mongo, contacts, breaker, monkeypatch):
+    calls = _failing(monkeypatch, 'find_one', 1)
+    assert str(ContactsRepoMongo().get_item(None, contacts[0])['_id']) == contacts[0]
+    assert len(calls) == 2
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_writes_not_retried(mongo, contacts, breaker, monkeypatch):
+    calls = _failing(monkeypatch, 'delete_one', 1)
+    with pytest.raises(falcon.HTTPServiceUnavailable):
+        ContactsRepoMongo().delete_item(None, contacts[0])
+    assert len(calls) == 1
+
+
+def test_breaker_fails_fast_then_probes(mongo, contacts, breaker, monkeypatch):
+    calls = _failing(monkeypatch, 'find_one', 3)
+    repo = ContactsRepoMongo()
+    with pytest.raises(falcon.HTTPServiceUnavailable):
+        repo.get_item(None, contacts[0])
+    assert breaker.state == CircuitBreaker.OPEN
+    assert len(calls) == 2
+
+    with pytest.raises(falcon.HTTPServiceUnavailable) as failed_fast:
+        repo.get_item(None, contacts[0])
+    assert len(calls) == 2
+    assert failed_fast.value.headers['Retry-After'] == '1'
+
+    time.sleep(0.06)
+    with pytest.raises(falcon.HTTPServiceUnavailable):
+        repo.get_item(None, contacts[0])  # the probe fails; open again
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    assert repo.get_item(None, contacts[0])
+    assert breaker.stats() == dict(state='closed', open=False, consecutiveFailures=0,
+                                   opened=2, rejected=1)
+
+
+def test_bad_id_does_not_close_half_open_breaker(mongo, contacts, breaker, monkeypatch):
+    calls = _failing(monkeypatch, 'find_one', 2)
+    repo = ContactsRepoMongo()
+    with pytest.raises(falcon.HTTPServiceUnavailable):
+        repo.get_item(None, contacts[0])
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    with pytest.raises(falcon.HTTPBadRequest):
+        repo.get_item(None, 'not-an-id')  # never reaches the datastore
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert len(calls) == 2
+    # The next operation probes
+    assert repo.get_item(None, contacts[0])
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_budget_bounds_operations(mongo, contacts, breaker, monkeypatch):
+    token = Resilience.start_budget(500)
+    try:
+        monkeypatch.setattr(Resilience, 'OPERATION_TIMEOUT_MS', 2000)
+        assert 400 < Resilience.operation_timeout_ms() <= 500
+    finally:
+        Resilience.end_budget(token)
+    assert Resilience.operation_timeout_ms() == 2000
+
+    token = Resilience.start_budget(0)
+    try:
+        with pytest.raises(falcon.HTTPGatewayTimeout):
+            ContactsRepoMongo().get_item(None, contacts[0])
+    finally:
+        Resilience.end_budget(token)
+
+
+def test_readiness_reports_breaker(mongo, breaker, monkeypatch):
+    monkeypatch.setenv('REQUEST_BUDGET_MS', '0')
+    client = testing.TestClient(app.initialize())
+    assert client.simulate_get('/contacts/5970fc55f33a80de48ba7a54').status == \
+        falcon.HTTP_GATEWAY_TIMEOUT
+    breaker.failed()
+    breaker.failed()
+    readiness = json.loads(client.simulate_get('/readiness').text)['data']['attributes']
+    assert readiness['mongodbBreaker']['state'] == 'open'
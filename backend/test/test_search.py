@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import falcon
+import pytest
+
+from app.common.search_index import SearchIndex
+
+
+def _search(api_client, query: str) -> dict:
+    response = api_client.simulate_get('/contacts/search', query_string=query)
+    assert response.status == falcon.HTTP_OK
+    return response.json
+
+
+def _names(body: dict) -> list:
+    return [item['attributes']['lastName'] for item in body['data']]
+
+
+def test_search_ranks_and_pages(api_client, contacts):
+    body = _search(api_client, 'q=last1&page[size]=5')
+    assert body['meta']['total'] == 11
+    assert _names(body) == ['Last1', 'Last10', 'Last11', 'Last12', 'Last13']
+    assert set(body['data'][0]['attributes']) == {'_id', 'firstName', 'lastName', 'companyName',
+                                                  'city', 'email'}
+    assert body['data'][0]['id'] == contacts[1]
+
+    path, query = body['links']['next'].split('?')
+    body = _search(api_client, query)
+    assert _names(body) == ['Last14', 'Last15', 'Last16', 'Last17', 'Last18']
+    body = _search(api_client, body['links']['next'].split('?')[1])
+    assert _names(body) == ['Last19'] and 'links' not in body
+
+    # Every word must match; emails are split into words
+    assert _names(_search(api_client, 'q=LAST1+city3')) == ['Last10', 'Last17']
+    assert _names(_search(api_client, 'q=contact7%40ex')) == ['Last7']
+    assert _search(api_client, 'q=nobody')['meta']['total'] == 0
+
+
+def test_search_follows_writes(api_client, contacts):
+    _search(api_client, 'q=anything')  # build the index
+    created = api_client.simulate_post('/contacts', json={'firstName': 'Zebulon', 'lastName': 'Quux'})
+    contact_id = created.json['data']['id']
+    assert _names(_search(api_client, 'q=zeb')) == ['Quux']
+
+    api_client.simulate_patch('/contacts/' + contact_id, json={'lastName': 'Quuxley'})
+    assert _names(_search(api_client, 'q=zeb+quuxl')) == ['Quuxley']
+
+    api_client.simulate_delete('/contacts/' + contact_id)
+    assert _search(api_client, 'q=zeb')['meta']['total'] == 0
+
+    api_client.simulate_post('/contacts/bulk', json={'atomic:operations': [
+        {'op': 'update', 'ref': {'id': contacts[2]}, 'data': {'attributes': {'city': 'Yonkers'}}},
+        {'op': 'remove', 'ref': {'id': contacts[3]}}]})
+    assert _names(_search(api_client, 'q=yonk')) == ['Last2']
+    assert _search(api_client, 'q=last3')['meta']['total'] == 0
+
+
+@pytest.mark.parametrize('query', ['', 'q=' + 'a' * 101, 'q=a&page[offset]=-1'])
+def test_search_validates_params(api_client, query):
+    response = api_client.simulate_get('/contacts/search', query_string=query)
+    assert response.status == falcon.HTTP_BAD_REQUEST
+
+
+def test_rebuild_keeps_concurrent_writes():
+    index = SearchIndex(dict(lastName=1.0))
+    index.add('a', {'lastName': 'Adams'})
+    with index.rebuilding() as load:
+        index.remove('a')
+        index.add('b', {'lastName': 'Baker'})
+        load('a', {'lastName': 'Adams'})   # read before the remove
+        load('b', {'lastName': 'Brown'})   # read before the add
+        load('c', {'lastName': 'Clark'})
+        assert index.search('adams', 10)[0] == 0
+    assert [doc['lastName'] for doc in index.search('b', 10)[1]] == ['Baker']
+    assert index.search('a', 10)[0] == 0
+    assert index.search('clark', 10)[0] == 1
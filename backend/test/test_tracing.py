@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+from types import SimpleNamespace
+
+from falcon import testing
+
+from app import app
+from app.common import tracing
+from app.common.logging import LogEntryProcessor
+from app.repository.mongo_pool import CommandTimer
+
+TRACEPARENT = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+
+
+def _timings(header: str) -> dict:
+    return dict(item.split(';dur=') for item in header.split(', '))
+
+
+def test_request_traced(mongo, contacts, monkeypatch, tmpdir):
+    export = tmpdir.join('spans.jsonl')
+    monkeypatch.setenv('TRACE_EXPORT_FILE', str(export))
+    client = testing.TestClient(app.initialize())
+    result = client.simulate_patch('/contacts/{}'.format(contacts[0]), body='{"zip":"1"}',
+                                   headers={'x-request-id': 'abc', 'traceparent': TRACEPARENT})
+    assert result.status_code == 200
+    assert result.headers['x-request-id'] == 'abc'
+    assert result.headers['traceparent'].startswith('00-0af7651916cd43dd8448eb211c80319c-')
+    timings = _timings(result.headers['server-timing'])
+    assert {'parse', 'controller.update_item', 'encode', 'log', 'total'} <= set(timings)
+
+    request = json.loads(export.read())
+    spans = request['resourceSpans'][0]['scopeSpans'][0]['spans']
+    root, children = spans[0], {span['name']: span for span in spans[1:]}
+    assert root['name'] == 'PATCH /contacts/{contact_id}'
+    assert root['parentSpanId'] == 'b7ad6b7169203331'
+    assert children['controller.update_item']['parentSpanId'] == root['spanId']
+    assert int(root['startTimeUnixNano']) <= int(children['parse']['startTimeUnixNano'])
+    assert LogEntryProcessor.get_request_id() is None
+    assert tracing.current() is None
+
+
+def test_probes_not_traced(mongo, monkeypatch):
+    monkeypatch.setenv('TRACE_SERVER_TIMING', '0')
+    client = testing.TestClient(app.initialize())
+    assert 'traceparent' not in client.simulate_get('/liveness').headers
+    result = client.simulate_get('/contacts/5970fc55f33a80de48ba7a54')
+    assert result.status_code == 404
+    assert 'server-timing' not in result.headers
+    assert result.headers['x-request-id']
+
+
+def test_mongo_commands_recorded_as_spans():
+    trace = tracing.start('test')
+    with tracing.span('controller.get_item'):
+        CommandTimer().succeeded(SimpleNamespace(command_name='find', database_name='contacts',
+                                                 duration_micros=2500))
+    tracing.finish(trace)
+    mongo_span, controller = trace.spans
+    assert mongo_span.name == 'mongo.find'
+    assert mongo_span.parent_id == controller.span_id
+    assert round(mongo_span.duration, 4) == 0.0025
+
+
+def test_concurrent_tasks_have_own_traces():
+    async def request(name):
+        trace = tracing.start(name)
+        await asyncio.sleep(0)
+        with tracing.span(name + '.work'):
+            await asyncio.sleep(0)
+        tracing.finish(trace)
+        return trace
+
+    async def both():
+        return await asyncio.gather(request('a'), request('b'))
+
+    first, second = asyncio.new_event_loop().run_until_complete(both())
+    assert [span.name for span in first.spans] == ['a.work']
+    assert [span.name for span in second.spans] == ['b.work']
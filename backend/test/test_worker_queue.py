@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import queue
+import threading
+
+from app.common.worker_queue import WorkerQueue
+
+
+def _collect(handled: list):
+    def drain(items: queue.Queue) -> None:
+        while True:
+            item = items.get()
+            if isinstance(item, threading.Event):
+                item.set()
+            else:
+                handled.append(item)
+    return drain
+
+
+def test_flush_waits_for_items_queued_before():
+    handled = []
+    writer = WorkerQueue('test-writer', _collect(handled))
+    assert writer.flush(1)
+    items = writer.queue(lambda: 10)
+    for i in range(5):
+        items.put(i)
+    assert writer.flush(1)
+    assert handled == list(range(5))
+    assert writer.qsize() == 0
+
+
+def _use_after_fork(writer: WorkerQueue, handled: list, done) -> None:
+    writer.queue(lambda: 10).put('child')
+    if writer.flush(1) and handled == ['parent', 'child']:
+        done.set()
+
+
+def test_forked_process_gets_own_queue_and_thread():
+    handled = []
+    writer = WorkerQueue('test-writer', _collect(handled))
+    writer.queue(lambda: 10).put('parent')
+    assert writer.flush(1)
+
+    # The parent's thread is not running in the child: the child must start its own
+    context = multiprocessing.get_context('fork')
+    done = context.Event()
+    child = context.Process(target=_use_after_fork, args=(writer, handled, done))
+    child.start()
+    child.join(10)
+    assert done.is_set()
+    assert handled == ['parent']
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import falcon
+import mongomock
+import pytest
+from falcon import testing
+from pymongo import errors as pymongoErrors
+
+from app import app
+from app.repository.write_behind import InsertQueue
+from test.conftest import make_contact
+
+
+@pytest.fixture
+def writes(mongo, monkeypatch):
+    """ An app queueing creates, with batches cut by size or flush() only """
+    monkeypatch.setenv('CONTACTS_WRITE_BEHIND', '1')
+    monkeypatch.setenv('WRITE_BEHIND_FLUSH_MS', '60000')
+    monkeypatch.setenv('WRITE_BEHIND_RETRIES', '1')
+    InsertQueue.reset()
+    yield testing.TestClient(app.initialize())
+    InsertQueue.reset()
+
+
+def _post(client: testing.TestClient, i: int) -> testing.Result:
+    return client.simulate_post('/contacts', json=make_contact(i))
+
+
+def _insert_many_failing(monkeypatch, failures: int) -> list:
+    calls = []
+    original = mongomock.Collection.insert_many
+
+    def flaky(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) <= failures:
+            raise pymongoErrors.AutoReconnect('connection reset')
+        return original(self, *args, **kwargs)
+    monkeypatch.setattr(mongomock.Collection, 'insert_many', flaky)
+    return calls
+
+
+def test_creates_batched(writes, mongo):
+    ids = []
+    for i in range(5):
+        result = _post(writes, i)
+        assert result.status == falcon.HTTP_ACCEPTED
+        ids.append(result.json['data']['id'])
+        assert result.json['links']['status'].endswith('/contacts/writes?id=' + ids[-1])
+    assert writes.simulate_get('/contacts/writes', params=dict(id=ids[0])).json[
+        'data']['attributes']['status'] == 'pending'
+
+    assert InsertQueue.flush()
+    assert sorted(str(doc['_id']) for doc in mongo.test.contacts.find()) == sorted(ids)
+    assert writes.simulate_get('/contacts/' + ids[0]).json['data']['attributes']['firstName'] == \
+        'First0'
+    stats = InsertQueue.stats()
+    assert stats['written'] == 5 and stats['batches'] == 1 and stats['queued'] == 0
+
+
+def test_full_queue_refuses_creates(writes, mongo, monkeypatch):
+    monkeypatch.setenv('WRITE_BEHIND_QUEUE_SIZE', '1')
+    monkeypatch.setenv('WRITE_BEHIND_BATCH_SIZE', '1')
+    InsertQueue.reset()
+    release = threading.Event()
+    insert_many = mongomock.Collection.insert_many
+    monkeypatch.setattr(mongomock.Collection, 'insert_many',
+                        lambda self, *args, **kwargs: release.wait(5) and insert_many(self, *args, **kwargs))
+
+    assert _post(writes, 0).status == falcon.HTTP_ACCEPTED
+    while InsertQueue.stats()['queued']:
+        time.sleep(0.001)  # the writer takes the first contact, then waits on release
+    assert _post(writes, 1).status == falcon.HTTP_ACCEPTED
+    refused = _post(writes, 2)
+    assert refused.status == falcon.HTTP_SERVICE_UNAVAILABLE
+    assert refused.headers['Retry-After'] == '1'
+
+    release.set()
+    assert InsertQueue.flush()
+    assert mongo.test.contacts.count_documents({}) == 2
+
+
+def test_connection_errors_retried(writes, mongo, monkeypatch):
+    calls = _insert_many_failing(monkeypatch, 1)
+    contact_id = _post(writes, 0).json['data']['id']
+    assert InsertQueue.flush()
+    assert len(calls) == 2
+    assert mongo.test.contacts.count_documents({}) == 1
+    assert InsertQueue.stats()['retried'] == 1
+    assert InsertQueue.status(contact_id) == 'unknown'
+
+
+def test_failed_writes_reported(writes, mongo, monkeypatch):
+    _insert_many_failing(monkeypatch, 2)
+    contact_id = _post(writes, 0).json['data']['id']
+    assert InsertQueue.flush()
+    assert mongo.test.contacts.count_documents({}) == 0
+
+    report = writes.simulate_get('/contacts/writes', params=dict(id=contact_id)).json
+    attributes = report['data']['attributes']
+    assert attributes['status'] == 'failed'
+    assert attributes['failed'] == 1
+    assert attributes['failures'][0]['id'] == contact_id
+    assert attributes['failures'][0]['error'] == 'connection reset'
+
+
+@pytest.mark.parametrize('error', [pymongoErrors.OperationFailure('not authorized', 13),
+                                   ValueError('unexpected')])
+def test_other_errors_fail_batch_and_keep_writer(writes, mongo, monkeypatch, error):
+    writes.simulate_get('/contacts/search', query_string='q=anything')  # build the index
+    insert_many = mongomock.Collection.insert_many
+    calls = []
+
+    def failing_once(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise error
+        return insert_many(self, *args, **kwargs)
+    monkeypatch.setattr(mongomock.Collection, 'insert_many', failing_once)
+
+    contact_id = _post(writes, 0).json['data']['id']
+    assert _search_ids(writes, 'q=first0') == [contact_id]
+    assert InsertQueue.flush(timeout=5)
+    assert len(calls) == 1
+    assert InsertQueue.status(contact_id) == 'failed'
+    assert InsertQueue.stats()['failed'] == 1
+    # The contact can't be fetched, so search must not find it
+    assert _search_ids(writes, 'q=first0') == []
+
+    # The writer is still running
+    written_id = _post(writes, 1).json['data']['id']
+    assert InsertQueue.flush(timeout=5)
+    assert InsertQueue.status(written_id) == 'unknown'
+    assert mongo.test.contacts.count_documents({}) == 1
+
+
+def _search_ids(client: testing.TestClient, query: str) -> list:
+    return [item['id'] for item in client.simulate_get('/contacts/search', query_string=query).json['data']]
+
+
+def test_creates_immediate_by_default(api_client):
+    assert _post(api_client, 0).status == falcon.HTTP_CREATED